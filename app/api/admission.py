@@ -0,0 +1,112 @@
+import os
+import math
+import time
+import logging
+from collections import OrderedDict
+
+from fastapi import HTTPException, Request
+
+from app.metrics import rejected_total
+
+logger = logging.getLogger(__name__)
+
+# Per-client token bucket: sustained generations per minute and burst size.
+# A rate of 0 disables rate limiting.
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "30"))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "10"))
+# Bound on tracked clients; the least recently seen are forgotten first
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "10000"))
+# Behind a reverse proxy, identify clients by the address the proxy appended
+# to X-Forwarded-For (the last one; earlier entries come from the client)
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "0") != "0"
+# Comma-separated API keys that get a bucket of their own; any other
+# X-API-Key is ignored, since a client could send a new one every request
+API_KEYS = frozenset(key.strip() for key in os.getenv("API_KEYS", "").split(",") if key.strip())
+
+
+class TokenBucket:
+    """Refills `rate` tokens per second up to `capacity`"""
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def take(self, cost: float = 1.0) -> float:
+        """
+        Take `cost` tokens. Returns 0 on success, otherwise the seconds until
+        enough tokens will have accumulated (nothing is taken then). A cost
+        above the capacity is taken from a full bucket, leaving it in debt
+        until the refill has paid for it.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        needed = min(cost, self.capacity)
+        if self.tokens >= needed:
+            self.tokens -= cost
+            return 0.0
+        return (needed - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Token buckets per client id, bounded to `max_clients` entries (LRU)"""
+    def __init__(self, per_minute: float = RATE_LIMIT_PER_MINUTE, burst: int = RATE_LIMIT_BURST,
+                 max_clients: int = RATE_LIMIT_MAX_CLIENTS):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.max_clients = max_clients
+        self.buckets = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def check(self, client: str, cost: float = 1.0) -> float:
+        """0 if the client may proceed, else seconds to wait"""
+        if not self.enabled:
+            return 0.0
+        bucket = self.buckets.get(client)
+        if bucket is None:
+            bucket = self.buckets[client] = TokenBucket(self.rate, self.burst)
+            if len(self.buckets) > self.max_clients:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(client)
+        return bucket.take(cost)
+
+
+rate_limiter = RateLimiter()
+
+
+def client_id(request: Request) -> str:
+    """Identify the caller: a known API key if one is sent, otherwise the client address"""
+    api_key = request.headers.get("x-api-key")
+    if api_key and api_key in API_KEYS:
+        return f"key:{api_key}"
+    if TRUST_FORWARDED_FOR:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[-1].strip()
+    return request.client.host if request.client else "unknown"
+
+
+def admit(request: Request, cost: float = 1.0):
+    """
+    Charge a generation to the caller's token bucket, or reject it with
+    429 and a Retry-After header
+    """
+    wait = rate_limiter.check(client_id(request), cost)
+    if wait > 0:
+        rejected_total.inc(reason="rate_limited")
+        retry_after = max(1, math.ceil(wait))
+        logger.info(f"Rate limited {client_id(request)} for {retry_after}s")
+        raise HTTPException(status_code=429, detail="Rate limit exceeded",
+                            headers={"Retry-After": str(retry_after)})
+
+
+def overloaded(error) -> HTTPException:
+    """429 for a full job queue (load shedding), with the queue's Retry-After estimate"""
+    rejected_total.inc(reason="queue_full")
+    return HTTPException(status_code=429, detail=str(error),
+                         headers={"Retry-After": str(error.retry_after)})
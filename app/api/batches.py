@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+
+from app.api.pipeline import generate_scene
+from app.api.prompt_cache import normalize_prompt
+from app.workers.jobs import job_manager, QueueFullError
+
+logger = logging.getLogger(__name__)
+
+BATCH_MAX_PROMPTS = int(os.getenv("BATCH_MAX_PROMPTS", "5000"))
+# Jobs a single batch keeps queued or running at once
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_TTL_SECONDS = int(os.getenv("BATCH_TTL_SECONDS", str(24 * 3600)))
+
+
+class BatchItem:
+    """One unique prompt of a batch and every position it appeared at"""
+    def __init__(self, prompt: str, indices: list):
+        self.prompt = prompt
+        self.indices = indices
+        self.status = "pending"
+        self.job_id = None
+        self.result = None
+        self.error = None
+
+    def to_dict(self) -> dict:
+        return {
+            "indices": self.indices,
+            "prompt": self.prompt,
+            "status": self.status,
+            "job_id": self.job_id,
+            "result": self.result.model_dump() if self.result is not None else None,
+            "error": self.error,
+        }
+
+
+class Batch:
+    """
+    A set of prompts generated in the background. Finished items are kept
+    in completion order so any number of readers can (re)attach and get
+    every result exactly once.
+    """
+    def __init__(self, batch_id: str, prompts: list, progressive: bool):
+        self.id = batch_id
+        self.progressive = progressive
+        self.total = len(prompts)
+        self.created_at = time.time()
+        self.finished_at = None
+        self.task = None
+
+        unique = {}
+        for index, prompt in enumerate(prompts):
+            key = normalize_prompt(prompt)
+            if key in unique:
+                unique[key].indices.append(index)
+            else:
+                unique[key] = BatchItem(prompt, [index])
+        self.items = list(unique.values())
+        self.completed = []
+        self._changed = asyncio.Condition()
+
+    @property
+    def done(self) -> bool:
+        return len(self.completed) == len(self.items)
+
+    def summary(self) -> dict:
+        return {
+            "batch": self.id,
+            "prompts": self.total,
+            "unique": len(self.items),
+            "completed": len(self.completed),
+            "done": self.done,
+        }
+
+    async def finish(self, item: BatchItem):
+        async with self._changed:
+            self.completed.append(item)
+            if self.done:
+                self.finished_at = time.time()
+            self._changed.notify_all()
+
+    async def lines(self):
+        """
+        NDJSON stream: a summary line, then one line per unique prompt in
+        completion order (results that are already done come first)
+        """
+        yield json.dumps(self.summary()) + "\n"
+        position = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: position < len(self.completed) or self.done)
+                ready = self.completed[position:]
+            for item in ready:
+                yield json.dumps(item.to_dict()) + "\n"
+            position += len(ready)
+            if position == len(self.items):
+                return
+
+
+class BatchManager:
+    """
+    Runs batches on the job manager's batch lane with at most
+    `concurrency` jobs per batch in flight, so offline work cannot crowd
+    out interactive requests.
+
+    Batches are kept in memory, as the jobs running them are: a restart
+    loses unfinished batches along with their jobs, and behind a load
+    balancer a batch must be resumed on the process that created it.
+    """
+    def __init__(self, concurrency: int = BATCH_CONCURRENCY):
+        self.concurrency = concurrency
+        self.batches = {}
+
+    def create(self, prompts: list, progressive: bool = False) -> Batch:
+        self._prune()
+        batch = Batch(uuid.uuid4().hex[:12], prompts, progressive)
+        self.batches[batch.id] = batch
+        batch.task = job_manager.spawn(self._schedule(batch))
+        logger.info(f"Batch {batch.id}: {batch.total} prompts, {len(batch.items)} unique")
+        return batch
+
+    def get(self, batch_id: str):
+        return self.batches.get(batch_id)
+
+    def cancel(self, batch: Batch):
+        if batch.task and not batch.task.done():
+            batch.task.cancel()
+
+    async def _schedule(self, batch: Batch):
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def run(item: BatchItem):
+            async with slots:
+                await self._run_item(batch, item)
+
+        tasks = [asyncio.ensure_future(run(item)) for item in batch.items]
+        try:
+            await asyncio.gather(*tasks)
+        except asyncio.CancelledError:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # Readers are waiting for every item; report the ones that never finished
+            for item in batch.items:
+                if item.status in ("pending", "running"):
+                    item.status = "cancelled"
+                    item.error = "Batch cancelled"
+                    await batch.finish(item)
+            raise
+
+    async def _run_item(self, batch: Batch, item: BatchItem):
+        job = None
+        try:
+            while job is None:
+                try:
+                    job = job_manager.submit(
+                        item.prompt,
+                        lambda job: generate_scene(job.id, job.prompt, progressive=batch.progressive),
+                        "batch"
+                    )
+                except QueueFullError as e:
+                    # The batch lane is saturated by other batches: wait our turn
+                    await asyncio.sleep(e.retry_after)
+            item.job_id = job.id
+            item.status = "running"
+            await asyncio.wait({job.task})
+            if job.status == "completed":
+                item.result = job.result
+                item.status = "completed" if job.result.success else "failed"
+                item.error = job.result.error
+            else:
+                item.status = "failed"
+                item.error = job.error or job.status
+        except asyncio.CancelledError:
+            if job is not None and not job.task.done():
+                job.task.cancel()
+            raise
+        await batch.finish(item)
+
+    def _prune(self):
+        """Forget batches that finished more than BATCH_TTL_SECONDS ago"""
+        cutoff = time.time() - BATCH_TTL_SECONDS
+        expired = [batch_id for batch_id, batch in self.batches.items()
+                   if batch.finished_at and batch.finished_at < cutoff]
+        for batch_id in expired:
+            del self.batches[batch_id]
+
+
+batch_manager = BatchManager()
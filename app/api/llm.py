@@ -1,11 +1,32 @@
 import os
+import json
+import asyncio
+import hashlib
+import logging
 import httpx
 from dotenv import load_dotenv
 
+from app.metrics import llm_tokens, timeouts_total, fallbacks_total
+from app.deadlines import budget, DeadlineExceeded
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 OPENROUTER_MODEL = os.getenv("OPENROUTER_MODEL", "deepseek-r1:free")
+OPENROUTER_URL = os.getenv("OPENROUTER_URL", "https://openrouter.ai/api/v1/chat/completions")
+
+# Shared connection pool settings
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30"))
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "1") != "0"
+# Global cap on LLM calls in flight, so bursts queue here instead of
+# tripping OpenRouter's rate limits
+LLM_MAX_CONCURRENT_CALLS = int(os.getenv("LLM_MAX_CONCURRENT_CALLS", "16"))
+# Longest an LLM call may take; less when the request's deadline is closer
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
 
 SYSTEM_PROMPT = """You are an expert Manim script writer.
 Return valid Python 3.11 code that imports from manim, defines
@@ -13,18 +34,129 @@ class Scene0(Scene) with construct().
 The scene must run in ≤ 15 seconds, 1920×1080, and use only core Manim primitives.
 Respond with code only."""
 
-async def get_manim_code_from_llm(prompt: str) -> str:
+_client = None
+_inflight = {}
+_call_slots = asyncio.Semaphore(LLM_MAX_CONCURRENT_CALLS)
+
+def start_client() -> httpx.AsyncClient:
     """
-    Sends a prompt to the LLM via OpenRouter API and gets Manim code in return
+    Create the shared OpenRouter client; called on application startup.
+    Connections are kept alive and reused across requests.
     """
-    if not OPENROUTER_API_KEY:
-        raise ValueError("OpenRouter API key not found in environment variables")
+    global _client
+    if _client is None:
+        http2 = LLM_HTTP2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("h2 is not installed; using HTTP/1.1 for LLM requests")
+                fallbacks_total.inc(kind="http1")
+                http2 = False
+        _client = httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=LLM_KEEPALIVE_EXPIRY
+            ),
+            timeout=LLM_TIMEOUT
+        )
+    return _client
+
+async def close_client():
+    """Close the shared client; called on application shutdown"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+def _timeout() -> float:
+    """
+    Timeout for an LLM call starting now; raises DeadlineExceeded if the
+    request has too little time left to start one
+    """
+    return budget(LLM_TIMEOUT, "llm")
+
+def _timed_out(timeout: float, error: Exception):
+    """Count an LLM timeout; one cut short by the request deadline is reported as such"""
+    timeouts_total.inc(stage="llm")
+    if timeout < LLM_TIMEOUT:
+        raise DeadlineExceeded("llm") from error
+    raise error
+
+def _record_usage(call: str, usage: dict):
+    """Observe token counts reported by the API for one call"""
+    for kind in ("prompt_tokens", "completion_tokens"):
+        if usage.get(kind) is not None:
+            llm_tokens.observe(usage[kind], call=call, kind=kind[:-len("_tokens")])
+
+async def _post_completion(headers: dict, data: dict, call: str) -> str:
+    async with _call_slots:
+        # Budgeted once a slot is free, so time spent waiting for it counts
+        timeout = _timeout()
+        try:
+            response = await start_client().post(
+                OPENROUTER_URL, 
+                headers=headers, 
+                json=data,
+                timeout=timeout
+            )
+        except httpx.TimeoutException as e:
+            _timed_out(timeout, e)
+    
+    if response.status_code != 200:
+        raise Exception(f"API request failed with status {response.status_code}: {response.text}")
         
-    headers = {
+    result = response.json()
+    _record_usage(call, result.get("usage") or {})
+    return result["choices"][0]["message"]["content"]
+
+async def _chat_completion(headers: dict, data: dict, call: str) -> str:
+    """
+    POST a chat completion, coalescing concurrent identical requests so
+    they share a single upstream call (single-flight). The call is
+    cancelled once every caller waiting for it has been cancelled.
+    """
+    key = hashlib.sha256(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+    flight = _inflight.get(key)
+    if flight is None:
+        task = asyncio.ensure_future(_post_completion(headers, data, call))
+        flight = _inflight[key] = {"task": task, "waiters": 0}
+        task.add_done_callback(lambda t: _finish_flight(key, t))
+    else:
+        logger.debug(f"Joining in-flight LLM request {key[:12]}")
+    task = flight["task"]
+    flight["waiters"] += 1
+    try:
+        # Shield so one cancelled caller does not cancel the call for the others
+        return await asyncio.shield(task)
+    finally:
+        flight["waiters"] -= 1
+        if not flight["waiters"] and not task.done():
+            # The last caller gave up (e.g. its client disconnected)
+            task.cancel()
+
+def _finish_flight(key: str, task: asyncio.Task):
+    _inflight.pop(key, None)
+    if not task.cancelled():
+        task.exception()  # mark retrieved even if every caller has gone away
+
+def _headers() -> dict:
+    return {
         "Authorization": f"Bearer {OPENROUTER_API_KEY}",
         "Content-Type": "application/json",
         "HTTP-Referer": "https://manim-video-generator.com"  # Update with your domain
     }
+
+async def get_manim_code_from_llm(prompt: str, temperature: float = None) -> str:
+    """
+    Sends a prompt to the LLM via OpenRouter API and gets Manim code in return
+    """
+    if not OPENROUTER_API_KEY:
+        raise ValueError("OpenRouter API key not found in environment variables")
+        
+    headers = _headers()
     
     data = {
         "model": OPENROUTER_MODEL,
@@ -33,21 +165,118 @@ async def get_manim_code_from_llm(prompt: str) -> str:
             {"role": "user", "content": prompt}
         ]
     }
+    if temperature is not None:
+        data["temperature"] = temperature
     
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            "https://openrouter.ai/api/v1/chat/completions", 
-            headers=headers, 
-            json=data,
-            timeout=60.0
-        )
+    return await _chat_completion(headers, data, "generate")
+
+async def get_manim_code_candidates(prompt: str, n: int, temperature: float = None) -> list:
+    """
+    Asks for `n` alternative scripts in one call using the `n` parameter.
+    Not every model behind OpenRouter honours it, so fewer may come back.
+    """
+    if not OPENROUTER_API_KEY:
+        raise ValueError("OpenRouter API key not found in environment variables")
+    
+    data = {
+        "model": OPENROUTER_MODEL,
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        "n": n
+    }
+    if temperature is not None:
+        data["temperature"] = temperature
+    
+    async with _call_slots:
+        timeout = _timeout()
+        try:
+            response = await start_client().post(OPENROUTER_URL, headers=_headers(), json=data, timeout=timeout)
+        except httpx.TimeoutException as e:
+            _timed_out(timeout, e)
+    if response.status_code != 200:
+        raise Exception(f"API request failed with status {response.status_code}: {response.text}")
+    
+    result = response.json()
+    _record_usage("candidates", result.get("usage") or {})
+    return [choice["message"]["content"] for choice in result["choices"]]
         
+async def stream_manim_code_from_llm(prompt: str):
+    """
+    Streams Manim code for a prompt from the LLM, yielding text deltas as they arrive
+    """
+    if not OPENROUTER_API_KEY:
+        raise ValueError("OpenRouter API key not found in environment variables")
+    
+    data = {
+        "model": OPENROUTER_MODEL,
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        "stream": True,
+        # Ask for token counts in the final chunk
+        "usage": {"include": True}
+    }
+    
+    async with _call_slots:
+        timeout = _timeout()
+        try:
+            async for delta in _stream_completion(data, timeout):
+                yield delta
+        except httpx.TimeoutException as e:
+            _timed_out(timeout, e)
+
+async def _stream_completion(data: dict, timeout: float):
+    async with start_client().stream(
+        "POST",
+        OPENROUTER_URL,
+        headers=_headers(),
+        json=data,
+        timeout=timeout
+    ) as response:
         if response.status_code != 200:
-            raise Exception(f"API request failed with status {response.status_code}: {response.text}")
-            
-        result = response.json()
-        return result["choices"][0]["message"]["content"]
+            body = (await response.aread()).decode("utf-8", errors="replace")
+            raise Exception(f"API request failed with status {response.status_code}: {body}")
+        
+        # Server-sent events; lines starting with ":" are keep-alive comments
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            payload = line[len("data:"):].strip()
+            if payload == "[DONE]":
+                break
+            chunk = json.loads(payload)
+            if chunk.get("usage"):
+                _record_usage("stream", chunk["usage"])
+            choices = chunk.get("choices") or [{}]
+            delta = choices[0].get("delta", {}).get("content")
+            if delta:
+                yield delta
+
+async def revise_manim_code(code: str, instruction: str) -> str:
+    """
+    Asks the LLM to change existing Manim code according to `instruction`,
+    keeping everything else as it is so unchanged animations stay cached
+    """
+    if not OPENROUTER_API_KEY:
+        raise ValueError("OpenRouter API key not found in environment variables")
         
+    headers = _headers()
+    
+    data = {
+        "model": OPENROUTER_MODEL,
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": "Generate Manim code for me."},
+            {"role": "assistant", "content": code},
+            {"role": "user", "content": f"Revise this scene: {instruction}\n\nChange only what the revision requires, keep every other line identical, and resend the complete code."}
+        ]
+    }
+    
+    return await _chat_completion(headers, data, "revise")
+
 async def fix_manim_code(code: str, error: str) -> str:
     """
     Sends the error to the LLM to get fixed Manim code
@@ -55,11 +284,7 @@ async def fix_manim_code(code: str, error: str) -> str:
     if not OPENROUTER_API_KEY:
         raise ValueError("OpenRouter API key not found in environment variables")
         
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json",
-        "HTTP-Referer": "https://manim-video-generator.com"  # Update with your domain
-    }
+    headers = _headers()
     
     data = {
         "model": OPENROUTER_MODEL,
@@ -71,16 +296,4 @@ async def fix_manim_code(code: str, error: str) -> str:
         ]
     }
     
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            "https://openrouter.ai/api/v1/chat/completions", 
-            headers=headers, 
-            json=data,
-            timeout=60.0
-        )
-        
-        if response.status_code != 200:
-            raise Exception(f"API request failed with status {response.status_code}: {response.text}")
-            
-        result = response.json()
-        return result["choices"][0]["message"]["content"] 
\ No newline at end of file
+    return await _chat_completion(headers, data, "repair")
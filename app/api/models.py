@@ -1,15 +1,94 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import Optional, Literal, List, Union, Dict
+
+from app.workers.render_profiles import PROFILES, FORMATS, ENCODE_PRESETS
+
+
+class RenderProfile(BaseModel):
+    # Output height in pixels; the width follows from Manim's 16:9 frame
+    height: int = Field(1080, ge=144, le=2160)
+    fps: int = Field(60, ge=1, le=60)
+    # Longer scenes are cut at this many seconds
+    max_duration: Optional[float] = Field(None, gt=0)
+    format: Literal[FORMATS] = "mp4"
+    # Encoder speed/size trade-off for WebM and GIF output
+    preset: Literal[ENCODE_PRESETS] = "balanced"
 
 
 class AnimationRequest(BaseModel):
     prompt: str
+    # Render a fast preview first and upgrade to HD in the background;
+    # None uses the server default (PROGRESSIVE_RENDERING)
+    progressive: Optional[bool] = None
+    # Speculative generation: render this many candidate scripts in parallel
+    # and keep the first that succeeds; None uses SPECULATIVE_CANDIDATES
+    candidates: Optional[int] = Field(None, ge=1)
+    # Priority lane: batch jobs have their own, smaller concurrency budget
+    priority: Literal["interactive", "batch"] = "interactive"
+    # Revise an earlier scene: the prompt describes the change to make to
+    # the latest code of this lineage (a SceneResponse's lineage_id)
+    lineage_id: Optional[str] = Field(None, pattern=r"^[A-Za-z0-9_-]{1,64}$")
+    # Output settings: a named profile or custom values; None renders the
+    # default quality ladder
+    profile: Optional[Union[Literal[tuple(PROFILES)], RenderProfile]] = None
+    # Seconds from submission until the scene must be ready; None uses
+    # REQUEST_DEADLINE_SECONDS, and MAX_REQUEST_DEADLINE_SECONDS caps it
+    deadline_seconds: Optional[float] = Field(None, gt=0)
     
 
+class BatchRequest(BaseModel):
+    prompts: List[str] = Field(..., min_length=1)
+    # Offline batches usually want the final quality straight away
+    progressive: Optional[bool] = False
+
+
 class SceneResponse(BaseModel):
     id: str
     prompt: str
     code: str
     video_url: Optional[str] = None
     success: bool
-    error: Optional[str] = None 
\ No newline at end of file
+    error: Optional[str] = None
+    # Progressive rendering: video_url points at the best version ready so far
+    preview_url: Optional[str] = None
+    hd_url: Optional[str] = None
+    hd_status: Optional[str] = None  # "pending", "ready", "failed" or "skipped"
+    # Pass as AnimationRequest.lineage_id to revise this scene
+    lineage_id: Optional[str] = None
+
+class JobResponse(BaseModel):
+    id: str
+    status: str
+    result: Optional[SceneResponse] = None
+    error: Optional[str] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+
+class SceneSummary(BaseModel):
+    id: str
+    lineage_id: Optional[str] = None
+    created_at: float
+    finished_at: float
+    outcome: str  # "success", "failed", "deadline", "error" or "cancelled"
+    prompt_hash: str
+    code_hash: Optional[str] = None
+    video_url: Optional[str] = None
+    quality: Optional[str] = None
+    profile: Optional[dict] = None
+    hd_status: Optional[str] = None
+    cached: bool = False
+    # Seconds for the whole request and per stage
+    duration: Optional[float] = None
+    timings: Optional[Dict[str, float]] = None
+
+class SceneRecord(SceneSummary):
+    prompt: str
+    code: Optional[str] = None
+    error: Optional[str] = None
+
+class SceneList(BaseModel):
+    scenes: List[SceneSummary]
+    # Pass as `cursor` to get the next page; None on the last page
+    next_cursor: Optional[int] = None
@@ -0,0 +1,413 @@
+import os
+import time
+import asyncio
+import logging
+from functools import partial
+
+from app.api.models import SceneResponse
+from app.api.llm import (
+    get_manim_code_from_llm, get_manim_code_candidates, stream_manim_code_from_llm, fix_manim_code,
+    revise_manim_code
+)
+from app.api.prompt_cache import prompt_cache
+from app.api.scene_index import scene_index
+from app.metrics import (
+    Trace, Stopwatch, current_trace, span, record_render,
+    requests_total, retries_total, fallbacks_total, cache_total, candidates_total, timeouts_total
+)
+from app.workers.jobs import job_manager
+from app.workers.manim_worker import DEFAULT_QUALITIES, preflight, cached_render, sanitize_manim_code
+from app.workers.lineage import lineage_store
+from app.workers.render_profiles import profile_key
+from app.deadlines import DeadlineExceeded, remaining, fits
+
+logger = logging.getLogger(__name__)
+
+# Progressive mode renders a cheap preview first and the HD version afterwards
+PROGRESSIVE_RENDERING = os.getenv("PROGRESSIVE_RENDERING", "1") != "0"
+PREVIEW_QUALITIES = ("-ql",)
+HD_QUALITIES = ("-qh",)
+# HD upgrades waiting or rendering at once; beyond it scenes keep their preview
+MAX_PENDING_HD_UPGRADES = int(os.getenv("MAX_PENDING_HD_UPGRADES", "100"))
+_hd_upgrades = set()
+
+# Speculative generation: several candidate scripts are generated and rendered
+# in parallel and the first that renders wins. 1 disables it by default.
+SPECULATIVE_CANDIDATES = int(os.getenv("SPECULATIVE_CANDIDATES", "1"))
+MAX_SPECULATIVE_CANDIDATES = int(os.getenv("MAX_SPECULATIVE_CANDIDATES", "4"))
+# "parallel" makes one LLM call per candidate at varied temperatures;
+# "n" asks for all candidates in a single call with the `n` parameter
+SPECULATIVE_MODE = os.getenv("SPECULATIVE_MODE", "parallel")
+SPECULATIVE_TEMPERATURES = tuple(
+    float(t) for t in os.getenv("SPECULATIVE_TEMPERATURES", "0.3,0.7,1.0,0.5").split(",")
+)
+
+# The repair (an LLM call and another render) is skipped with less of the
+# request's deadline left than this
+REPAIR_MIN_SECONDS = float(os.getenv("REPAIR_MIN_SECONDS", "15"))
+
+
+async def generate_scene(scene_id: str, prompt: str, emit=None, progressive=None,
+                         candidates=None, lineage_id=None, profile=None) -> SceneResponse:
+    """
+    Full generation pipeline: prompt -> LLM code -> render -> one repair attempt.
+    Renders run on the job manager's worker pool so the event loop never blocks.
+
+    If `emit` is given it is awaited as emit(event, data) with code tokens,
+    stage transitions and render progress while the pipeline runs.
+
+    In progressive mode the response is returned as soon as a low quality
+    preview exists; the HD render then runs in the background and updates
+    the response in place when it finishes.
+    
+    With more than one candidate (default SPECULATIVE_CANDIDATES) several
+    scripts are generated and rendered concurrently; see _speculate.
+    
+    Every scene starts a lineage (its id is the scene id). Given the
+    `lineage_id` of an earlier scene, the prompt is a revision of that
+    scene's latest code instead. Renders within a lineage share a media
+    directory, so repairs and revisions only re-render changed animations.
+    
+    A resolved render `profile` (resolution, frame rate, duration, format)
+    replaces the quality ladder and progressive rendering.
+    
+    Every stage runs within the job's deadline (see app.deadlines): LLM
+    calls and renders get the time left, the repair is skipped when it
+    cannot fit, and work still running at the deadline is cancelled, which
+    kills its renders. DeadlineExceeded is raised if no scene could be
+    produced in time.
+    
+    Stage timings go to the metrics registry and one structured trace log
+    line, and the scene with its outcome to the scene index.
+    """
+    trace = Trace(scene_id)
+    token = current_trace.set(trace)
+    created_at = time.time()
+    outcome = "error"
+    response = None
+    error = None
+    try:
+        # Whatever overruns the stage budgets is cut off at the deadline itself
+        response = await asyncio.wait_for(
+            _generate_scene(scene_id, prompt, emit, progressive, candidates, lineage_id, profile),
+            remaining()
+        )
+        if response.success:
+            outcome = "success"
+        else:
+            outcome = "deadline" if trace.attributes.get("deadline_exceeded") else "failed"
+        return response
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    except (DeadlineExceeded, asyncio.TimeoutError) as e:
+        outcome = "deadline"
+        timeouts_total.inc(stage="request")
+        if isinstance(e, DeadlineExceeded):
+            error = str(e)
+            raise
+        exceeded = DeadlineExceeded("generation")
+        error = str(exceeded)
+        raise exceeded from e
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        requests_total.inc(outcome=outcome)
+        trace.log(outcome)
+        current_trace.reset(token)
+        # SQLite blocks; the write completes in its thread even if this wait is cancelled
+        await asyncio.get_running_loop().run_in_executor(None, partial(
+            scene_index.record,
+            scene_id, prompt, outcome, created_at, time.perf_counter() - trace.start,
+            timings=_stage_timings(trace), response=response, quality=trace.attributes.get("quality"),
+            profile=profile, cached=trace.attributes.get("cached", False), error=error
+        ))
+
+
+def _stage_timings(trace: Trace) -> dict:
+    """Seconds per stage of a trace, summing repeated stages (e.g. two renders)"""
+    timings = {}
+    for entry in trace.spans:
+        timings[entry["name"]] = round(timings.get(entry["name"], 0) + entry["duration"], 4)
+    return timings
+
+
+async def _generate_scene(scene_id: str, prompt: str, emit, progressive, candidates,
+                          lineage_id, profile) -> SceneResponse:
+    if profile is not None:
+        # The profile is the final quality; there is nothing to upgrade to
+        progressive = False
+    elif progressive is None:
+        progressive = PROGRESSIVE_RENDERING
+    qualities = PREVIEW_QUALITIES if progressive else DEFAULT_QUALITIES
+    candidates = max(1, min(candidates or SPECULATIVE_CANDIDATES, MAX_SPECULATIVE_CANDIDATES))
+
+    logger.debug(f"Received prompt: {prompt}")
+
+    # A revision continues an earlier scene's lineage; anything else starts one
+    previous_code = lineage_store.code(lineage_id) if lineage_id else None
+    if previous_code is None:
+        lineage_id = scene_id
+
+    # Reuse code that already rendered for this prompt, otherwise ask the LLM
+    loop = asyncio.get_running_loop()
+    cached_code = await loop.run_in_executor(None, prompt_cache.get, prompt) if previous_code is None else None
+    code = cached_code
+    from_cache = code is not None
+    if previous_code is None:
+        cache_total.inc(cache="prompt", result="hit" if from_cache else "miss")
+    result = None
+    if previous_code is not None:
+        if emit:
+            await emit("stage", {"stage": "revising"})
+        with span("revise"):
+            code = await revise_manim_code(previous_code, prompt)
+        if emit:
+            await emit("code", {"code": code})
+    elif from_cache:
+        if emit:
+            await emit("token", {"text": code, "cached": True})
+    elif candidates > 1:
+        code, result = await _speculate(prompt, candidates, emit, qualities, profile, lineage_id)
+    elif emit:
+        await emit("stage", {"stage": "generating"})
+        tokens = []
+        with span("llm", streamed=True):
+            async for token in stream_manim_code_from_llm(prompt):
+                tokens.append(token)
+                await emit("token", {"text": token})
+        code = "".join(tokens)
+    else:
+        with span("llm"):
+            code = await get_manim_code_from_llm(prompt)
+        logger.debug(f"Generated code from LLM")
+
+    # Run the code
+    if result is None:
+        logger.debug(f"Running Manim code")
+        if emit:
+            await emit("stage", {"stage": "validating"})
+        result = await _render(code, emit, qualities, lineage=lineage_id, profile=profile)
+    logger.debug(f"Manim result: success={result['success']} video={result.get('video_path')}")
+
+    if from_cache and not result["success"] and not result.get("deadline_exceeded"):
+        # Never replay code that no longer renders
+        await loop.run_in_executor(None, prompt_cache.invalidate, prompt)
+        fallbacks_total.inc(kind="prompt_cache_invalidated")
+
+    if result.get("deadline_exceeded"):
+        pass  # out of time, not broken: nothing to repair
+    elif not result["success"] and result["error"] and not fits(REPAIR_MIN_SECONDS):
+        logger.info(f"Skipping the repair of {scene_id}: too close to the deadline")
+        fallbacks_total.inc(kind="repair_skipped")
+    # If failed, try one more time with error feedback, if there is time for it
+    elif not result["success"] and result["error"]:
+        logger.debug(f"First attempt failed, trying to fix code with error: {result['error']}")
+        if emit:
+            await emit("stage", {"stage": "repairing", "error": result["error"]})
+        retries_total.inc(kind="repair")
+        with span("repair"):
+            fixed_code = await fix_manim_code(code, result["error"])
+        if emit:
+            await emit("code", {"code": fixed_code})
+        result = await _render(fixed_code, emit, qualities, lineage=lineage_id, profile=profile)
+        # Use the fixed code if successful
+        if result["success"]:
+            code = fixed_code
+
+    current_trace.get().attributes.update(quality=result.get("quality"), cached=bool(result.get("cached")))
+    if result.get("deadline_exceeded"):
+        current_trace.get().attributes["deadline_exceeded"] = True
+    # Cached code that rendered again is already stored
+    if result["success"] and previous_code is None and code != cached_code:
+        await loop.run_in_executor(None, prompt_cache.put, prompt, code)
+
+    video_url = _video_url(result)
+    logger.debug(f"Setting video URL to: {video_url}")
+
+    response = SceneResponse(
+        id=scene_id,
+        prompt=prompt,
+        code=code,
+        video_url=video_url,
+        success=result["success"],
+        error=result["error"],
+        lineage_id=lineage_id
+    )
+    if progressive and video_url:
+        response.preview_url = video_url
+        if len(_hd_upgrades) < MAX_PENDING_HD_UPGRADES:
+            response.hd_status = "pending"
+            upgrade = job_manager.spawn(_upgrade_to_hd(response))
+            _hd_upgrades.add(upgrade)
+            upgrade.add_done_callback(_hd_upgrades.discard)
+        else:
+            # Upgrades are the lowest priority renders; a backlog of them only grows
+            logger.info(f"Skipping the HD render of {scene_id}: {len(_hd_upgrades)} upgrades pending")
+            fallbacks_total.inc(kind="hd_skipped")
+            response.hd_status = "skipped"
+    return response
+
+
+async def _speculate(prompt: str, n: int, emit, qualities, profile=None, lineage_id=None) -> tuple:
+    """
+    Generate `n` candidate scripts concurrently and render each on the pool
+    as soon as it arrives. The first successful render wins; the other
+    candidates are cancelled and their renders killed. If every candidate
+    fails, the earliest failure is returned so the usual repair step runs
+    on it. Returns (code, result).
+    
+    Candidates render outside the lineage, which could only hold one of
+    them; the winner's code is saved to `lineage_id` afterwards.
+    """
+    if emit:
+        await emit("stage", {"stage": "generating", "candidates": n})
+    batch = None
+    if SPECULATIVE_MODE == "n":
+        batch = asyncio.ensure_future(get_manim_code_candidates(prompt, n, SPECULATIVE_TEMPERATURES[0]))
+
+    async def generate(index: int) -> str:
+        if batch is None:
+            temperature = SPECULATIVE_TEMPERATURES[index % len(SPECULATIVE_TEMPERATURES)]
+            return await get_manim_code_from_llm(prompt, temperature)
+        codes = await asyncio.shield(batch)
+        if index >= len(codes):
+            raise LookupError(f"The model returned {len(codes)} of {n} candidates")
+        return codes[index]
+
+    async def attempt(index: int):
+        with span("llm", candidate=index):
+            code = await generate(index)
+        result = await _render(code, None, qualities, profile=profile)
+        return code, result
+
+    tasks = [asyncio.ensure_future(attempt(index)) for index in range(n)]
+    failures = []
+    errors = []
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            try:
+                code, result = await next_done
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                candidates_total.inc(outcome="error")
+                errors.append(e)
+                continue
+            if result["success"]:
+                candidates_total.inc(outcome="won")
+                if lineage_id is not None:
+                    await asyncio.get_running_loop().run_in_executor(
+                        None, lineage_store.save_code, lineage_id, sanitize_manim_code(code)
+                    )
+                if emit:
+                    await emit("code", {"code": code})
+                return code, result
+            candidates_total.inc(outcome="failed")
+            failures.append((code, result))
+    finally:
+        # Losers are cancelled, which kills their renders in the workers
+        pending = [task for task in tasks if not task.done()]
+        for task in pending:
+            task.cancel()
+        if batch is not None and not batch.done():
+            batch.cancel()
+        candidates_total.inc(len(pending), outcome="cancelled")
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    if failures:
+        code, result = failures[0]
+        if emit:
+            await emit("code", {"code": code})
+        return code, result
+    raise errors[0]
+
+
+async def _upgrade_to_hd(response: SceneResponse):
+    """Render the HD version of a previewed scene and publish it on the response"""
+    # The request's trace is already logged; the upgrade gets its own
+    trace = Trace(f"{response.id}-hd")
+    current_trace.set(trace)
+    try:
+        result = await _render(response.code, None, HD_QUALITIES, lineage=response.lineage_id)
+    except Exception as e:
+        logger.error(f"HD render for {response.id} failed: {str(e)}")
+        result = {"success": False, "error": str(e)}
+    trace.log("success" if result["success"] else "failed")
+
+    if result["success"] and result.get("video_path"):
+        response.hd_url = _video_url(result)
+        response.video_url = response.hd_url
+        response.hd_status = "ready"
+    else:
+        logger.info(f"HD render for {response.id} failed, keeping the preview: {result['error']}")
+        fallbacks_total.inc(kind="preview_only")
+        response.hd_status = "failed"
+    await asyncio.get_running_loop().run_in_executor(
+        None, scene_index.update_video, response.id, response.hd_url, response.hd_status, result.get("quality")
+    )
+
+
+def _video_url(result: dict):
+    """URL path (starting with /static/) for a successful render result"""
+    if not (result["success"] and result["video_path"]):
+        return None
+    video_path = result["video_path"]
+    if not video_path.startswith('/'):
+        return f"/{video_path}"
+    return video_path
+
+
+async def _render(code: str, emit=None, qualities=DEFAULT_QUALITIES,
+                  lineage: str = None, profile: dict = None) -> dict:
+    """
+    Render on the worker pool. With `emit`, relay the worker's progress
+    events while it runs. Cancelling the caller (a client disconnect, the
+    deadline, a losing speculative candidate) kills the render. With a
+    `lineage`, render in its media directory.
+    
+    Code that fails static validation is rejected here, and a render cache
+    hit served, before waiting for a render slot.
+    """
+    with span("render_total", qualities=",".join(qualities) if profile is None else profile_key(profile)):
+        watch = Stopwatch()
+        code, result = await asyncio.get_running_loop().run_in_executor(
+            None, _before_render, code, watch, qualities, lineage, profile
+        )
+        if result is None:
+            result = await _render_in_pool(code, emit, qualities, lineage, profile)
+        else:
+            result.update(timings=watch.timings, counts=watch.counts)
+    record_render(result)
+    return result
+
+
+def _before_render(code: str, watch: Stopwatch, qualities, lineage, profile) -> tuple:
+    """Preflight, then the render cache: (code, result), with a result when there is nothing to render"""
+    code, result = preflight(code, watch)
+    if result is None:
+        with watch.time("cache"):
+            result = cached_render(code, qualities, profile, lineage)
+    return code, result
+
+
+async def _render_in_pool(code: str, emit, qualities, lineage, profile) -> dict:
+    channel = job_manager.channel()
+    render = asyncio.ensure_future(
+        job_manager.render(code, channel.progress, channel.cancel, qualities, lineage, profile)
+    )
+    try:
+        async for event in channel.events(render):
+            if emit:
+                await emit(event.pop("event"), event)
+        return await render
+    except asyncio.CancelledError:
+        # The event stops a render already on a worker; cancelling the task
+        # gives up its slot, or its place in line for one
+        channel.cancel.set()
+        render.cancel()
+        await asyncio.gather(render, return_exceptions=True)
+        raise
+    finally:
+        channel.close()
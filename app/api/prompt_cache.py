@@ -0,0 +1,139 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from collections import OrderedDict
+
+from app.api.llm import OPENROUTER_MODEL, SYSTEM_PROMPT
+from app.workers.storage import StorageQuota
+
+logger = logging.getLogger(__name__)
+
+WORKSPACE_ROOT = Path(__file__).parent.parent.parent.absolute()
+PROMPT_CACHE_DIR = Path(os.getenv("PROMPT_CACHE_DIR", str(WORKSPACE_ROOT / "app" / "prompt-cache")))
+PROMPT_CACHE_TTL = int(os.getenv("PROMPT_CACHE_TTL", str(7 * 24 * 3600)))
+PROMPT_CACHE_MEMORY_ENTRIES = int(os.getenv("PROMPT_CACHE_MEMORY_ENTRIES", "1024"))
+PROMPT_CACHE_DISK_ENTRIES = int(os.getenv("PROMPT_CACHE_DISK_ENTRIES", "20000"))
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Case- and whitespace-insensitive form of a prompt"""
+    return re.sub(r"\s+", " ", prompt).strip().lower()
+
+
+class PromptCache:
+    """
+    Two-tier prompt -> code cache: an in-memory LRU in front of a directory
+    of JSON files. Keys cover the normalized prompt, the model and a hash of
+    the system prompt, so changing either invalidates old entries.
+
+    Only code that rendered successfully should be stored with `put`.
+    The disk tier blocks, so async callers run the methods in an executor;
+    the memory tier is shared by those threads.
+    """
+    def __init__(self, directory: Path = PROMPT_CACHE_DIR, ttl: int = PROMPT_CACHE_TTL,
+                 memory_entries: int = PROMPT_CACHE_MEMORY_ENTRIES,
+                 disk_entries: int = PROMPT_CACHE_DISK_ENTRIES,
+                 model: str = OPENROUTER_MODEL, system_prompt: str = SYSTEM_PROMPT):
+        self.directory = Path(directory)
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.model = model
+        self.system_hash = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        # Entries are small, so only their count is limited; the directory
+        # is scanned at most once per quota check interval
+        self.quota = StorageQuota(self.directory, max_bytes=float("inf"), max_files=disk_entries)
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, prompt: str) -> str:
+        digest = hashlib.sha256()
+        for part in (normalize_prompt(prompt), self.model, self.system_hash):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def get(self, prompt: str):
+        """Return cached code for `prompt`, or None on a miss or expired entry"""
+        key = self.key(prompt)
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+        if entry is None:
+            entry = self._read(key)
+            if entry is not None:
+                self._remember(key, entry)
+
+        if entry is None or now - entry["created_at"] > self.ttl:
+            if entry is not None:
+                self.invalidate(prompt)
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        logger.debug(f"Prompt cache hit for {key[:12]}")
+        return entry["code"]
+
+    def put(self, prompt: str, code: str):
+        """Record code that rendered successfully for `prompt`"""
+        key = self.key(prompt)
+        entry = {"code": code, "model": self.model, "created_at": time.time()}
+        self._remember(key, entry)
+        try:
+            self.directory.mkdir(exist_ok=True, parents=True)
+            path = self._path(key)
+            # Hidden, so the quota never counts a partial entry
+            tmp_path = path.with_name(f".{path.stem}.{os.getpid()}.{threading.get_ident()}.tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+            self.quota.enforce()
+        except OSError as e:
+            logger.warning(f"Could not persist prompt cache entry: {str(e)}")
+
+    def invalidate(self, prompt: str):
+        """Drop the entry for `prompt`, e.g. when its cached code stopped rendering"""
+        key = self.key(prompt)
+        with self._lock:
+            self._memory.pop(key, None)
+        try:
+            self._path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _remember(self, key: str, entry: dict):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _read(self, key: str):
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+            # Recency for the quota's least recently used eviction
+            os.utime(path)
+            return entry
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable prompt cache entry {path.name}: {str(e)}")
+            return None
+
+
+prompt_cache = PromptCache()
@@ -1,84 +1,258 @@
-from fastapi import APIRouter, HTTPException, Request, Form
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import APIRouter, HTTPException, Request, Form, Query
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 import uuid
 import os
 import logging
 from pathlib import Path
+import re
+import json
 import asyncio
+from functools import partial
+from typing import Optional, Literal
 
-from app.api.models import AnimationRequest, SceneResponse
-from app.api.llm import get_manim_code_from_llm, fix_manim_code
-from app.workers.manim_worker import run_manim_code, VIDEO_DIR
+from app.api.models import AnimationRequest, BatchRequest, SceneResponse, JobResponse, SceneRecord, SceneList
+from app.api.pipeline import generate_scene
+from app.workers.jobs import job_manager, QueueFullError
+from app.api.admission import admit, overloaded
+from app.api.batches import batch_manager, BATCH_MAX_PROMPTS
+from app.api.prompt_cache import normalize_prompt
+from app.api.video_files import serve_video
+from app.api.scene_index import scene_index, SCENE_PAGE_SIZE, SCENE_MAX_PAGE_SIZE
+from app.workers.manim_worker import VIDEO_DIR
+from app.workers.lineage import lineage_store
+from app.workers.render_profiles import resolve_profile, FORMATS
+from app.deadlines import deadline_after
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-@router.post("/generate", response_model=SceneResponse)
-async def generate_animation(request: AnimationRequest):
+VIDEO_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+
+@router.post("/generate", response_model=JobResponse, status_code=202)
+async def generate_animation(request: AnimationRequest, http_request: Request):
     """
-    Generate animation from natural language prompt
+    Enqueue an animation job for a natural language prompt.
+    Poll /api/jobs/{id} for its status and result.
+    Returns 429 with Retry-After when rate limited or overloaded.
     """
-    scene_id = str(uuid.uuid4())[:8]
-    
+    _check_lineage(request)
+    profile = _profile(request)
+    admit(http_request)
     try:
-        logger.debug(f"Received prompt: {request.prompt}")
-        
-        # Get Manim code from LLM
-        code = await get_manim_code_from_llm(request.prompt)
-        logger.debug(f"Generated code from LLM")
-        
-        # Run the code
-        logger.debug(f"Running Manim code")
-        result = run_manim_code(code)
-        logger.debug(f"Manim result: {result}")
-        
-        # If failed, try one more time with error feedback
-        if not result["success"] and result["error"]:
-            logger.debug(f"First attempt failed, trying to fix code with error: {result['error']}")
-            fixed_code = await fix_manim_code(code, result["error"])
-            result = run_manim_code(fixed_code)
-            # Use the fixed code if successful
-            if result["success"]:
-                code = fixed_code
-        
-        video_url = None
-        if result["success"] and result["video_path"]:
-            # Ensure we use a URL path that starts with /static/
-            video_path = result["video_path"]
-            if not video_path.startswith('/'):
-                video_url = f"/{video_path}"
-            else:
-                video_url = video_path
-            
-            logger.debug(f"Setting video URL to: {video_url}")
-        
-        # Return the response
-        response = SceneResponse(
-            id=scene_id,
-            prompt=request.prompt,
-            code=code,
-            video_url=video_url,
-            success=result["success"],
-            error=result["error"]
+        job = job_manager.submit(
+            request.prompt,
+            lambda job: generate_scene(job.id, job.prompt, progressive=request.progressive,
+                                       candidates=request.candidates, lineage_id=request.lineage_id,
+                                       profile=profile),
+            request.priority,
+            deadline_after(request.deadline_seconds)
         )
-        logger.debug(f"Returning response: {response}")
-        return response
-        
-    except Exception as e:
-        logger.error(f"Error in generate_animation: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+    except QueueFullError as e:
+        logger.warning(f"Rejecting prompt: {str(e)}")
+        raise overloaded(e)
+
+    logger.debug(f"Queued job {job.id}")
+    return _job_response(job)
 
-@router.get("/videos/{video_id}")
-async def get_video(video_id: str):
+@router.post("/generate/stream")
+async def generate_animation_stream(request: AnimationRequest, http_request: Request):
     """
-    Serve a video by its ID from local storage
+    Generate an animation and stream progress as server-sent events:
+    `job`, `stage`, `token`, `code`, `progress`, then `result` or `error`.
+    Disconnecting cancels the job, including any render in progress.
     """
-    video_path = VIDEO_DIR / f"{video_id}.mp4"
+    _check_lineage(request)
+    profile = _profile(request)
+    admit(http_request)
+    events = asyncio.Queue()
+    
+    async def emit(event: str, data: dict):
+        await events.put((event, data))
+    
+    try:
+        job = job_manager.submit(
+            request.prompt,
+            lambda job: generate_scene(job.id, job.prompt, emit, request.progressive, request.candidates,
+                                       request.lineage_id, profile),
+            request.priority,
+            deadline_after(request.deadline_seconds)
+        )
+    except QueueFullError as e:
+        logger.warning(f"Rejecting prompt: {str(e)}")
+        raise overloaded(e)
+    
+    async def stream():
+        try:
+            yield _sse("job", {"id": job.id, "status": job.status})
+            while True:
+                next_event = asyncio.ensure_future(events.get())
+                done, _ = await asyncio.wait(
+                    {next_event, job.task}, return_when=asyncio.FIRST_COMPLETED
+                )
+                if next_event not in done:
+                    next_event.cancel()
+                    break
+                yield _sse(*next_event.result())
+            
+            while not events.empty():
+                yield _sse(*events.get_nowait())
+            if job.status == "completed":
+                yield _sse("result", job.result.model_dump())
+            else:
+                yield _sse("error", {"detail": job.error or job.status})
+        finally:
+            # Client went away (or we are done): stop any work still running
+            if not job.task.done():
+                logger.info(f"Client disconnected, cancelling job {job.id}")
+                job.task.cancel()
     
-    if not video_path.exists():
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/generate/batch")
+async def generate_batch(request: BatchRequest, http_request: Request):
+    """
+    Generate many prompts in the background on the batch lane. Identical
+    prompts (ignoring case and whitespace) are generated once. Streams NDJSON:
+    a summary line with the batch id, then one line per unique prompt with
+    its positions in the request and its SceneResponse, in completion order.
+    The batch keeps running if the client disconnects; reattach with
+    GET /api/generate/batch/{id}. Batches live in this API process, like
+    jobs: they are lost on a restart and only this process can resume them.
+    """
+    if len(request.prompts) > BATCH_MAX_PROMPTS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_PROMPTS} prompts per batch")
+    # Charged like that many single requests
+    admit(http_request, cost=len({normalize_prompt(prompt) for prompt in request.prompts}))
+    batch = batch_manager.create(request.prompts, request.progressive)
+    return _ndjson(batch)
+
+@router.get("/generate/batch/{batch_id}")
+async def resume_batch(batch_id: str):
+    """
+    Resume a batch's NDJSON stream: results finished so far come first,
+    then the rest as they complete. 404 for batches of another process,
+    or from before a restart.
+    """
+    batch = batch_manager.get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return _ndjson(batch)
+
+@router.delete("/generate/batch/{batch_id}")
+async def cancel_batch(batch_id: str):
+    """Cancel a batch's unfinished prompts"""
+    batch = batch_manager.get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    batch_manager.cancel(batch)
+    return batch.summary()
+
+def _check_lineage(request: AnimationRequest):
+    """404 for a revision of a lineage that never rendered or was evicted"""
+    if request.lineage_id and lineage_store.code(request.lineage_id) is None:
+        raise HTTPException(status_code=404, detail="Lineage not found")
+
+def _profile(request: AnimationRequest):
+    """The request's render profile as a complete dict, or None"""
+    if request.profile is None or isinstance(request.profile, str):
+        return resolve_profile(request.profile)
+    return resolve_profile(request.profile.model_dump())
+
+def _ndjson(batch) -> StreamingResponse:
+    return StreamingResponse(
+        batch.lines(),
+        media_type="application/x-ndjson",
+        headers={"X-Batch-Id": batch.id, "Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str):
+    """
+    Report the status of a generation job and its SceneResponse once finished
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return _job_response(job)
+
+@router.delete("/jobs/{job_id}", response_model=JobResponse)
+async def cancel_job(job_id: str):
+    """
+    Cancel a queued or running job, killing its LLM calls and renders;
+    for clients that poll and give up on a job
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if not job.task.done():
+        job.task.cancel()
+        await asyncio.wait({job.task})
+    return _job_response(job)
+
+def _job_response(job) -> JobResponse:
+    return JobResponse(
+        id=job.id,
+        status=job.status,
+        result=job.result,
+        error=job.error,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at
+    )
+
+@router.get("/scenes", response_model=SceneList)
+async def list_scenes(
+    limit: int = Query(SCENE_PAGE_SIZE, ge=1, le=SCENE_MAX_PAGE_SIZE),
+    cursor: Optional[int] = Query(None, ge=0),
+    outcome: Optional[Literal["success", "failed", "deadline", "error", "cancelled"]] = None,
+    prompt_hash: Optional[str] = None,
+    code_hash: Optional[str] = None,
+    lineage_id: Optional[str] = None
+):
+    """
+    List generated scenes, newest first. Follow `next_cursor` for older
+    pages; filters narrow the listing by outcome, prompt or code hash, or
+    lineage.
+    """
+    scenes, next_cursor = await asyncio.get_running_loop().run_in_executor(None, partial(
+        scene_index.list, limit, cursor, outcome=outcome, prompt_hash=prompt_hash,
+        code_hash=code_hash, lineage_id=lineage_id
+    ))
+    return SceneList(scenes=scenes, next_cursor=next_cursor)
+
+@router.get("/scenes/{scene_id}", response_model=SceneRecord)
+async def get_scene(scene_id: str):
+    """
+    Everything recorded about a generated scene: prompt, code, video,
+    quality, stage timings and outcome
+    """
+    scene = await asyncio.get_running_loop().run_in_executor(None, scene_index.get, scene_id)
+    if scene is None:
+        raise HTTPException(status_code=404, detail="Scene not found")
+    return scene
+
+@router.api_route("/videos/{video_id}", methods=["GET", "HEAD"])
+async def get_video(video_id: str, request: Request):
+    """
+    Serve a video by its ID from local storage, with range and ETag support.
+    The ID names the file without its extension, whatever the output format.
+    """
+    if not VIDEO_ID_PATTERN.match(video_id):
         raise HTTPException(status_code=404, detail="Video not found")
     
-    return FileResponse(str(video_path), media_type="video/mp4") 
\ No newline at end of file
+    for ext in FORMATS:
+        path = VIDEO_DIR / f"{video_id}.{ext}"
+        if path.exists():
+            return serve_video(path, request)
+    raise HTTPException(status_code=404, detail="Video not found")
@@ -0,0 +1,196 @@
+"""
+Persistent index of generated scenes: what was asked, what code rendered,
+where the video is and how it went. Backs GET /api/scenes and
+/api/scenes/{id} with indexed lookups instead of walks over the video and
+code directories.
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from pathlib import Path
+
+from app.api.prompt_cache import normalize_prompt
+
+logger = logging.getLogger(__name__)
+
+WORKSPACE_ROOT = Path(__file__).parent.parent.parent.absolute()
+SCENE_INDEX_ENABLED = os.getenv("SCENE_INDEX_ENABLED", "1") != "0"
+SCENE_INDEX_PATH = Path(os.getenv("SCENE_INDEX_PATH", str(WORKSPACE_ROOT / "app" / "scene-index.db")))
+SCENE_PAGE_SIZE = 50
+SCENE_MAX_PAGE_SIZE = 500
+
+# Columns returned by listings; the detail view adds the code and prompt text
+SUMMARY_COLUMNS = (
+    "seq", "id", "lineage_id", "created_at", "finished_at", "outcome", "prompt_hash", "code_hash",
+    "video_url", "quality", "profile", "hd_status", "cached", "duration", "timings"
+)
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def prompt_hash(prompt: str) -> str:
+    """Hash of a prompt's case- and whitespace-insensitive form, as the prompt cache matches them"""
+    return text_hash(normalize_prompt(prompt))
+
+
+class SceneIndex:
+    """
+    Scenes in one SQLite database (WAL mode), one row per generation
+    request. `seq` orders rows by insertion and is the pagination cursor,
+    so every listing is a range scan on an index, newest first.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS scenes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            id TEXT NOT NULL UNIQUE,
+            lineage_id TEXT,
+            created_at REAL NOT NULL,
+            finished_at REAL NOT NULL,
+            outcome TEXT NOT NULL,
+            prompt TEXT NOT NULL,
+            prompt_hash TEXT NOT NULL,
+            code TEXT,
+            code_hash TEXT,
+            video_url TEXT,
+            quality TEXT,
+            profile TEXT,
+            hd_status TEXT,
+            cached INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            duration REAL,
+            timings TEXT
+        );
+        CREATE INDEX IF NOT EXISTS scenes_by_outcome ON scenes (outcome, seq);
+        CREATE INDEX IF NOT EXISTS scenes_by_prompt ON scenes (prompt_hash, seq);
+        CREATE INDEX IF NOT EXISTS scenes_by_code ON scenes (code_hash, seq);
+        CREATE INDEX IF NOT EXISTS scenes_by_lineage ON scenes (lineage_id, seq);
+    """
+    # Listing filters -> their column, each covered by an index above
+    FILTERS = ("outcome", "prompt_hash", "code_hash", "lineage_id")
+
+    def __init__(self, path: Path = SCENE_INDEX_PATH, enabled: bool = SCENE_INDEX_ENABLED):
+        self.path = Path(path)
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._db = None
+
+    def _connection(self):
+        # Opened on first use so importing the app does not create the database
+        if self._db is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(str(self.path), timeout=5, isolation_level=None, check_same_thread=False)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.executescript(self.SCHEMA)
+            self._db = db
+        return self._db
+
+    def _execute(self, sql: str, parameters=()):
+        with self._lock:
+            return self._connection().execute(sql, parameters).fetchall()
+
+    @staticmethod
+    def _scene(row) -> dict:
+        scene = dict(row)
+        for field in ("profile", "timings"):
+            if scene.get(field) is not None:
+                scene[field] = json.loads(scene[field])
+        if "cached" in scene:
+            scene["cached"] = bool(scene["cached"])
+        return scene
+
+    def record(self, scene_id: str, prompt: str, outcome: str, created_at: float, duration: float,
+               timings: dict = None, response=None, quality: str = None, profile: dict = None,
+               cached: bool = False, error: str = None):
+        """
+        Record a finished generation request; `response` is its
+        SceneResponse, or None if the request raised or was cancelled.
+        Failures to write are logged, never raised.
+        """
+        if not self.enabled:
+            return
+        code = response.code if response is not None else None
+        try:
+            self._execute(
+                "INSERT OR REPLACE INTO scenes (id, lineage_id, created_at, finished_at, outcome, prompt, "
+                "prompt_hash, code, code_hash, video_url, quality, profile, hd_status, cached, error, "
+                "duration, timings) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    scene_id,
+                    response.lineage_id if response is not None else None,
+                    created_at,
+                    time.time(),
+                    outcome,
+                    prompt,
+                    prompt_hash(prompt),
+                    code,
+                    text_hash(code) if code else None,
+                    response.video_url if response is not None else None,
+                    quality,
+                    json.dumps(profile) if profile is not None else None,
+                    response.hd_status if response is not None else None,
+                    int(cached),
+                    response.error if response is not None else error,
+                    round(duration, 4),
+                    json.dumps(timings) if timings else None,
+                )
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Could not index scene {scene_id}: {str(e)}")
+
+    def update_video(self, scene_id: str, video_url: str, hd_status: str, quality: str = None):
+        """Record the outcome of a progressive scene's HD upgrade"""
+        if not self.enabled:
+            return
+        try:
+            self._execute(
+                "UPDATE scenes SET video_url = COALESCE(?, video_url), hd_status = ?, "
+                "quality = COALESCE(?, quality) WHERE id = ?",
+                (video_url, hd_status, quality, scene_id)
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Could not update indexed scene {scene_id}: {str(e)}")
+
+    def get(self, scene_id: str):
+        """Everything recorded for a scene, or None"""
+        if not self.enabled:
+            return None
+        rows = self._execute("SELECT * FROM scenes WHERE id = ?", (scene_id,))
+        return self._scene(rows[0]) if rows else None
+
+    def list(self, limit: int = SCENE_PAGE_SIZE, cursor: int = None, **filters) -> tuple:
+        """
+        Up to `limit` scene summaries, newest first, matching the given
+        FILTERS. Pass the returned cursor back to get the next page; it is
+        None after the last page. Returns (scenes, next_cursor).
+        """
+        if not self.enabled:
+            return [], None
+        conditions = []
+        parameters = []
+        for name in self.FILTERS:
+            if filters.get(name) is not None:
+                conditions.append(f"{name} = ?")
+                parameters.append(filters[name])
+        if cursor is not None:
+            conditions.append("seq < ?")
+            parameters.append(cursor)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        # One extra row tells whether there is a next page
+        rows = self._execute(
+            f"SELECT {', '.join(SUMMARY_COLUMNS)} FROM scenes {where} ORDER BY seq DESC LIMIT ?",
+            (*parameters, limit + 1)
+        )
+        scenes = [self._scene(row) for row in rows[:limit]]
+        next_cursor = scenes[-1]["seq"] if len(rows) > limit else None
+        return scenes, next_cursor
+
+
+scene_index = SceneIndex()
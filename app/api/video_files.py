@@ -0,0 +1,107 @@
+import os
+import re
+from pathlib import Path
+
+from fastapi import HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+
+from app.workers.render_cache import KEY_LENGTH
+from app.workers.storage import touch
+
+CHUNK_SIZE = 256 * 1024
+
+# Content-addressed videos (<render cache key>.<format>) never change
+IMMUTABLE_NAME = re.compile(rf"^[0-9a-f]{{{KEY_LENGTH}}}\.(mp4|webm|gif)$")
+MEDIA_TYPES = {".mp4": "video/mp4", ".webm": "video/webm", ".gif": "image/gif"}
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _etag(path: Path, stat: os.stat_result) -> str:
+    if IMMUTABLE_NAME.match(path.name):
+        return f'"{path.stem}"'
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def _parse_range(header: str, size: int):
+    """
+    Parse a single "bytes=start-end" range into an inclusive (start, end).
+    Returns None for headers we serve as a full response (multiple ranges,
+    other units) and raises ValueError when the range is unsatisfiable.
+    """
+    match = _RANGE.match(header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        # Suffix range: the last N bytes
+        length = int(end)
+        if length == 0:
+            raise ValueError("empty suffix range")
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError("range not satisfiable")
+    return start, end
+
+
+def _read(path: Path, start: int, length: int):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def serve_video(path: Path, request: Request) -> Response:
+    """
+    Serve a video (MP4, WebM or GIF) with byte-range support (206), strong ETags and
+    conditional requests. Content-addressed files are marked immutable.
+    """
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Video not found")
+
+    # Served files count as recently used for quota eviction
+    touch(path)
+    etag = _etag(path, stat)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Cache-Control": ("public, max-age=31536000, immutable"
+                          if IMMUTABLE_NAME.match(path.name) else "no-cache"),
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    size = stat.st_size
+    byte_range = None
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    # A stale If-Range means the client's partial copy is outdated: send everything
+    if range_header and (not if_range or if_range.strip() == etag):
+        try:
+            byte_range = _parse_range(range_header, size)
+        except ValueError:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+
+    media_type = MEDIA_TYPES.get(path.suffix, "video/mp4")
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(_read(path, 0, size), media_type=media_type, headers=headers)
+
+    start, end = byte_range
+    length = end - start + 1
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(length)
+    return StreamingResponse(_read(path, start, length), status_code=206,
+                             media_type=media_type, headers=headers)
@@ -0,0 +1,61 @@
+"""
+End-to-end request deadlines. A job carries one absolute deadline (wall
+clock, so it can cross into render workers on other processes and nodes);
+every stage asks for its share of what is left and is skipped when too
+little remains.
+"""
+import os
+import time
+import contextvars
+from typing import Optional
+
+# Budget of a generation request from submission to response, queueing included
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "120"))
+MAX_REQUEST_DEADLINE_SECONDS = float(os.getenv("MAX_REQUEST_DEADLINE_SECONDS", "600"))
+# A stage is not started with less time than this left
+MIN_STAGE_SECONDS = float(os.getenv("DEADLINE_MIN_STAGE_SECONDS", "2"))
+
+# Deadline (time.time()) of the job the current task is working for; None is unbounded
+current_deadline = contextvars.ContextVar("current_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a stage cannot start, or finish, within the request's deadline"""
+    def __init__(self, stage: str):
+        super().__init__(f"Request deadline exceeded during {stage}")
+        self.stage = stage
+
+
+def deadline_after(seconds: Optional[float] = None) -> float:
+    """Deadline `seconds` (default REQUEST_DEADLINE_SECONDS, at most the maximum) from now"""
+    seconds = REQUEST_DEADLINE_SECONDS if seconds is None else seconds
+    return time.time() + min(seconds, MAX_REQUEST_DEADLINE_SECONDS)
+
+
+def remaining(deadline: Optional[float] = None) -> Optional[float]:
+    """Seconds left until `deadline` (default: the current one), or None without a deadline"""
+    if deadline is None:
+        deadline = current_deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.time()
+
+
+def fits(seconds: float, deadline: Optional[float] = None) -> bool:
+    """Whether `seconds` of work can still finish before the deadline"""
+    left = remaining(deadline)
+    return left is None or left >= seconds
+
+
+def budget(limit: float, stage: str, deadline: Optional[float] = None) -> float:
+    """
+    Timeout for a stage normally limited to `limit` seconds: the smaller of
+    that and the time left. Raises DeadlineExceeded if less than
+    MIN_STAGE_SECONDS is left.
+    """
+    left = remaining(deadline)
+    if left is None:
+        return limit
+    if left < MIN_STAGE_SECONDS:
+        raise DeadlineExceeded(stage)
+    return min(limit, left)
@@ -0,0 +1,35 @@
+import os
+import random
+import logging
+
+# Root log level; DEBUG output includes per-render details
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Fraction of DEBUG records kept (1 keeps all); WARNING and above are never sampled
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "1"))
+LOG_INFO_SAMPLE_RATE = float(os.getenv("LOG_INFO_SAMPLE_RATE", "1"))
+
+
+class SamplingFilter(logging.Filter):
+    """Drop a random share of low-severity records to bound log volume under load"""
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(record.levelno, 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+
+def configure_logging():
+    """
+    Configure the root logger once per process (the app and each render
+    worker). Does nothing if handlers are already installed.
+    """
+    root = logging.getLogger()
+    if root.handlers:
+        return
+    logging.basicConfig(level=getattr(logging, LOG_LEVEL, logging.INFO),
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    sampling = SamplingFilter({logging.DEBUG: LOG_DEBUG_SAMPLE_RATE, logging.INFO: LOG_INFO_SAMPLE_RATE})
+    for handler in root.handlers:
+        handler.addFilter(sampling)
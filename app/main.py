@@ -1,18 +1,38 @@
 from fastapi import FastAPI, Request, Depends, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 import os
+import re
 from pathlib import Path
 from dotenv import load_dotenv
 
-from app.api.routes import router as api_router
-
 # Load environment variables
 load_dotenv()
 
+from app.log_config import configure_logging
+
+configure_logging()
+
+from app.api.routes import router as api_router
+from app.api.llm import start_client, close_client
+from app.api.video_files import serve_video
+from app.workers.manim_worker import VIDEO_DIR
+from app.workers.jobs import job_manager
+from app.metrics import REGISTRY, Gauge
+
 app = FastAPI(title="Manim Video Generator")
 
+VIDEO_FILENAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]+\.(mp4|webm|gif)$")
+
+# Rendered videos get range requests, ETags and caching headers; this route
+# must be registered before the /static mount, which would otherwise shadow it
+@app.api_route("/static/videos/{filename}", methods=["GET", "HEAD"])
+async def get_static_video(filename: str, request: Request):
+    if not VIDEO_FILENAME_PATTERN.match(filename):
+        raise HTTPException(status_code=404, detail="Video not found")
+    return serve_video(VIDEO_DIR / filename, request)
+
 # Mount static files
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
@@ -26,6 +46,27 @@ templates = Jinja2Templates(directory=templates_dir)
 # Include API routes
 app.include_router(api_router, prefix="/api")
 
+REGISTRY.register(Gauge("manim_jobs", "Known jobs by status", ("status",),
+                        collect=job_manager.status_counts))
+if job_manager.render_queue is not None:
+    REGISTRY.register(Gauge("manim_render_queue_tasks", "Render queue tasks by status", ("status",),
+                            collect=job_manager.render_queue.counts))
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus scrape endpoint"""
+    return PlainTextResponse(REGISTRY.expose(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.on_event("startup")
+async def startup():
+    start_client()
+    job_manager.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await job_manager.shutdown()
+    await close_client()
+
 # Create a simple HTML form
 @app.get("/", response_class=HTMLResponse)
 async def get_form(request: Request):
@@ -108,7 +149,7 @@ async def get_form(request: Request):
         </div>
         
         <div class="loading">
-            <p>Generating animation... This may take up to 30 seconds.</p>
+            <p id="status">Generating animation...</p>
         </div>
         
         <div class="result" id="result">
@@ -127,6 +168,23 @@ async def get_form(request: Request):
         </div>
         
         <script>
+            async function upgradeToHd(jobId, videoElement) {
+                while (true) {
+                    await new Promise(resolve => setTimeout(resolve, 2000));
+                    const job = await (await fetch(`/api/jobs/${jobId}`)).json();
+                    const scene = job.result || {};
+                    if (scene.hd_status === 'ready') {
+                        const position = videoElement.currentTime;
+                        videoElement.src = scene.hd_url;
+                        videoElement.currentTime = position;
+                        return;
+                    }
+                    if (scene.hd_status !== 'pending') {
+                        return;
+                    }
+                }
+            }
+            
             document.getElementById('generate').addEventListener('click', async function() {
                 const prompt = document.getElementById('prompt').value;
                 if (!prompt) {
@@ -138,8 +196,16 @@ async def get_form(request: Request):
                 document.querySelector('.loading').style.display = 'block';
                 document.getElementById('result').style.display = 'none';
                 
+                // Show the result panel early so code can stream into it
+                const codeElement = document.getElementById('code');
+                const statusElement = document.getElementById('status');
+                codeElement.textContent = '';
+                document.getElementById('error').textContent = '';
+                document.getElementById('video-container').style.display = 'none';
+                document.getElementById('result').style.display = 'block';
+                
                 try {
-                    const response = await fetch('/api/generate', {
+                    const response = await fetch('/api/generate/stream', {
                         method: 'POST',
                         headers: {
                             'Content-Type': 'application/json'
@@ -149,7 +215,45 @@ async def get_form(request: Request):
                         })
                     });
                     
-                    const data = await response.json();
+                    if (!response.ok) {
+                        const failure = await response.json();
+                        throw new Error(failure.detail || 'Failed to queue animation');
+                    }
+                    
+                    // Read server-sent events until the result (or an error) arrives
+                    let data = {success: false, error: 'Stream ended unexpectedly', code: ''};
+                    let jobId = null;
+                    const reader = response.body.getReader();
+                    const decoder = new TextDecoder();
+                    let buffer = '';
+                    while (true) {
+                        const {value, done} = await reader.read();
+                        if (done) break;
+                        buffer += decoder.decode(value, {stream: true});
+                        let boundary;
+                        while ((boundary = buffer.indexOf('\\n\\n')) >= 0) {
+                            const message = buffer.slice(0, boundary);
+                            buffer = buffer.slice(boundary + 2);
+                            const event = (message.match(/^event: (.*)$/m) || [])[1];
+                            const payload = JSON.parse((message.match(/^data: (.*)$/m) || [])[1] || '{}');
+                            if (event === 'job') {
+                                jobId = payload.id;
+                            } else if (event === 'token') {
+                                codeElement.textContent += payload.text;
+                            } else if (event === 'code') {
+                                codeElement.textContent = payload.code;
+                            } else if (event === 'stage') {
+                                statusElement.textContent = payload.stage.charAt(0).toUpperCase() + payload.stage.slice(1)
+                                    + (payload.quality ? ` (${payload.quality})` : '') + '...';
+                            } else if (event === 'progress') {
+                                statusElement.textContent = `Rendering animation ${payload.animation}: ${payload.percent}%`;
+                            } else if (event === 'result') {
+                                data = payload;
+                            } else if (event === 'error') {
+                                data = {success: false, error: payload.detail, code: codeElement.textContent};
+                            }
+                        }
+                    }
                     
                     // Hide loading
                     document.querySelector('.loading').style.display = 'none';
@@ -165,6 +269,11 @@ async def get_form(request: Request):
                         
                         // Display code
                         document.getElementById('code').textContent = data.code;
+                        
+                        // A preview was returned; swap in the HD render once it is ready
+                        if (data.hd_status === 'pending' && jobId) {
+                            upgradeToHd(jobId, videoElement);
+                        }
                     } else {
                         document.getElementById('error').textContent = data.error || 'Failed to generate animation';
                         document.getElementById('video-container').style.display = 'none';
@@ -191,5 +300,7 @@ if __name__ == "__main__":
         host="0.0.0.0", 
         port=8000, 
         reload=True,
-        reload_excludes=["app/manim-code/*", "app/static/videos/*"]
+        reload_excludes=["app/manim-code/*", "app/static/videos/*", "app/prompt-cache/*", "app/render-staging/*",
+                         "app/profiles/*", "app/render-lineages/*",
+                         "app/asset-cache/*", "app/render-queue.db*", "app/scene-index.db*"]
     ) 
\ No newline at end of file
@@ -0,0 +1,277 @@
+"""
+In-process metrics with Prometheus text exposition, and per-request spans.
+
+Metrics live in the API process. Render workers run in other processes, so
+they time their stages with a Stopwatch and return the timings in the
+result dict; the API side records them with `record_render`.
+"""
+import json
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Seconds; covers sub-millisecond validation up to multi-minute renders
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SIZE_BUCKETS = (64e3, 256e3, 1e6, 4e6, 16e6, 64e6, 256e6)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def expose(self) -> list:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def expose(self) -> list:
+        lines = super().expose()
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Gauge(Metric):
+    """A gauge whose labelled values are read from `collect()` at scrape time"""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), collect=None):
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+
+    def expose(self) -> list:
+        lines = super().expose()
+        if self.collect is None:
+            return lines
+        try:
+            values = self.collect()
+        except Exception as e:
+            logger.warning(f"Could not collect {self.name}: {str(e)}")
+            return lines
+        for key, value in sorted(values.items()):
+            key = key if isinstance(key, tuple) else (key,) if self.labelnames else ()
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (),
+                 buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][index] += 1
+                    break
+            series["sum"] += value
+            series["count"] += 1
+
+    def count(self, **labels) -> int:
+        series = self._series.get(self._key(labels))
+        return series["count"] if series else 0
+
+    def expose(self) -> list:
+        lines = super().expose()
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series["counts"]):
+                    cumulative += count
+                    le = f'le="{_number(bound)}"'
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+                labels = _labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_number(series['sum'])}")
+                lines.append(f"{self.name}_count{labels} {series['count']}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def expose(self) -> str:
+        """All metrics in the Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+stage_seconds = REGISTRY.register(Histogram(
+    "manim_stage_duration_seconds", "Time spent per pipeline stage", ("stage",)))
+render_seconds = REGISTRY.register(Histogram(
+    "manim_render_duration_seconds", "Manim render time per quality attempt", ("quality", "outcome")))
+video_bytes = REGISTRY.register(Histogram(
+    "manim_video_size_bytes", "Size of rendered videos", ("quality",), SIZE_BUCKETS))
+llm_tokens = REGISTRY.register(Histogram(
+    "manim_llm_tokens", "Tokens per LLM call", ("call", "kind"), TOKEN_BUCKETS))
+requests_total = REGISTRY.register(Counter(
+    "manim_requests_total", "Generation requests by outcome", ("outcome",)))
+retries_total = REGISTRY.register(Counter(
+    "manim_retries_total", "Retries: LLM repairs and lower-quality re-renders", ("kind",)))
+timeouts_total = REGISTRY.register(Counter(
+    "manim_timeouts_total", "Operations that timed out", ("stage",)))
+fallbacks_total = REGISTRY.register(Counter(
+    "manim_fallbacks_total", "Degraded paths taken instead of the preferred one", ("kind",)))
+candidates_total = REGISTRY.register(Counter(
+    "manim_speculative_candidates_total", "Speculative candidates by outcome", ("outcome",)))
+rejected_total = REGISTRY.register(Counter(
+    "manim_rejected_requests_total", "Requests turned away by admission control", ("reason",)))
+cache_total = REGISTRY.register(Counter(
+    "manim_cache_requests_total", "Cache lookups by cache and result", ("cache", "result")))
+
+
+class Stopwatch:
+    """
+    Named durations and counts for one render. Plain dicts so the result
+    can cross the process pool boundary.
+    """
+    def __init__(self):
+        self.timings = {}
+        self.counts = {}
+
+    @contextmanager
+    def time(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+    def count(self, name: str, amount: int = 1):
+        self.counts[name] = self.counts.get(name, 0) + amount
+
+
+class Trace:
+    """Spans of one generation request, logged as a single structured line at the end"""
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.start = time.perf_counter()
+        self.spans = []
+        self.attributes = {}
+
+    def add(self, name: str, duration: float, **attributes):
+        span = {"name": name, "duration": round(duration, 4)}
+        span.update(attributes)
+        self.spans.append(span)
+
+    def log(self, outcome: str):
+        logger.info(json.dumps({
+            "trace": self.request_id,
+            "outcome": outcome,
+            "duration": round(time.perf_counter() - self.start, 4),
+            **self.attributes,
+            "spans": self.spans,
+        }))
+
+
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+@contextmanager
+def span(stage: str, **attributes):
+    """Time a block: observe manim_stage_duration_seconds and add a span to the current trace"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        stage_seconds.observe(duration, stage=stage)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add(stage, duration, **attributes)
+
+
+def record_render(result: dict):
+    """Record the timings and counts a render worker returned in its result"""
+    trace = current_trace.get()
+    for name, duration in result.get("timings", {}).items():
+        stage, _, quality = name.partition(" ")
+        if stage == "render":
+            outcome = "ok" if result["success"] and quality == result.get("quality") else "failed"
+            render_seconds.observe(duration, quality=quality, outcome=outcome)
+        stage_seconds.observe(duration, stage=stage)
+        if trace is not None:
+            trace.add(name, duration)
+
+    counts = result.get("counts", {})
+    if counts.get("quality_fallback"):
+        retries_total.inc(counts["quality_fallback"], kind="quality")
+        fallbacks_total.inc(counts["quality_fallback"], kind="lower_quality")
+    if counts.get("timeout"):
+        timeouts_total.inc(counts["timeout"], stage="render")
+    if counts.get("deadline_skip"):
+        fallbacks_total.inc(counts["deadline_skip"], kind="deadline_skip")
+    if counts.get("faststart_failed"):
+        fallbacks_total.inc(counts["faststart_failed"], kind="no_faststart")
+    if counts.get("asset_hits"):
+        cache_total.inc(counts["asset_hits"], cache="tex", result="hit")
+    if counts.get("asset_misses"):
+        cache_total.inc(counts["asset_misses"], cache="tex", result="miss")
+    if counts.get("partial_movie_hits"):
+        cache_total.inc(counts["partial_movie_hits"], cache="partial_movie", result="hit")
+    if "cached" in result:
+        cache_total.inc(cache="render", result="hit" if result["cached"] else "miss")
+    if result.get("size") is not None:
+        video_bytes.observe(result["size"], quality=result.get("quality") or "")
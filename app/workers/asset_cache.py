@@ -0,0 +1,241 @@
+import os
+import errno
+import shutil
+import logging
+import itertools
+from pathlib import Path
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: views cannot be locked, so renders do not share assets
+    fcntl = None
+
+from app.workers.storage import StorageQuota, touch
+from app.workers.render_cache import MANIM_VERSION
+from app.workers.render_limits import open_lock, close_lock
+
+logger = logging.getLogger(__name__)
+
+ASSET_CACHE_ENABLED = os.getenv("ASSET_CACHE_ENABLED", "1") != "0"
+# Keep on the same filesystem as the render directories so seeding is hard links
+ASSET_CACHE_DIR = Path(os.getenv(
+    "ASSET_CACHE_DIR", str(Path(__file__).parent.parent.parent.absolute() / "app" / "asset-cache")
+))
+# Limits per asset kind (LaTeX and text)
+ASSET_CACHE_MAX_BYTES = int(os.getenv("ASSET_CACHE_MAX_BYTES", str(512 * 1024 ** 2)))
+ASSET_CACHE_MAX_FILES = int(os.getenv("ASSET_CACHE_MAX_FILES", "20000"))
+
+# Manim's tex_dir and text_dir. Both hold SVGs named after a hash of
+# everything that affects them (expression and TeX template, or text and
+# font settings).
+TEX_DIR = "Tex"
+TEXT_DIR = "texts"
+KINDS = (TEX_DIR, TEXT_DIR)
+VIEWS_DIR = "views"
+LOCK_FILE = ".lock"
+# A journal is rewritten with only the live entries once it is this many
+# times the size a full cache's entries would take
+JOURNAL_COMPACT_RATIO = 4
+JOURNAL_LINE_BYTES = 64
+
+
+def _link(source: Path, destination: Path) -> bool:
+    """
+    Atomically make `destination` a copy of the finished file `source`: a
+    hard link, or a copy renamed into place across filesystems. Returns
+    False if `destination` already exists.
+    """
+    try:
+        os.link(source, destination)
+        return True
+    except FileExistsError:
+        return False
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+    if destination.exists():
+        return False
+    partial = destination.with_name(f".{destination.name}.{os.getpid()}.part")
+    shutil.copy2(source, partial)
+    os.replace(partial, destination)
+    return True
+
+
+def _svgs(directory: Path) -> dict:
+    """name -> path of the finished SVGs in `directory`"""
+    try:
+        return {
+            entry.name: Path(entry.path) for entry in os.scandir(directory)
+            if entry.name.endswith(".svg") and not entry.name.startswith(".")
+        }
+    except FileNotFoundError:
+        return {}
+
+
+class AssetCache:
+    """
+    LaTeX and text SVGs shared by every render.
+
+    Renders never write into the shared directories. Each render gets a
+    view for Manim's tex_dir and text_dir: a directory of its own, locked
+    while it renders and kept afterwards for the next render, holding hard
+    links to the shared SVGs. The SVGs it compiled are published back
+    afterwards (`collect`), by an atomic link or rename, so concurrent
+    renders cannot see a partial file.
+
+    Every publication and eviction is appended to a journal per kind, and
+    a view remembers how far it has read it. Bringing a view up to date
+    (`view`) therefore only links what was published, and removes what was
+    evicted, since that view was last used. Least recently used entries are
+    evicted beyond the limits.
+    """
+    def __init__(self, directory: Path = ASSET_CACHE_DIR, max_bytes: int = ASSET_CACHE_MAX_BYTES,
+                 max_files: int = ASSET_CACHE_MAX_FILES, enabled: bool = ASSET_CACHE_ENABLED):
+        # Hashes are only comparable within one manim version
+        self.directory = Path(directory) / MANIM_VERSION
+        self.enabled = enabled and fcntl is not None
+        self.journal_max_bytes = JOURNAL_COMPACT_RATIO * JOURNAL_LINE_BYTES * max_files
+        self.quotas = {
+            kind: StorageQuota(self.directory / kind, max_bytes, max_files,
+                               on_evict=lambda path, kind=kind: self._journal(kind, "-", path.name))
+            for kind in KINDS
+        }
+
+    @contextmanager
+    def view(self):
+        """
+        Yield the Manim config values (tex_dir, text_dir) of an up to date
+        view for one render, or {} when the cache is disabled. The view is
+        the render's until the block exits.
+        """
+        if not self.enabled:
+            yield {}
+            return
+        views = self.directory / VIEWS_DIR
+        for index in itertools.count():
+            path = views / str(index)
+            path.mkdir(parents=True, exist_ok=True)
+            fd = open_lock(path / LOCK_FILE)
+            if fd is not None:
+                break
+        try:
+            for kind in KINDS:
+                self._sync(path, kind)
+            yield {"tex_dir": str(path / TEX_DIR), "text_dir": str(path / TEXT_DIR)}
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            close_lock(fd)
+
+    def collect(self, tex_dir: str, text_dir: str, started: float) -> tuple:
+        """
+        Publish the SVGs a successful render compiled in its view and
+        refresh the entries it used. Returns (hits, misses) for LaTeX
+        expressions, where a hit is an SVG that existed before `started`.
+        """
+        if not self.enabled:
+            return 0, 0
+        hits = misses = 0
+        for kind, directory in ((TEX_DIR, Path(tex_dir)), (TEXT_DIR, Path(text_dir))):
+            shared = self.directory / kind
+            shared.mkdir(parents=True, exist_ok=True)
+            entries = list(os.scandir(directory))
+            for entry in entries:
+                if entry.name.startswith(".") or not entry.name.endswith(".svg"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if stat.st_size and stat.st_mtime >= started and _link(Path(entry.path), shared / entry.name):
+                    self._journal(kind, "+", entry.name)
+            if kind == TEX_DIR:
+                # Manim writes <hash>.tex for every expression it typesets
+                # whose .tex is missing, and views only keep the SVGs, so
+                # fresh .tex files are the expressions this render used
+                for entry in entries:
+                    if not entry.name.endswith(".tex"):
+                        continue
+                    svg = Path(entry.path).with_suffix(".svg")
+                    try:
+                        fresh = entry.stat().st_mtime >= started
+                        compiled = svg.stat().st_mtime >= started
+                    except FileNotFoundError:
+                        fresh = False
+                    if fresh and compiled:
+                        misses += 1
+                    elif fresh:
+                        hits += 1
+                        touch(shared / svg.name)
+                    Path(entry.path).unlink(missing_ok=True)
+            self.quotas[kind].enforce()
+        if hits or misses:
+            logger.debug(f"LaTeX assets for {tex_dir}: {hits} cached, {misses} compiled")
+        return hits, misses
+
+    def _journal(self, kind: str, change: str, name: str):
+        with open(self.directory / f"{kind}.journal", "a") as journal:
+            journal.write(f"{change}{name}\n")
+
+    def _sync(self, view: Path, kind: str):
+        """Apply the journal entries `view` has not seen yet"""
+        target = view / kind
+        target.mkdir(parents=True, exist_ok=True)
+        shared = self.directory / kind
+        journal_path = self.directory / f"{kind}.journal"
+        state_path = view / f".{kind}.synced"
+        try:
+            journal = open(journal_path)
+        except FileNotFoundError:
+            return
+        with journal:
+            inode = os.fstat(journal.fileno()).st_ino
+            try:
+                saved_inode, offset = map(int, state_path.read_text().split())
+            except (FileNotFoundError, ValueError):
+                saved_inode, offset = None, 0
+            if saved_inode != inode:
+                # New view, or the journal was compacted: compare the directories once
+                present = _svgs(target)
+                wanted = _svgs(shared)
+                for name in present.keys() - wanted.keys():
+                    present[name].unlink(missing_ok=True)
+                for name in wanted.keys() - present.keys():
+                    self._link_entry(wanted[name], target / name)
+                journal.seek(0, os.SEEK_END)
+                lines = None
+            else:
+                journal.seek(offset)
+                lines = journal.read()
+            end = journal.tell()
+        if lines:
+            # A line still being appended is read next time
+            complete = lines[:lines.rfind("\n") + 1]
+            end = offset + len(complete.encode())
+            for line in complete.splitlines():
+                change, name = line[:1], line[1:]
+                if change == "+":
+                    self._link_entry(shared / name, target / name)
+                elif change == "-":
+                    (target / name).unlink(missing_ok=True)
+        state_path.write_text(f"{inode} {end}")
+        if end > self.journal_max_bytes:
+            self._compact(kind)
+
+    @staticmethod
+    def _link_entry(source: Path, destination: Path):
+        try:
+            _link(source, destination)
+        except FileNotFoundError:
+            pass  # evicted meanwhile
+
+    def _compact(self, kind: str):
+        """Rewrite a journal with only the live entries; views then resynchronize once"""
+        journal_path = self.directory / f"{kind}.journal"
+        partial = journal_path.with_name(f".{journal_path.name}.{os.getpid()}")
+        partial.write_text("".join(f"+{name}\n" for name in _svgs(self.directory / kind)))
+        os.replace(partial, journal_path)
+        logger.info(f"Compacted the {kind} asset journal")
+
+
+asset_cache = AssetCache()
@@ -0,0 +1,474 @@
+import os
+import math
+import time
+import uuid
+import heapq
+import asyncio
+import logging
+import itertools
+import threading
+import contextvars
+import multiprocessing
+from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor
+
+from app.workers.manim_worker import init_render_worker, run_manim_code, DEFAULT_QUALITIES
+from app.workers.segments import count_animations, plan_segments
+from app.workers.render_queue import RENDER_BACKEND, open_queue, render_remote
+from app.metrics import stage_seconds
+from app.deadlines import current_deadline
+
+logger = logging.getLogger(__name__)
+
+# Pool and queue limits, configurable through the environment
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(os.cpu_count() or 2)))
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", str(RENDER_WORKERS * 4)))
+MAX_QUEUED_JOBS = int(os.getenv("MAX_QUEUED_JOBS", "100"))
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", "3600"))
+
+# Priority lanes: each has its own (max running, max queued) job budget so
+# batch traffic cannot starve interactive requests
+LANES = {
+    "interactive": (MAX_CONCURRENT_JOBS, MAX_QUEUED_JOBS),
+    "batch": (
+        int(os.getenv("BATCH_MAX_CONCURRENT_JOBS", str(max(1, MAX_CONCURRENT_JOBS // 2)))),
+        int(os.getenv("BATCH_MAX_QUEUED_JOBS", "1000")),
+    ),
+}
+# Renders waiting for the pool are served in this order; background work
+# (HD upgrades) goes last
+LANE_PRIORITY = {"interactive": 0, "batch": 1, "background": 2}
+# Renders in flight on the pool across all lanes; more would only queue
+# inside the pool, where priorities no longer apply
+MAX_CONCURRENT_RENDERS = int(os.getenv("MAX_CONCURRENT_RENDERS", str(RENDER_WORKERS)))
+
+# Lane of the job the current task is working for
+current_lane = contextvars.ContextVar("current_lane", default="interactive")
+
+# Put on a channel after a render's last progress event, which follows
+# the render's result by at most this many seconds
+END_OF_EVENTS = None
+END_OF_EVENTS_TIMEOUT = 5
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while its lane's queue is at capacity"""
+    def __init__(self, message: str, retry_after: int = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class PrioritySemaphore:
+    """
+    A semaphore whose waiters are woken lowest priority value first
+    (FIFO within a priority)
+    """
+    def __init__(self, value: int):
+        self.value = value
+        self._waiters = []
+        self._counter = itertools.count()
+
+    async def acquire(self, priority: int = 0):
+        if self.value > 0 and not self._waiters:
+            self.value -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        entry = [priority, next(self._counter), future]
+        heapq.heappush(self._waiters, entry)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Woken and cancelled at the same time: pass the slot on
+                self.release()
+            else:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.value += 1
+
+    def try_acquire(self, count: int) -> int:
+        """Take up to `count` free units without waiting, none while anyone waits; returns how many"""
+        if self._waiters:
+            return 0
+        taken = max(0, min(count, self.value))
+        self.value -= taken
+        return taken
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+
+class ProgressSink:
+    """
+    The render side of a channel: puts progress events, tagged with the
+    channel's id, on a queue shared by every render of the process. Picklable,
+    so it can be passed to functions running on the pool.
+    """
+    def __init__(self, events, channel_id: int):
+        self.events = events
+        self.channel_id = channel_id
+
+    def put(self, event):
+        self.events.put((self.channel_id, event))
+
+    def close(self):
+        self.events.put((self.channel_id, END_OF_EVENTS))
+
+
+class Channel:
+    """
+    Progress events and cancellation of one render. `progress` and
+    `cancel` go to the render; its events arrive on an asyncio queue, see
+    `events`. Close it once the render is over.
+    """
+    def __init__(self, manager, channel_id: int, progress, cancel):
+        self.manager = manager
+        self.id = channel_id
+        self.progress = progress
+        self.cancel = cancel
+        self.queue = asyncio.Queue()
+
+    async def events(self, render: asyncio.Future):
+        """
+        Yield the progress events of `render` until it has finished and its
+        last event has arrived
+        """
+        while True:
+            if not render.done():
+                getter = asyncio.ensure_future(self.queue.get())
+                try:
+                    done, _ = await asyncio.wait({getter, render}, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    if not getter.done():
+                        getter.cancel()
+                if getter not in done:
+                    continue
+                event = getter.result()
+            elif render.cancelled() or render.exception() is not None:
+                # A render that raised may never have closed the channel
+                if self.queue.empty():
+                    return
+                event = self.queue.get_nowait()
+            else:
+                # The render returned; its last events may still be on their way
+                try:
+                    event = await asyncio.wait_for(self.queue.get(), END_OF_EVENTS_TIMEOUT)
+                except asyncio.TimeoutError:
+                    logger.warning(f"Render channel {self.id} was never closed")
+                    return
+            if event is END_OF_EVENTS:
+                # The worker closes the channel just before it returns, so
+                # the render's result can still be on its way
+                if not render.done():
+                    await asyncio.wait({render})
+                return
+            yield event
+
+    def close(self):
+        self.manager._channels.pop(self.id, None)
+
+
+class Job:
+    """
+    State of a single generation job
+    """
+    def __init__(self, job_id: str, prompt: str, lane: str = "interactive", deadline: float = None):
+        self.id = job_id
+        self.prompt = prompt
+        self.lane = lane
+        # time.time() by which the job should have finished; see app.deadlines
+        self.deadline = deadline
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.task = None
+
+
+class JobManager:
+    """
+    Runs generation jobs as asyncio tasks and their renders on a process pool.
+
+    Jobs are submitted to a lane (see LANES). In each lane at most
+    `max_concurrent` jobs run at once; further jobs wait in the queue and
+    submissions beyond `max_queued` waiting jobs are rejected. Renders from
+    all lanes share `max_renders` pool slots, handed out by lane priority.
+    
+    With a `render_queue` (RENDER_BACKEND=queue) renders are not run here
+    but sent to standalone render workers (app.workers.render_worker),
+    which claim them from the queue by lane priority.
+    """
+    def __init__(self, workers: int = RENDER_WORKERS, lanes: dict = LANES,
+                 max_renders: int = MAX_CONCURRENT_RENDERS,
+                 initializer=init_render_worker, render_queue=None):
+        self.workers = workers
+        self.render_queue = render_queue
+        self.initializer = initializer
+        self.lanes = lanes
+        self.max_renders = max_renders
+        self.jobs = {}
+        self.background = set()
+        self._pool = None
+        self._slots = None
+        self._renders = None
+        self._manager = None
+        # Pool renders put their progress events on one shared queue, which
+        # a single relay thread hands to the channels on the event loop
+        self._events = None
+        self._relay = None
+        self._channels = {}
+        self._channel_ids = itertools.count()
+        # Moving average of job run time per lane, for Retry-After estimates
+        self._durations = {lane: None for lane in lanes}
+
+    def start(self):
+        """Create the render pool; called on application startup"""
+        if self._slots is None and self.render_queue is not None:
+            logger.info("Sending renders to the render queue")
+            self._slots = {lane: asyncio.Semaphore(max_concurrent)
+                           for lane, (max_concurrent, _) in self.lanes.items()}
+        if self._pool is None and self.render_queue is None:
+            logger.info(f"Starting render pool with {self.workers} workers")
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             initializer=self.initializer)
+            self._slots = {lane: asyncio.Semaphore(max_concurrent)
+                           for lane, (max_concurrent, _) in self.lanes.items()}
+            self._renders = PrioritySemaphore(self.max_renders)
+
+    async def shutdown(self):
+        """Cancel outstanding jobs and stop the render pool"""
+        for job in self.jobs.values():
+            if job.task and not job.task.done():
+                job.task.cancel()
+        for task in self.background:
+            task.cancel()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        if self._events is not None:
+            self._events.put(None)
+            self._events = None
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
+
+    def queued(self, lane: str = None) -> int:
+        return sum(1 for job in self.jobs.values()
+                   if job.status == "queued" and (lane is None or job.lane == lane))
+
+    def retry_after(self, lane: str) -> int:
+        """Seconds until a queued job in `lane` would likely start"""
+        max_concurrent, _ = self.lanes[lane]
+        duration = self._durations[lane] or 30.0
+        return max(1, math.ceil(self.queued(lane) * duration / max_concurrent))
+
+    def status_counts(self) -> dict:
+        """Number of known jobs per status"""
+        counts = dict.fromkeys(("queued", "running", "completed", "failed", "cancelled"), 0)
+        for job in self.jobs.values():
+            counts[job.status] += 1
+        return counts
+
+    def submit(self, prompt: str, handler, lane: str = "interactive", deadline: float = None) -> Job:
+        """
+        Enqueue a job in `lane`. `handler` is an async callable taking the
+        Job and returning its result; it runs with the job's `deadline` as
+        current_deadline. Raises QueueFullError (with a retry_after
+        estimate) when the lane's queue is full.
+        """
+        self.start()
+        self._prune()
+        _, max_queued = self.lanes[lane]
+        if self.queued(lane) >= max_queued:
+            raise QueueFullError(f"The {lane} queue is full ({max_queued} jobs waiting)",
+                                 self.retry_after(lane))
+
+        job = Job(str(uuid.uuid4())[:8], prompt, lane, deadline)
+        self.jobs[job.id] = job
+        job.task = asyncio.create_task(self._run(job, handler))
+        return job
+
+    def spawn(self, coro) -> asyncio.Task:
+        """
+        Run follow-up work (e.g. an HD upgrade render) outside any job slot
+        and the job's deadline. The task is tracked so it is cancelled on
+        shutdown.
+        """
+        task = asyncio.create_task(self._background(coro))
+        self.background.add(task)
+        task.add_done_callback(self.background.discard)
+        return task
+
+    def get(self, job_id: str):
+        return self.jobs.get(job_id)
+
+    @asynccontextmanager
+    async def render_slots(self, wanted: int = 1):
+        """
+        Hold one of the shared render slots, waiting for it by the caller's
+        lane priority, plus up to `wanted` - 1 more that are idle right
+        now. Yields the number held.
+        """
+        self.start()
+        await self._renders.acquire(LANE_PRIORITY[current_lane.get()])
+        held = 1 + self._renders.try_acquire(wanted - 1)
+        try:
+            yield held
+        finally:
+            for _ in range(held):
+                self._renders.release()
+
+    async def run_in_pool(self, fn, *args):
+        """
+        Run a blocking function (e.g. a render) on the worker pool, waiting
+        for one of the shared render slots first (by the caller's lane priority)
+        """
+        async with self.render_slots():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._pool, fn, *args)
+
+    async def render(self, code: str, progress=None, cancel=None, qualities=DEFAULT_QUALITIES,
+                     lineage: str = None, profile: dict = None) -> dict:
+        """
+        Render on the pool, or through the render queue when there is one,
+        within the current job's deadline; see run_manim_code for the
+        arguments and result
+        """
+        deadline = current_deadline.get()
+        if self.render_queue is None:
+            # Segments of a long scene render at once, each using a slot's
+            # share of the CPUs; the render splits into no more segments than
+            # there are idle slots for, and never waits for extra ones
+            async with self.render_slots(len(plan_segments(count_animations(code)))) as slots:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._pool, _render_and_close, code, progress, cancel,
+                                                  qualities, lineage, profile, deadline, slots)
+        self.start()
+        payload = {"code": code, "qualities": list(qualities), "lineage": lineage, "profile": profile,
+                   "deadline": deadline}
+        try:
+            return await render_remote(self.render_queue, payload, LANE_PRIORITY[current_lane.get()],
+                                       progress, cancel)
+        finally:
+            if progress is not None:
+                progress.close()
+
+    def channel(self) -> Channel:
+        """
+        A Channel for one render: pass its `progress` and `cancel` to
+        render() to stream events back and to stop the render early
+        """
+        channel_id = next(self._channel_ids)
+        if self.render_queue is not None:
+            # Remote renders are relayed by render_remote on the event loop itself
+            channel = Channel(self, channel_id, None, threading.Event())
+            channel.progress = _LocalSink(channel.queue)
+        else:
+            if self._manager is None:
+                self._manager = multiprocessing.Manager()
+            if self._events is None:
+                self._events = self._manager.Queue()
+                self._relay = threading.Thread(
+                    target=self._relay_events, args=(self._events, asyncio.get_running_loop()),
+                    name="render-progress", daemon=True
+                )
+                self._relay.start()
+            channel = Channel(self, channel_id, ProgressSink(self._events, channel_id), self._manager.Event())
+        self._channels[channel_id] = channel
+        return channel
+
+    def _relay_events(self, events, loop):
+        """Relay thread: hand every render's progress events to its channel"""
+        while True:
+            try:
+                item = events.get()
+            except (EOFError, OSError):
+                return  # the manager has shut down
+            if item is None:
+                return
+            try:
+                loop.call_soon_threadsafe(self._deliver, *item)
+            except RuntimeError:
+                return  # the event loop is closed
+
+    def _deliver(self, channel_id: int, event):
+        channel = self._channels.get(channel_id)
+        if channel is not None:
+            channel.queue.put_nowait(event)
+
+    async def _background(self, coro):
+        current_lane.set("background")
+        current_deadline.set(None)
+        return await coro
+
+    async def _run(self, job: Job, handler):
+        current_lane.set(job.lane)
+        current_deadline.set(job.deadline)
+        try:
+            # A job can be cancelled while it still waits for its lane slot
+            async with self._slots[job.lane]:
+                job.status = "running"
+                job.started_at = time.time()
+                stage_seconds.observe(job.started_at - job.created_at, stage="queue")
+                try:
+                    job.result = await handler(job)
+                    job.status = "completed"
+                except Exception as e:
+                    logger.error(f"Job {job.id} failed: {str(e)}")
+                    job.error = str(e)
+                    job.status = "failed"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            raise
+        finally:
+            job.finished_at = time.time()
+            if job.started_at is not None:
+                duration = job.finished_at - job.started_at
+                average = self._durations[job.lane]
+                self._durations[job.lane] = duration if average is None else 0.8 * average + 0.2 * duration
+
+    def _prune(self):
+        """Forget finished jobs older than JOB_TTL_SECONDS"""
+        cutoff = time.time() - JOB_TTL_SECONDS
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job.finished_at and job.finished_at < cutoff]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+
+class _LocalSink:
+    """ProgressSink for events produced on the event loop"""
+    def __init__(self, events: asyncio.Queue):
+        self.events = events
+
+    def put(self, event):
+        self.events.put_nowait(event)
+
+    def close(self):
+        self.events.put_nowait(END_OF_EVENTS)
+
+
+def _render_and_close(code, progress, cancel, qualities, lineage, profile, deadline, max_segments):
+    """run_manim_code on the pool, then mark the end of its progress events"""
+    try:
+        return run_manim_code(code, progress, cancel, qualities, lineage, profile, deadline, max_segments)
+    finally:
+        if progress is not None:
+            try:
+                progress.close()
+            except Exception as e:
+                logger.debug(f"Could not close progress channel: {str(e)}")
+
+
+job_manager = JobManager(render_queue=open_queue() if RENDER_BACKEND == "queue" else None)
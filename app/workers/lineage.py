@@ -0,0 +1,170 @@
+import os
+import re
+import time
+import shutil
+import logging
+import tempfile
+from pathlib import Path
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: lineage directories are not shared between renders
+    fcntl = None
+
+from app.workers.storage import QUOTA_CHECK_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+WORKSPACE_ROOT = Path(__file__).parent.parent.parent.absolute()
+# Keep on the same filesystem as the video directory, like the staging directory
+LINEAGE_DIR = Path(os.getenv("LINEAGE_DIR", str(WORKSPACE_ROOT / "app" / "render-lineages")))
+LINEAGE_MAX_COUNT = int(os.getenv("LINEAGE_MAX_COUNT", "200"))
+LINEAGE_MAX_BYTES = int(os.getenv("LINEAGE_MAX_BYTES", str(5 * 1024 ** 3)))
+LINEAGE_TTL_SECONDS = int(os.getenv("LINEAGE_TTL_SECONDS", str(24 * 3600)))
+
+LINEAGE_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+LOCK_FILE = ".lock"
+CODE_FILE = "scene.py"
+
+
+def _dir_size(path: Path) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except FileNotFoundError:
+                pass
+    return total
+
+
+def _try_lock(path: Path):
+    """Exclusive non-blocking lock on `path`/.lock; returns the open fd or None"""
+    if fcntl is None:
+        return None
+    fd = os.open(path / LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def _unlock(fd: int):
+    fcntl.flock(fd, fcntl.LOCK_UN)
+    os.close(fd)
+
+
+class LineageStore:
+    """
+    Persistent Manim media directories, one per scene lineage (a scene and
+    its repairs and revisions). Rendering a revision in its lineage's
+    directory lets Manim reuse the partial movie files of every `play`
+    call that did not change.
+
+    A directory is used by one render at a time (a lock file shared across
+    worker processes); a render that finds it busy uses a throwaway
+    directory instead. Least recently used lineages are deleted beyond
+    `max_count`, `max_bytes` or `ttl`.
+    """
+    def __init__(self, directory: Path = LINEAGE_DIR, max_count: int = LINEAGE_MAX_COUNT,
+                 max_bytes: int = LINEAGE_MAX_BYTES, ttl: int = LINEAGE_TTL_SECONDS,
+                 check_interval: float = QUOTA_CHECK_INTERVAL):
+        self.directory = Path(directory)
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self._last_check = 0.0
+
+    def path(self, lineage_id: str) -> Path:
+        if not LINEAGE_ID_PATTERN.match(lineage_id):
+            raise ValueError(f"Invalid lineage id: {lineage_id!r}")
+        return self.directory / lineage_id
+
+    def code(self, lineage_id: str):
+        """The latest code that rendered in this lineage, or None"""
+        try:
+            return (self.path(lineage_id) / CODE_FILE).read_text()
+        except (ValueError, FileNotFoundError):
+            return None
+
+    @contextmanager
+    def media_dir(self, lineage_id: str = None, fallback_dir: Path = None):
+        """
+        Yield (media directory, reused) for a render: the lineage's
+        persistent directory when it is free, otherwise a temporary
+        directory under `fallback_dir` that is removed afterwards
+        """
+        fd = None
+        if lineage_id is not None and fcntl is not None:
+            path = self.path(lineage_id)
+            path.mkdir(parents=True, exist_ok=True)
+            fd = _try_lock(path)
+            if fd is None:
+                logger.info(f"Lineage {lineage_id} is busy; rendering without its cache")
+        if fd is None:
+            with tempfile.TemporaryDirectory(dir=fallback_dir) as temp_dir:
+                yield temp_dir, False
+            return
+        try:
+            # The directory's mtime is its last use, for eviction
+            os.utime(path)
+            yield str(path), True
+        finally:
+            _unlock(fd)
+
+    def save_code(self, lineage_id: str, code: str):
+        path = self.path(lineage_id) / CODE_FILE
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial = path.with_name(f".{CODE_FILE}.{os.getpid()}")
+        partial.write_text(code)
+        os.replace(partial, path)
+
+    def enforce(self, force: bool = False) -> int:
+        """
+        Delete least recently used lineages beyond the limits; returns how
+        many. Scans at most once per check_interval unless `force`.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_check < self.check_interval:
+            return 0
+        self._last_check = now
+        try:
+            entries = [Path(entry.path) for entry in os.scandir(self.directory) if entry.is_dir()]
+        except FileNotFoundError:
+            return 0
+        lineages = []
+        for path in entries:
+            try:
+                lineages.append((path, path.stat().st_mtime, _dir_size(path)))
+            except FileNotFoundError:
+                continue
+        lineages.sort(key=lambda entry: entry[1])
+
+        cutoff = time.time() - self.ttl
+        total = sum(size for _, _, size in lineages)
+        count = len(lineages)
+        removed = 0
+        for path, mtime, size in lineages:
+            if mtime >= cutoff and count <= self.max_count and total <= self.max_bytes:
+                break
+            fd = _try_lock(path)
+            if fd is None and fcntl is not None:
+                continue  # in use right now
+            try:
+                shutil.rmtree(path, ignore_errors=True)
+            finally:
+                if fd is not None:
+                    os.close(fd)
+            total -= size
+            count -= 1
+            removed += 1
+        if removed:
+            logger.info(f"Evicted {removed} render lineages")
+        return removed
+
+
+lineage_store = LineageStore()
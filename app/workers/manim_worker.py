@@ -1,25 +1,83 @@
 import os
-import tempfile
+import time
 import subprocess
 import uuid
-import shutil
 import traceback
 import logging
+import re
 import sys
 import platform
 from pathlib import Path
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from app.workers.render_server import (
+    warm_up, ForkedRender, CliRender, RenderCancelled,
+    PREFORK_SUPPORTED, STREAMING_SUPPORTED
+)
+from app.workers.segments import count_animations, plan_segments, RENDER_SEGMENTS
+from app.workers.media import concat_videos, remux_faststart, encode_video
+from app.workers.render_profiles import profile_key, dimensions, needs_encode
+from app.workers.render_cache import RenderCache
+from app.workers.storage import StorageQuota, place_file
+from app.workers.lineage import lineage_store
+from app.workers.asset_cache import asset_cache
+from app.workers.render_limits import RenderLimits, thread_env, describe_exit
+from app.workers.validator import validate_manim_code, index_manim_symbols
+from app.workers import profiling
+from app.workers.render_output import extract_error
+from app.metrics import Stopwatch
+from app.deadlines import remaining, MIN_STAGE_SECONDS
+from app.log_config import configure_logging
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 # Use absolute path to ensure correct location
 WORKSPACE_ROOT = Path(__file__).parent.parent.parent.absolute()
 VIDEO_DIR = WORKSPACE_ROOT / "app" / "static" / "videos"
 CODE_DIR = WORKSPACE_ROOT / "app" / "manim-code"
+# Renders write here; keep it on the same filesystem as VIDEO_DIR
+STAGING_DIR = WORKSPACE_ROOT / "app" / "render-staging"
 logger.info(f"Setting VIDEO_DIR to absolute path: {VIDEO_DIR}")
 logger.info(f"Setting CODE_DIR to absolute path: {CODE_DIR}")
 
+# "prefork" renders in children forked from a warm worker that has manim
+# imported already; "cli" spawns a fresh `manim` process per render
+RENDER_MODE = os.getenv("MANIM_RENDER_MODE", "prefork" if PREFORK_SUPPORTED else "cli")
+RENDER_TIMEOUT = 30
+# With a request deadline, a render attempt that has a lower quality
+# fallback is only started with this much time for itself, and keeps this
+# much for each fallback
+RENDER_MIN_SECONDS = float(os.getenv("RENDER_MIN_SECONDS", "5"))
+
+# Manim's per-animation progress bar, e.g. "Animation 3: Create(Circle):  45%|"
+PROGRESS_PATTERN = re.compile(r"Animation (\d+).*?(\d+)%")
+
+# Manim logs this for every animation it takes from the partial movie cache
+PARTIAL_CACHE_HIT = "Using cached data"
+
+# Remux finished videos with -movflags +faststart
+FASTSTART_ENABLED = os.getenv("FASTSTART_ENABLED", "1") != "0"
+
+# Quality flags tried in order by default; part of the render cache key
+DEFAULT_QUALITIES = ("-qh", "-ql")
+# A render profile sets resolution and frame rate itself; this flag only
+# supplies Manim's remaining quality defaults
+PROFILE_QUALITY = "-ql"
+render_cache = RenderCache(VIDEO_DIR)
+
+# Disk quotas for generated files, enforced by evicting least recently accessed files
+video_storage = StorageQuota(
+    VIDEO_DIR,
+    int(os.getenv("VIDEO_DIR_MAX_BYTES", str(10 * 1024 ** 3))),
+    int(os.getenv("VIDEO_DIR_MAX_FILES", "50000"))
+)
+code_storage = StorageQuota(
+    CODE_DIR,
+    int(os.getenv("CODE_DIR_MAX_BYTES", str(512 * 1024 ** 2))),
+    int(os.getenv("CODE_DIR_MAX_FILES", "50000"))
+)
+
 def check_ffmpeg():
     """Check if FFmpeg is installed and available in the PATH"""
     try:
@@ -74,13 +132,352 @@ def sanitize_manim_code(code: str) -> str:
     
     return "\n".join(sanitized_lines)
 
-def run_manim_code(code: str) -> dict:
+def preflight(code: str, watch: Stopwatch) -> tuple:
+    """
+    Sanitize and statically validate scene code. Returns (sanitized code,
+    None), or (code, failed render result) for code that cannot render.
+    """
+    with watch.time("sanitize"):
+        code = sanitize_manim_code(code)
+    # Catch doomed code statically instead of paying for a render
+    with watch.time("validate"):
+        validation_error = validate_manim_code(code)
+    if validation_error:
+        logger.info(f"Validation failed: {validation_error}")
+        return code, {
+            "success": False,
+            "error": f"Validation failed: {validation_error}",
+            "output": None,
+            "video_path": None
+        }
+    return code, None
+
+def _cache_key(code: str, qualities, profile) -> tuple:
+    """(render cache key, file extension) of sanitized code rendered at `qualities` or `profile`"""
+    if profile is None:
+        return render_cache.key(code, ",".join(qualities)), "mp4"
+    return render_cache.key(code, profile_key(profile)), profile["format"]
+
+def _cached_result(key: str, ext: str, code: str, lineage: str = None):
+    cached_path = render_cache.get(key, ext)
+    if cached_path is None:
+        return None
+    if lineage is not None:
+        lineage_store.save_code(lineage, code)
+    return {
+        "success": True,
+        "error": None,
+        "output": None,
+        "video_path": str("static/videos" / Path(cached_path.name)),
+        "cached": True
+    }
+
+def cached_render(code: str, qualities=DEFAULT_QUALITIES, profile: dict = None, lineage: str = None):
+    """
+    Result of an earlier render of the same sanitized code at the same
+    qualities or profile, or None. The API checks it before taking a
+    render slot; the render itself checks again.
+    """
+    return _cached_result(*_cache_key(code, qualities, profile), code, lineage)
+
+def init_render_worker():
+    """
+    Render pool initializer: pre-import manim so prefork renders start warm,
+    and index its symbols for validation
+    """
+    configure_logging()
+    # Before numpy is imported, so its BLAS threads match the render's CPU set
+    os.environ.update(thread_env())
+    index_manim_symbols()
+    if RENDER_MODE == "prefork":
+        try:
+            warm_up()
+        except Exception as e:
+            # A failing initializer breaks the whole pool; let renders report the error instead
+            logger.warning(f"Could not pre-import manim in render worker: {str(e)}")
+
+def _emit(progress, event: dict):
+    """Report a progress event to the caller, if it is listening"""
+    if progress is not None:
+        try:
+            progress.put(event)
+        except Exception as e:
+            logger.debug(f"Dropping progress event: {str(e)}")
+
+def _progress_parser(progress, quality_flag: str):
+    """
+    Build an on_stderr callback turning Manim's progress bars
+    ("Animation 3: ...  45%|...") into progress events
+    """
+    if progress is None:
+        return None
+    
+    state = {"buffer": "", "last": None}
+    
+    def on_stderr(text: str):
+        buffer = state["buffer"] + text
+        *lines, state["buffer"] = re.split(r"[\r\n]", buffer)
+        for line in lines:
+            match = PROGRESS_PATTERN.search(line)
+            if match:
+                animation, percent = int(match.group(1)), int(match.group(2))
+                if (animation, percent) != state["last"]:
+                    state["last"] = (animation, percent)
+                    _emit(progress, {
+                        "event": "progress",
+                        "quality": quality_flag,
+                        "animation": animation,
+                        "percent": percent
+                    })
+    
+    return on_stderr
+
+def output_path(media_dir: str, ext: str = "mp4") -> Path:
+    """Where a render started with `media_dir` writes its finished Scene0 video"""
+    return Path(media_dir) / "output" / f"Scene0.{ext}"
+
+def _quality_label(quality_flag: str, overrides: dict = None) -> str:
+    """The quality flag, or e.g. 480p30 when a render profile overrides it"""
+    if overrides is None:
+        return quality_flag
+    return f"{overrides['pixel_height']}p{overrides['frame_rate']}"
+
+def _start_render(code_file: Path, media_dir: str, quality_flag: str, env: dict, animations=None,
+                  profile_name: str = None, overrides: dict = None, assets: dict = None):
+    """
+    Start rendering Scene0 at the given quality flag, optionally limited to an
+    inclusive (first, last) range of animations. `overrides` (pixel_width,
+    pixel_height, frame_rate, format) come from a render profile, `assets`
+    (tex_dir, text_dir) from an asset cache view. The video is written to
+    output_path(media_dir). Returns a ForkedRender or CliRender handle.
+    """
+    video_dir = str(output_path(media_dir).parent)
+    profile = profiling.profile_path(profile_name or f"{code_file.stem}{quality_flag}")
+    assets = assets or {}
+    # CPU set and memory/CPU-time limits, held until the render is reaped
+    limits = RenderLimits()
+    
+    if RENDER_MODE == "prefork":
+        logger.debug(f"Rendering {code_file.name} {quality_flag} in forked child")
+        try:
+            return ForkedRender(code_file, media_dir, quality_flag, str(CODE_DIR), animations, video_dir,
+                                profile, {**(overrides or {}), **assets}, limits)
+        except BaseException:
+            limits.release()
+            raise
+    
+    # video_dir and the asset directories have no CLI flags; pass them
+    # through a per-render config file
+    Path(media_dir).mkdir(parents=True, exist_ok=True)
+    config_file = Path(media_dir) / "manim.cfg"
+    settings = {"video_dir": video_dir, **assets}
+    config_file.write_text("[CLI]\n" + "".join(f"{key} = {value}\n" for key, value in settings.items()))
+    
+    cmd = [
+        "manim", 
+        quality_flag,
+        "-c", str(config_file),
+        "--media_dir", media_dir, 
+        str(code_file),
+        "Scene0"  # Assuming the scene class is named Scene0
+    ]
+    if animations is not None:
+        cmd[2:2] = ["-n", f"{animations[0]},{animations[1]}"]
+    if overrides is not None:
+        cmd[2:2] = [
+            "-r", f"{overrides['pixel_width']},{overrides['pixel_height']}",
+            "--fps", str(overrides["frame_rate"]),
+            "--format", overrides["format"],
+        ]
+    if profile is not None:
+        cmd[:1] = profiling.cli_prefix(profile)
+    
+    logger.debug(f"Running command: {' '.join(cmd)}")
+    try:
+        return CliRender(cmd, str(CODE_DIR), thread_env(env), limits)
+    except BaseException:
+        limits.release()
+        raise
+
+def _collect_assets(assets: dict, started: float, watch=None):
+    """Publish the SVGs a successful render compiled in its asset cache view"""
+    if not assets:
+        return
+    hits, misses = asset_cache.collect(assets["tex_dir"], assets["text_dir"], started)
+    if watch is not None:
+        watch.count("asset_hits", hits)
+        watch.count("asset_misses", misses)
+
+def _render(code_file: Path, media_dir: str, quality_flag: str, env: dict,
+            progress=None, cancel=None, overrides=None, timeout=RENDER_TIMEOUT, watch=None):
+    """
+    Render Scene0 once at the given quality flag.
+    Returns (returncode, stdout, stderr); raises subprocess.TimeoutExpired
+    after `timeout` seconds, or RenderCancelled once the optional `cancel`
+    event is set.
+    """
+    label = _quality_label(quality_flag, overrides)
+    _emit(progress, {"event": "stage", "stage": "rendering", "quality": label})
+    started = time.time()
+    # LaTeX and text SVGs compiled by earlier renders
+    with asset_cache.view() as assets:
+        render = _start_render(code_file, media_dir, quality_flag, env, overrides=overrides, assets=assets)
+        returncode, stdout, stderr = render.wait(
+            timeout, _progress_parser(progress, label), cancel
+        )
+        if returncode == 0:
+            _collect_assets(assets, started, watch)
+    
+    logger.debug(f"Process return code: {returncode} "
+                 f"({len(stdout)} bytes stdout, {len(stderr)} bytes stderr)")
+    return returncode, stdout, stderr
+
+def _render_segments(code_file: Path, media_dir: str, quality_flag: str, env: dict,
+                     segments: list, progress=None, cancel=None, watch=None, overrides=None,
+                     timeout=RENDER_TIMEOUT):
+    """
+    Render ranges of Scene0's animations in parallel processes and join them
+    losslessly. Returns (returncode, stdout, stderr, video_path); on failure
+    the other segments are killed and the failing segment's output returned.
+    """
+    label = _quality_label(quality_flag, overrides)
+    _emit(progress, {"event": "stage", "stage": "rendering", "quality": label,
+                     "segments": len(segments)})
+    
+    with ExitStack() as stack:
+        # Every segment compiles its LaTeX in an asset cache view of its own
+        views = [stack.enter_context(asset_cache.view()) for _ in segments]
+        started = time.time()
+        returncode, stdout, stderr = _run_segments(code_file, media_dir, quality_flag, env, segments,
+                                                   views, progress, cancel, overrides, timeout, label)
+        if returncode != 0:
+            return returncode, stdout, stderr, None
+        for assets in views:
+            _collect_assets(assets, started, watch)
+    
+    segment_videos = []
+    for index in range(len(segments)):
+        segment_video = output_path(str(Path(media_dir) / f"segment{index}"))
+        if not segment_video.exists():
+            return 1, stdout, f"Segment {index} produced no video\n{stderr}", None
+        segment_videos.append(segment_video)
+    
+    joined_path = output_path(media_dir)
+    joined_path.parent.mkdir(parents=True, exist_ok=True)
+    with (watch or Stopwatch()).time("concat"):
+        concat_videos(segment_videos, joined_path, env)
+    return 0, stdout, stderr, joined_path
+
+def _run_segments(code_file: Path, media_dir: str, quality_flag: str, env: dict, segments: list,
+                  views: list, progress, cancel, overrides, timeout, label: str):
+    """Start every segment's render and wait for them; returns the joint (returncode, stdout, stderr)"""
+    # Start every child from this thread (forking from helper threads is unsafe),
+    # then collect their output concurrently
+    renders = []
+    try:
+        for index, (animations, assets) in enumerate(zip(segments, views)):
+            segment_dir = str(Path(media_dir) / f"segment{index}")
+            renders.append(_start_render(code_file, segment_dir, quality_flag, env, animations,
+                                         f"{code_file.stem}{quality_flag}-segment{index}", overrides, assets))
+    except Exception:
+        for render in renders:
+            render.kill()
+            render.wait(RENDER_TIMEOUT)
+        raise
+    
+    def kill_all():
+        for render in renders:
+            try:
+                render.kill()
+            except (ProcessLookupError, OSError):
+                pass
+    
+    outputs = [None] * len(renders)
+    with ThreadPoolExecutor(max_workers=len(renders)) as executor:
+        futures = {
+            executor.submit(render.wait, timeout, _progress_parser(progress, label), cancel): index
+            for index, render in enumerate(renders)
+        }
+        try:
+            for future in as_completed(futures):
+                outputs[futures[future]] = future.result()
+                returncode, stdout, stderr = outputs[futures[future]]
+                if returncode != 0:
+                    logger.error(f"Segment {futures[future]} failed with code {returncode}")
+                    kill_all()
+                    return returncode, stdout, stderr
+        except Exception:
+            kill_all()
+            raise
+    
+    stdout = "".join(output[1] for output in outputs)
+    stderr = "".join(output[2] for output in outputs)
+    return 0, stdout, stderr
+
+def run_manim_code(code: str, progress=None, cancel=None, qualities=DEFAULT_QUALITIES,
+                   lineage: str = None, profile: dict = None, deadline: float = None,
+                   max_segments: int = RENDER_SEGMENTS) -> dict:
     """
-    Runs Manim code and returns the output video path
+    Runs Manim code and returns the output video path.
+    
+    `progress` is an optional queue receiving stage/progress event dicts and
+    `cancel` an optional event that aborts the render when set. `qualities`
+    are the quality flags tried in order until one renders.
+    
+    With a `lineage` id the render runs in that lineage's persistent media
+    directory, so Manim reuses partial movie files of unchanged animations
+    from earlier renders of the same scene (see LineageStore).
+    
+    A resolved render `profile` (see render_profiles.resolve_profile)
+    replaces the quality ladder with one render at its resolution and frame
+    rate, then encodes to its format and duration.
+    
+    With a `deadline` (time.time() of the request's deadline) each attempt
+    gets at most the time left, keeping RENDER_MIN_SECONDS for each
+    fallback after it. Attempts that cannot get RENDER_MIN_SECONDS are
+    skipped, so e.g. a late request goes straight to the low quality; an
+    attempt cut short by the deadline falls back like a failed one.
+    
+    A long scene renders as at most `max_segments` parallel segments (see
+    segments.plan_segments); callers pass the render slots they hold.
+    
+    The result carries per-stage `timings` (seconds) and `counts` for the
+    caller's metrics; see app.metrics.record_render.
     """
+    watch = Stopwatch()
+    result = _run_manim_code(code, progress, cancel, qualities, lineage, profile, deadline, max_segments, watch)
+    result["timings"] = watch.timings
+    result["counts"] = watch.counts
+    return result
+
+def _attempt_timeout(deadline, fallbacks: int):
+    """
+    Timeout for a render attempt with `fallbacks` attempts after it, or
+    None if the deadline leaves it too little time to start
+    """
+    left = remaining(deadline)
+    if left is None:
+        return RENDER_TIMEOUT
+    timeout = min(RENDER_TIMEOUT, left - fallbacks * RENDER_MIN_SECONDS)
+    # The last attempt may use whatever was kept for it
+    return timeout if timeout >= (RENDER_MIN_SECONDS if fallbacks else MIN_STAGE_SECONDS) else None
+
+def _run_manim_code(code: str, progress, cancel, qualities, lineage, profile, deadline, max_segments,
+                    watch: Stopwatch) -> dict:
     # Create unique ID for this render
     render_id = str(uuid.uuid4())[:8]
     
+    # Abandoned while it waited for a worker: nothing to kill yet
+    if cancel is not None and cancel.is_set():
+        logger.info(f"Render {render_id} cancelled before it started")
+        return {
+            "success": False,
+            "error": "Render was cancelled",
+            "output": None,
+            "video_path": None,
+            "cancelled": True
+        }
+    
     try:
         # Make sure the directories exist
         VIDEO_DIR.mkdir(exist_ok=True, parents=True)
@@ -88,8 +485,39 @@ def run_manim_code(code: str) -> dict:
         logger.debug(f"Video directory: {VIDEO_DIR}")
         logger.debug(f"Code directory: {CODE_DIR}")
         
-        # Sanitize the code
-        code = sanitize_manim_code(code)
+        # The API validates before taking a render slot; direct callers and
+        # queue payloads are checked again here
+        code, failure = preflight(code, watch)
+        if failure is not None:
+            return failure
+        
+        # Manim renders MP4 at the profile's resolution and frame rate; other
+        # formats are encoded from it, unless there is no ffmpeg to do so
+        overrides = None
+        ext = "mp4"
+        if profile is not None:
+            qualities = (PROFILE_QUALITY,)
+            ext = profile["format"]
+            width, height = dimensions(profile)
+            overrides = {
+                "pixel_width": width,
+                "pixel_height": height,
+                "frame_rate": profile["fps"],
+                "format": "mp4" if FFMPEG_AVAILABLE else ext,
+            }
+        
+        # Identical code at the same quality or profile renders to the same video
+        cache_key, _ = _cache_key(code, qualities, profile)
+        cached = _cached_result(cache_key, ext, code, lineage)
+        if cached is not None:
+            return cached
+        
+        # Long scenes with a static animation count render as parallel segments
+        segments = []
+        if FFMPEG_AVAILABLE and STREAMING_SUPPORTED:
+            segments = plan_segments(count_animations(code), max_segments)
+            if segments:
+                logger.debug(f"Rendering in {len(segments)} segments: {segments}")
         
         # Write code to a permanent file
         code_file = CODE_DIR / f"scene_{render_id}.py"
@@ -97,11 +525,18 @@ def run_manim_code(code: str) -> dict:
             f.write(code)
         
         logger.debug(f"Saved code to {code_file}")
-        logger.debug(f"Code content:\n{code}")
         
-        # Create a temp directory for Manim's output (media files)
-        with tempfile.TemporaryDirectory() as temp_dir:
+        # Manim's output (media files) goes to the lineage's persistent
+        # directory or a staging directory, both on the same filesystem as
+        # VIDEO_DIR so the result can be renamed into place
+        STAGING_DIR.mkdir(exist_ok=True, parents=True)
+        with lineage_store.media_dir(lineage, STAGING_DIR) as (temp_dir, reused):
             temp_dir_path = Path(temp_dir)
+            if reused:
+                # Leftovers of an earlier failed render must not pass as this one's output
+                for stale in (output_path(temp_dir, ext), output_path(temp_dir),
+                              temp_dir_path / "Scene0.faststart.mp4", temp_dir_path / f"Scene0.encoded.{ext}"):
+                    stale.unlink(missing_ok=True)
             
             # Run manim in subprocess
             try:
@@ -123,77 +558,78 @@ def run_manim_code(code: str) -> dict:
                             logger.info(f"Adding potential FFmpeg path to PATH: {ffmpeg_path}")
                             env["PATH"] = f"{ffmpeg_path};{env.get('PATH', '')}"
                 
-                cmd = [
-                    "manim", 
-                    "-qh",  # High quality
-                    "--media_dir", temp_dir, 
-                    str(code_file),
-                    "Scene0"  # Assuming the scene class is named Scene0
-                ]
-                
-                logger.debug(f"Running command: {' '.join(cmd)}")
-                
-                process = subprocess.Popen(
-                    cmd, 
-                    cwd=str(CODE_DIR),  # Run from code directory
-                    stdout=subprocess.PIPE, 
-                    stderr=subprocess.PIPE,
-                    text=True,
-                    env=env  # Use our modified environment
-                )
-                stdout, stderr = process.communicate(timeout=30)  # 30s timeout
-                
-                logger.debug(f"Process return code: {process.returncode}")
-                logger.debug(f"STDOUT: {stdout}")
-                logger.debug(f"STDERR: {stderr}")
-                
-                if process.returncode != 0:
-                    logger.error(f"Manim execution failed with code {process.returncode}")
-                    
-                    # Try with lower quality if high quality failed
-                    if "-qh" in cmd:
-                        logger.info("Retrying with lower quality...")
-                        cmd[1] = "-ql"  # Low quality
-                        
-                        process = subprocess.Popen(
-                            cmd, 
-                            cwd=str(CODE_DIR),
-                            stdout=subprocess.PIPE, 
-                            stderr=subprocess.PIPE,
-                            text=True,
-                            env=env
-                        )
-                        stdout, stderr = process.communicate(timeout=30)
-                        
-                        logger.debug(f"Retry process return code: {process.returncode}")
-                        logger.debug(f"Retry STDOUT: {stdout}")
-                        logger.debug(f"Retry STDERR: {stderr}")
-                        
-                        if process.returncode != 0:
-                            return {
-                                "success": False,
-                                "error": stderr,
-                                "output": stdout,
-                                "video_path": None
-                            }
-                    else:
+                # returncode stays None while no attempt has finished
+                returncode, stdout, stderr = None, "", ""
+                attempted = False
+                # The deadline, not the code, made a lower quality render; the
+                # video must not be cached for unhurried requests of the ladder
+                degraded = False
+                for attempt, quality_flag in enumerate(qualities):
+                    fallbacks = len(qualities) - attempt - 1
+                    timeout = _attempt_timeout(deadline, fallbacks)
+                    if timeout is None:
+                        logger.info(f"Skipping {quality_flag} for render {render_id}: too close to the deadline")
+                        watch.count("deadline_skip")
+                        degraded = True
+                        continue
+                    if attempted:
+                        # Try with lower quality if the previous quality failed
+                        logger.info(f"Retrying with quality {quality_flag}...")
+                        watch.count("quality_fallback")
+                    attempted = True
+                    quality = _quality_label(quality_flag, overrides)
+                    try:
+                        with watch.time(f"render {quality}"):
+                            if segments:
+                                returncode, stdout, stderr, _ = _render_segments(
+                                    code_file, temp_dir, quality_flag, env, segments, progress, cancel, watch,
+                                    overrides, timeout
+                                )
+                            else:
+                                returncode, stdout, stderr = _render(code_file, temp_dir, quality_flag, env,
+                                                                     progress, cancel, overrides, timeout, watch)
+                    except subprocess.TimeoutExpired:
+                        if timeout >= RENDER_TIMEOUT or not fallbacks:
+                            raise
+                        # Cut short by the deadline; the fallback still has the time kept for it
+                        logger.info(f"{quality_flag} render {render_id} ran into the deadline")
+                        degraded = True
+                        watch.count("timeout")
+                        returncode, stdout, stderr = None, "", ""
+                        continue
+                    if reused:
+                        watch.count("partial_movie_hits", stdout.count(PARTIAL_CACHE_HIT) + stderr.count(PARTIAL_CACHE_HIT))
+                    if returncode == 0:
+                        break
+                    logger.warning(f"Manim execution failed with code {returncode}")
+                else:
+                    if returncode is None:
                         return {
                             "success": False,
-                            "error": stderr,
-                            "output": stdout,
-                            "video_path": None
+                            "error": "Request deadline exceeded before a render could finish",
+                            "output": None,
+                            "video_path": None,
+                            "deadline_exceeded": True
                         }
+                    # Only the final traceback and the offending code go back to the LLM
+                    error = describe_exit(returncode)
+                    if error is not None:
+                        watch.count("resource_limit")
+                    else:
+                        error = extract_error(f"{stdout}\n{stderr}", code, code_file.name)
+                    logger.info(f"Render {render_id} failed: {error.splitlines()[0]}")
+                    return {
+                        "success": False,
+                        "error": error,
+                        "output": stdout,
+                        "video_path": None
+                    }
                 
-                # Find the output video - check both Scene0.mp4 and low quality version
-                video_paths = list(Path(temp_dir).glob("**/Scene0.mp4"))
-                if not video_paths:
-                    # Try different quality levels
-                    video_paths = list(Path(temp_dir).glob("**/*Scene0*.mp4"))
-                
-                logger.debug(f"Looking for video in {temp_dir}")
-                logger.debug(f"Found videos: {video_paths}")
+                # The render wrote to a known path; no need to search for it
+                video_path = output_path(temp_dir, overrides["format"] if overrides else "mp4")
+                logger.debug(f"Expecting video at {video_path}")
                 
-                if not video_paths:
+                if not video_path.exists():
                     logger.error("No video was generated")
                     return {
                         "success": False,
@@ -202,27 +638,78 @@ def run_manim_code(code: str) -> dict:
                         "video_path": None
                     }
                 
-                # Copy video to static directory with absolute path
-                output_path = VIDEO_DIR / f"{render_id}.mp4"
-                logger.debug(f"Copying video from {video_paths[0]} to {output_path}")
-                shutil.copy2(video_paths[0], output_path)
+                source_path = video_path
+                if profile is not None and FFMPEG_AVAILABLE and needs_encode(profile):
+                    encoded_path = temp_dir_path / f"Scene0.encoded.{ext}"
+                    with watch.time("encode"):
+                        encode_video(source_path, encoded_path, profile, env)
+                    source_path = encoded_path
+                
+                # Put the moov atom first so playback and seeking start immediately
+                if ext == "mp4" and FFMPEG_AVAILABLE and FASTSTART_ENABLED:
+                    faststart_path = temp_dir_path / "Scene0.faststart.mp4"
+                    with watch.time("faststart"):
+                        remuxed = remux_faststart(source_path, faststart_path, env)
+                    if remuxed:
+                        source_path = faststart_path
+                    else:
+                        watch.count("faststart_failed")
+                
+                # Move the video into the static directory (a rename, not a copy)
+                size = source_path.stat().st_size
+                with watch.time("copy"):
+                    if render_cache.enabled and not degraded:
+                        output_file = render_cache.put(cache_key, source_path, ext)
+                    else:
+                        output_file = VIDEO_DIR / f"{render_id}.{ext}"
+                        place_file(source_path, output_file)
+                logger.debug(f"Placed video from {source_path} at {output_file}")
+                # Also when the lineage directory was busy: the lineage's
+                # latest code is what a revision starts from
+                if lineage is not None:
+                    lineage_store.save_code(lineage, code)
+                video_storage.enforce()
+                code_storage.enforce()
+                lineage_store.enforce()
                 
                 # Use a path relative to app for the URL
-                relative_path = "static/videos" / Path(f"{render_id}.mp4")
+                relative_path = "static/videos" / Path(output_file.name)
                 logger.debug(f"Returning relative path for URL: {relative_path}")
                 
                 return {
                     "success": True,
                     "error": None,
                     "output": stdout,
-                    "video_path": str(relative_path)
+                    "video_path": str(relative_path),
+                    "quality": quality,
+                    "size": size,
+                    "cached": False
                 }
                 
+            except RenderCancelled as e:
+                logger.info(f"Render {render_id} cancelled")
+                return {
+                    "success": False,
+                    "error": str(e),
+                    "output": None,
+                    "video_path": None,
+                    "cancelled": True
+                }
             except subprocess.TimeoutExpired as e:
                 logger.error(f"Rendering timed out: {e}")
+                watch.count("timeout")
+                if e.timeout < RENDER_TIMEOUT:
+                    return {
+                        "success": False,
+                        "error": f"Request deadline exceeded while rendering (after {e.timeout:.0f}s)",
+                        "output": None,
+                        "video_path": None,
+                        "deadline_exceeded": True
+                    }
                 return {
                     "success": False,
-                    "error": f"Rendering timed out (30s): {str(e)}",
+                    "error": (f"Rendering timed out after {RENDER_TIMEOUT}s; "
+                              f"the scene is too long or too expensive to render"),
                     "output": None,
                     "video_path": None
                 }
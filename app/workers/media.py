@@ -0,0 +1,86 @@
+import logging
+import subprocess
+from pathlib import Path
+
+from app.workers.render_profiles import VP9_SPEED, GIF_DITHER
+
+logger = logging.getLogger(__name__)
+
+
+def concat_videos(paths: list, output: Path, env: dict = None):
+    """
+    Join videos with ffmpeg's concat demuxer without re-encoding.
+    All inputs must share codec parameters, as segments of one scene do.
+    """
+    list_file = output.with_suffix(".txt")
+    with open(list_file, "w") as f:
+        for path in paths:
+            escaped = str(Path(path).absolute()).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+    cmd = [
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-f", "concat", "-safe", "0",
+        "-i", str(list_file),
+        "-c", "copy",
+        str(output)
+    ]
+    logger.debug(f"Concatenating {len(paths)} segments: {' '.join(cmd)}")
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, env=env)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg concat failed: {result.stderr}")
+
+
+def remux_faststart(source: Path, output: Path, env: dict = None) -> bool:
+    """
+    Copy `source` to `output` with the moov atom moved to the front
+    (`-movflags +faststart`) so browsers can start playback and seek before
+    the whole file has downloaded. Streams are copied, not re-encoded.
+    Returns False if ffmpeg failed; `output` is then not created.
+    """
+    cmd = [
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-i", str(source),
+        "-map", "0",
+        "-c", "copy",
+        "-movflags", "+faststart",
+        str(output)
+    ]
+    logger.debug(f"Remuxing for fast start: {' '.join(cmd)}")
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, env=env)
+    except OSError as e:
+        logger.warning(f"Could not run ffmpeg for fast start remux: {str(e)}")
+        return False
+    if result.returncode != 0:
+        logger.warning(f"Fast start remux failed, keeping the original file: {result.stderr}")
+        Path(output).unlink(missing_ok=True)
+        return False
+    return True
+
+
+def encode_video(source: Path, output: Path, profile: dict, env: dict = None):
+    """
+    Produce the profile's output format from Manim's MP4: a VP9 WebM or a
+    palette-optimized GIF, encoded with the profile's preset, trimmed to its
+    max_duration. An MP4 that only needs trimming is cut without re-encoding.
+    """
+    cmd = ["ffmpeg", "-y", "-loglevel", "error", "-i", str(source)]
+    if profile["max_duration"] is not None:
+        cmd += ["-t", str(profile["max_duration"])]
+    preset = profile["preset"]
+    if profile["format"] == "mp4":
+        cmd += ["-map", "0", "-c", "copy"]
+    elif profile["format"] == "webm":
+        deadline, cpu_used = VP9_SPEED[preset]
+        cmd += ["-c:v", "libvpx-vp9", "-b:v", "0", "-crf", "33", "-row-mt", "1",
+                "-deadline", deadline, "-cpu-used", cpu_used, "-c:a", "libopus"]
+    elif profile["format"] == "gif":
+        cmd += ["-vf", f"split[a][b];[a]palettegen=stats_mode=diff[p];[b][p]paletteuse=dither={GIF_DITHER[preset]}",
+                "-loop", "0"]
+    cmd.append(str(output))
+    logger.debug(f"Encoding {profile['format']}: {' '.join(cmd)}")
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, env=env)
+    if result.returncode != 0:
+        Path(output).unlink(missing_ok=True)
+        raise RuntimeError(f"ffmpeg {profile['format']} encode failed: {result.stderr}")
@@ -0,0 +1,70 @@
+import os
+import sys
+import random
+import shutil
+import logging
+import cProfile
+import subprocess
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Opt-in profiling of render processes: "cprofile" writes .prof files (open
+# with snakeviz or pstats), "py-spy" writes flame graph SVGs. Off by default.
+RENDER_PROFILER = os.getenv("RENDER_PROFILER", "").lower()
+# Fraction of renders profiled while a profiler is set
+RENDER_PROFILE_RATE = float(os.getenv("RENDER_PROFILE_RATE", "1"))
+PROFILE_DIR = Path(os.getenv(
+    "RENDER_PROFILE_DIR",
+    str(Path(__file__).parent.parent.parent.absolute() / "app" / "profiles")
+))
+
+
+def profile_path(name: str):
+    """
+    Where to write the profile of the render called `name`, or None when
+    this render is not profiled
+    """
+    if RENDER_PROFILER not in ("cprofile", "py-spy"):
+        return None
+    if RENDER_PROFILER == "py-spy" and shutil.which("py-spy") is None:
+        logger.warning("RENDER_PROFILER=py-spy but py-spy is not installed")
+        return None
+    if random.random() >= RENDER_PROFILE_RATE:
+        return None
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    suffix = ".prof" if RENDER_PROFILER == "cprofile" else ".svg"
+    return PROFILE_DIR / f"{name}{suffix}"
+
+
+def cli_prefix(path: Path) -> list:
+    """Command prefix that runs `manim ...` under the profiler, writing to `path`"""
+    if RENDER_PROFILER == "cprofile":
+        return [sys.executable, "-m", "cProfile", "-o", str(path), "-m", "manim"]
+    return ["py-spy", "record", "--output", str(path), "--", "manim"]
+
+
+def run_profiled(path: Path, fn, *args):
+    """
+    Call fn(*args) in this process under cProfile, dumping to `path`.
+    Used in forked render children.
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return fn(*args)
+    finally:
+        profiler.disable()
+        profiler.dump_stats(str(path))
+
+
+def attach_py_spy(pid: int, path: Path):
+    """Sample an already running process with py-spy until it exits"""
+    try:
+        return subprocess.Popen(
+            ["py-spy", "record", "--pid", str(pid), "--output", str(path)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+    except OSError as e:
+        logger.warning(f"Could not attach py-spy to {pid}: {str(e)}")
+        return None
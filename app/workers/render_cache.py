@@ -0,0 +1,80 @@
+import os
+import hashlib
+import logging
+from pathlib import Path
+from importlib import metadata
+
+from app.workers.storage import touch, place_file
+
+logger = logging.getLogger(__name__)
+
+RENDER_CACHE_ENABLED = os.getenv("RENDER_CACHE_ENABLED", "1") != "0"
+
+# Cache entries are stored as <key>.<format>; the key length keeps them apart
+# from other files in the same directory
+KEY_LENGTH = 32
+
+
+def _manim_version() -> str:
+    try:
+        return metadata.version("manim")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+MANIM_VERSION = _manim_version()
+
+
+def normalize_code(code: str) -> str:
+    """
+    Normalize code so cosmetic differences (line endings, trailing
+    whitespace, surrounding blank lines) map to the same cache key
+    """
+    lines = code.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip("\n")
+
+
+class RenderCache:
+    """
+    Content-addressed store of rendered videos.
+
+    Entries live in `directory` as <key>.<format> so the filesystem itself
+    is the index and every render worker process sees the same cache. An
+    entry's atime is refreshed on each hit; the directory's StorageQuota
+    evicts the least recently used videos, cached or not.
+    """
+    def __init__(self, directory: Path, enabled: bool = RENDER_CACHE_ENABLED):
+        self.directory = Path(directory)
+        self.enabled = enabled
+
+    def key(self, code: str, quality: str) -> str:
+        """Cache key for sanitized code rendered at the given quality flags"""
+        digest = hashlib.sha256()
+        for part in (normalize_code(code), quality, MANIM_VERSION):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()[:KEY_LENGTH]
+
+    def path(self, key: str, ext: str = "mp4") -> Path:
+        return self.directory / f"{key}.{ext}"
+
+    def get(self, key: str, ext: str = "mp4"):
+        """Return the cached video path for `key`, or None on a miss"""
+        if not self.enabled:
+            return None
+        path = self.path(key, ext)
+        if not path.exists():
+            logger.debug(f"Render cache miss for {key}")
+            return None
+        touch(path)
+        logger.debug(f"Render cache hit for {key}")
+        return path
+
+    def put(self, key: str, source: Path, ext: str = "mp4") -> Path:
+        """
+        Move a rendered video into the cache under `key`. The rename is
+        atomic so concurrent workers never see a partial file.
+        """
+        path = self.path(key, ext)
+        place_file(source, path)
+        return path
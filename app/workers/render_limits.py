@@ -0,0 +1,187 @@
+"""
+Per-render CPU and memory bounds: a dedicated CPU set, matching thread
+counts for numeric libraries, and memory/CPU-time limits (a cgroup v2
+group when one is delegated to us, rlimits otherwise).
+"""
+import os
+import signal
+import logging
+from pathlib import Path
+
+try:
+    import fcntl
+    import resource
+except ImportError:  # Windows: renders run unbounded
+    fcntl = None
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+WORKSPACE_ROOT = Path(__file__).parent.parent.parent.absolute()
+AFFINITY_SUPPORTED = hasattr(os, "sched_setaffinity")
+_CPUS = sorted(os.sched_getaffinity(0)) if AFFINITY_SUPPORTED else list(range(os.cpu_count() or 1))
+
+# Cores per render; by default the host's cores are split evenly between the
+# RENDER_WORKERS renders that can run at once
+_RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(len(_CPUS))))
+RENDER_CPUS = int(os.getenv("RENDER_CPUS", str(max(1, len(_CPUS) // _RENDER_WORKERS))))
+RENDER_CPU_PINNING = os.getenv("RENDER_CPU_PINNING", "1") != "0" and AFFINITY_SUPPORTED
+# 0 disables either limit
+RENDER_MEMORY_LIMIT_MB = int(os.getenv("RENDER_MEMORY_LIMIT_MB", "4096"))
+RENDER_CPU_TIME_LIMIT = int(os.getenv("RENDER_CPU_TIME_LIMIT", "300"))
+# A cgroup v2 directory delegated to this service (e.g. through systemd's
+# Delegate=yes); renders then get a child group each instead of rlimits
+RENDER_CGROUP = os.getenv("RENDER_CGROUP", "")
+# Lock files marking which CPU sets are taken, shared by all workers on the host
+SLOT_DIR = Path(os.getenv("RENDER_CPU_SLOT_DIR", str(WORKSPACE_ROOT / "app" / "render-staging" / ".cpu-slots")))
+
+# Environment variables bounding the thread pools of numpy's BLAS and friends
+THREAD_VARIABLES = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS",
+                    "NUMEXPR_NUM_THREADS", "VECLIB_MAXIMUM_THREADS")
+
+
+# Lock fds this process holds (CPU slots, asset cache views). A child forked
+# without exec inherits them and would keep the locks after this process
+# releases them, so it closes them first (close_inherited_locks).
+_lock_fds = set()
+
+
+def open_lock(path: Path):
+    """Exclusive non-blocking flock on `path`; returns the open fd, or None if taken"""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return None
+    _lock_fds.add(fd)
+    return fd
+
+
+def close_lock(fd: int):
+    _lock_fds.discard(fd)
+    os.close(fd)
+
+
+def close_inherited_locks():
+    """In a forked child: drop the parent's locks (the parent still holds them)"""
+    for fd in list(_lock_fds):
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+    _lock_fds.clear()
+
+
+def thread_env(env: dict = None) -> dict:
+    """`env` (default os.environ) with every thread pool sized to RENDER_CPUS"""
+    env = dict(os.environ if env is None else env)
+    for name in THREAD_VARIABLES:
+        env.setdefault(name, str(RENDER_CPUS))
+    return env
+
+
+def describe_exit(returncode: int):
+    """Error message for a render the kernel stopped at one of its limits, else None"""
+    if hasattr(signal, "SIGXCPU") and returncode == -signal.SIGXCPU:
+        return f"Render exceeded its CPU time limit of {RENDER_CPU_TIME_LIMIT}s"
+    if returncode == -signal.SIGKILL and RENDER_CGROUP:
+        return "Render was killed, most likely for exceeding its memory limit"
+    return None
+
+
+class RenderLimits:
+    """
+    Resources of one render process (and everything it starts). Create it
+    before the process starts, `apply` it to the process, and `release` it
+    once the process has exited.
+    """
+    def __init__(self):
+        self.cpus = None
+        self.cgroup = None
+        self._slot_fd = None
+        if RENDER_CPU_PINNING:
+            self._take_cpu_slot()
+        if RENDER_CGROUP:
+            self._make_cgroup()
+
+    def _take_cpu_slot(self):
+        """Lock the first free CPU set; with none free, the render is not pinned"""
+        SLOT_DIR.mkdir(parents=True, exist_ok=True)
+        for index in range(len(_CPUS) // RENDER_CPUS):
+            fd = open_lock(SLOT_DIR / f"{index}.lock")
+            if fd is None:
+                continue
+            self._slot_fd = fd
+            self.cpus = set(_CPUS[index * RENDER_CPUS:(index + 1) * RENDER_CPUS])
+            return
+        logger.debug("No free CPU set; rendering unpinned")
+
+    def _make_cgroup(self):
+        path = Path(RENDER_CGROUP) / f"render-{os.getpid()}-{id(self):x}"
+        try:
+            path.mkdir()
+            if RENDER_MEMORY_LIMIT_MB:
+                (path / "memory.max").write_text(str(RENDER_MEMORY_LIMIT_MB * 1024 ** 2))
+                (path / "memory.swap.max").write_text("0")
+            (path / "cpu.max").write_text(f"{RENDER_CPUS * 100000} 100000")
+            if self.cpus is not None and (path / "cpuset.cpus").exists():
+                (path / "cpuset.cpus").write_text(",".join(map(str, sorted(self.cpus))))
+        except OSError as e:
+            logger.warning(f"Could not set up cgroup {path}, falling back to rlimits: {str(e)}")
+            self._remove_cgroup(path)
+            return
+        self.cgroup = path
+
+    def apply(self, pid: int = 0):
+        """
+        Bound process `pid` (0: the calling process, e.g. a freshly forked
+        render child). Its children inherit the CPU set and limits.
+        """
+        if self.cpus is not None:
+            os.sched_setaffinity(pid, self.cpus)
+        if self.cgroup is not None:
+            (self.cgroup / "cgroup.procs").write_text(str(pid or os.getpid()))
+            return
+        if resource is None:
+            return
+        limits = []
+        if RENDER_MEMORY_LIMIT_MB:
+            limit = RENDER_MEMORY_LIMIT_MB * 1024 ** 2
+            limits.append((resource.RLIMIT_AS, (limit, limit)))
+        if RENDER_CPU_TIME_LIMIT:
+            # SIGXCPU at the soft limit, SIGKILL a little later
+            limits.append((resource.RLIMIT_CPU, (RENDER_CPU_TIME_LIMIT, RENDER_CPU_TIME_LIMIT + 5)))
+        for limit, values in limits:
+            if pid:
+                resource.prlimit(pid, limit, values)
+            else:
+                resource.setrlimit(limit, values)
+
+    def kill(self, pgid: int):
+        """Kill the render's whole process group (and cgroup), including ffmpeg and LaTeX children"""
+        if self.cgroup is not None and (self.cgroup / "cgroup.kill").exists():
+            try:
+                (self.cgroup / "cgroup.kill").write_text("1")
+            except OSError:
+                pass
+        try:
+            os.killpg(pgid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def release(self):
+        if self._slot_fd is not None:
+            close_lock(self._slot_fd)
+            self._slot_fd = None
+        if self.cgroup is not None:
+            self._remove_cgroup(self.cgroup)
+            self.cgroup = None
+
+    @staticmethod
+    def _remove_cgroup(path: Path):
+        try:
+            path.rmdir()
+        except OSError:
+            # Still populated, or already gone
+            logger.debug(f"Could not remove cgroup {path}")
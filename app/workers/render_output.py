@@ -0,0 +1,107 @@
+import os
+import re
+from collections import deque
+from typing import Optional
+
+# Bytes of each output stream kept per render; tracebacks are at the end,
+# so the oldest output is dropped first
+RENDER_OUTPUT_MAX_BYTES = int(os.getenv("RENDER_OUTPUT_MAX_BYTES", str(64 * 1024)))
+# Lines of output used as the error when no traceback can be found
+ERROR_TAIL_LINES = 20
+
+_ANSI = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]")
+# Rich's boxed tracebacks (manim CLI) draw frames with these characters
+_BOX = re.compile(r"^[\s│╭╮╰╯─┃━]+|[\s│╭╮╰╯─┃━]+$")
+_PLAIN_FRAME = re.compile(r'File "(?P<file>[^"]+)", line (?P<line>\d+), in (?P<func>\S+)')
+_RICH_FRAME = re.compile(r"(?P<file>\S+\.py):(?P<line>\d+) in (?P<func>\S+)")
+_EXCEPTION = re.compile(r"^[A-Za-z_][\w.]*(?:Error|Exception|Exit|Interrupt|Warning|Iteration)(?::.*)?$")
+
+
+class OutputBuffer:
+    """
+    Keeps the last `max_bytes` of a stream. Appending is O(1) amortized and
+    memory stays bounded no matter how much a render prints.
+    """
+    def __init__(self, max_bytes: int = RENDER_OUTPUT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.chunks = deque()
+        self.size = 0
+        self.dropped = 0
+
+    def append(self, data: bytes):
+        self.chunks.append(data)
+        self.size += len(data)
+        while self.size > self.max_bytes and self.chunks:
+            excess = self.size - self.max_bytes
+            head = self.chunks[0]
+            if len(head) <= excess:
+                self.chunks.popleft()
+                self.size -= len(head)
+                self.dropped += len(head)
+            else:
+                self.chunks[0] = head[excess:]
+                self.size -= excess
+                self.dropped += excess
+
+    def text(self) -> str:
+        text = b"".join(self.chunks).decode("utf-8", errors="replace")
+        if self.dropped:
+            return f"[... {self.dropped} earlier bytes dropped ...]\n{text}"
+        return text
+
+
+def clean_output(text: str) -> list:
+    """
+    Output lines without ANSI codes, progress-bar redraws (only the text
+    after the last carriage return of a line is what the terminal shows)
+    or blank lines
+    """
+    lines = []
+    for line in _ANSI.sub("", text).split("\n"):
+        line = line.rsplit("\r", 1)[-1].rstrip()
+        if line.strip():
+            lines.append(line)
+    return lines
+
+
+def _excerpt(code_lines: list, lineno: int) -> str:
+    start, end = max(lineno - 2, 1), min(lineno + 1, len(code_lines))
+    return "".join(
+        f"\n  {'>' if n == lineno else ' '} {n} | {code_lines[n - 1].rstrip()}"
+        for n in range(start, end + 1)
+    )
+
+
+def extract_error(output: str, code: str, code_file: Optional[str] = None) -> str:
+    """
+    Compact error for a failed render: the final exception line, the deepest
+    frame inside the scene code (line number and function) and an excerpt
+    of the code around it. Falls back to the last lines of output when no
+    Python traceback is present.
+    """
+    lines = clean_output(output)
+    start = max((i for i, line in enumerate(lines) if "Traceback (most recent call last)" in line), default=None)
+    if start is None:
+        return "\n".join(lines[-ERROR_TAIL_LINES:]) or "Render failed without output"
+
+    traceback_lines = [_BOX.sub("", line) for line in lines[start + 1:]]
+    frame = None
+    exception = None
+    for line in traceback_lines:
+        match = _PLAIN_FRAME.search(line) or _RICH_FRAME.search(line)
+        if match and (code_file is None or os.path.basename(match["file"]) == os.path.basename(code_file)):
+            frame = match
+        elif _EXCEPTION.match(line):
+            exception = line
+    if exception is None:
+        # Exceptions without a conventional name: take the last line
+        exception = traceback_lines[-1] if traceback_lines else lines[-1]
+
+    message = exception.strip()
+    if frame is not None:
+        lineno = int(frame["line"])
+        code_lines = code.rstrip("\n").split("\n")
+        message += f"\n(line {lineno}, in {frame['func']})"
+        if 0 < lineno <= len(code_lines):
+            message += _excerpt(code_lines, lineno)
+    return message
@@ -0,0 +1,62 @@
+import json
+from typing import Optional
+
+FORMATS = ("mp4", "webm", "gif")
+ENCODE_PRESETS = ("fast", "balanced", "quality")
+
+# Named profiles; a custom profile overrides these defaults field by field
+DEFAULT_PROFILE = {"height": 1080, "fps": 60, "max_duration": None, "format": "mp4", "preset": "balanced"}
+PROFILES = {
+    "thumbnail": {"height": 240, "fps": 12, "max_duration": 6, "format": "gif", "preset": "fast"},
+    "mobile": {"height": 480, "fps": 30, "max_duration": None, "format": "mp4", "preset": "fast"},
+    "web": {"height": 720, "fps": 30, "max_duration": None, "format": "webm", "preset": "balanced"},
+    "hd": DEFAULT_PROFILE,
+}
+
+# Manim's frame is 16:9 (frame_height 8, frame_width 14.22); other aspect
+# ratios would crop the scene, so a profile only picks the height
+ASPECT_RATIO = 16 / 9
+
+# Encoder settings per preset for the formats re-encoded with ffmpeg:
+# libvpx-vp9 -deadline/-cpu-used and the GIF palette dithering. MP4 is
+# Manim's own encode, which has no preset setting.
+VP9_SPEED = {"fast": ("realtime", "8"), "balanced": ("good", "5"), "quality": ("good", "2")}
+GIF_DITHER = {"fast": "none", "balanced": "bayer:bayer_scale=3", "quality": "sierra2_4a"}
+
+
+def resolve_profile(profile) -> Optional[dict]:
+    """
+    Complete profile for a profile name or a dict of overrides, or None
+    for None (the default quality ladder). Raises ValueError for unknown
+    names, formats or presets.
+    """
+    if profile is None:
+        return None
+    if isinstance(profile, str):
+        if profile not in PROFILES:
+            raise ValueError(f"Unknown render profile: {profile}")
+        return dict(PROFILES[profile])
+    resolved = dict(DEFAULT_PROFILE)
+    resolved.update({key: value for key, value in profile.items() if key in DEFAULT_PROFILE})
+    if resolved["format"] not in FORMATS:
+        raise ValueError(f"Unsupported output format: {resolved['format']}")
+    if resolved["preset"] not in ENCODE_PRESETS:
+        raise ValueError(f"Unknown encode preset: {resolved['preset']}")
+    return resolved
+
+
+def profile_key(profile: dict) -> str:
+    """Canonical form of a resolved profile, for cache keys"""
+    return json.dumps(profile, sort_keys=True, separators=(",", ":"))
+
+
+def dimensions(profile: dict) -> tuple:
+    """(pixel width, pixel height), both even as the video encoders require"""
+    height = profile["height"] - profile["height"] % 2
+    width = round(height * ASPECT_RATIO)
+    return width - width % 2, height
+
+
+def needs_encode(profile: dict) -> bool:
+    """Whether Manim's MP4 has to be re-encoded or trimmed for this profile"""
+    return profile["format"] != "mp4" or profile["max_duration"] is not None
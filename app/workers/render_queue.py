@@ -0,0 +1,367 @@
+"""
+Durable render queue shared by API processes and standalone render workers
+(see app.workers.render_worker).
+
+The API side enqueues a render task and waits for its result; workers
+claim tasks under a lease, renew it with heartbeats while rendering (which
+also appends the render's progress events to the task's event log) and
+publish the result dict. A task whose worker stops heartbeating is handed
+to another worker, up to RENDER_QUEUE_MAX_ATTEMPTS claims.
+"""
+import os
+import abc
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+WORKSPACE_ROOT = Path(__file__).parent.parent.parent.absolute()
+# "pool" renders on the API process's own worker pool; "queue" sends renders
+# to standalone workers through RENDER_QUEUE_URL
+RENDER_BACKEND = os.getenv("RENDER_BACKEND", "pool")
+RENDER_QUEUE_URL = os.getenv("RENDER_QUEUE_URL", f"sqlite:///{WORKSPACE_ROOT / 'app' / 'render-queue.db'}")
+RENDER_QUEUE_LEASE_SECONDS = float(os.getenv("RENDER_QUEUE_LEASE_SECONDS", "60"))
+RENDER_QUEUE_MAX_ATTEMPTS = int(os.getenv("RENDER_QUEUE_MAX_ATTEMPTS", "3"))
+RENDER_QUEUE_POLL_INTERVAL = float(os.getenv("RENDER_QUEUE_POLL_INTERVAL", "0.25"))
+# Finished tasks are deleted after this long
+RENDER_QUEUE_TTL_SECONDS = int(os.getenv("RENDER_QUEUE_TTL_SECONDS", "3600"))
+
+# queued -> leased -> done | failed | cancelled; an expired lease goes back to queued
+FINISHED = ("done", "failed", "cancelled")
+
+
+class RenderQueue(abc.ABC):
+    """
+    Interface of a queue backend. Tasks are dicts with at least id, status,
+    payload, result, error and attempts; each has an append-only log of
+    progress events.
+    """
+    @abc.abstractmethod
+    def put(self, payload: dict, priority: int = 0) -> str:
+        """Enqueue a task; lower priority values are claimed first. Returns its id."""
+
+    @abc.abstractmethod
+    def get(self, task_id: str):
+        """The task, or None if there is no such task"""
+
+    @abc.abstractmethod
+    def claim(self, worker: str, lease: float = RENDER_QUEUE_LEASE_SECONDS):
+        """Lease the next task to `worker`, or return None if there is none"""
+
+    @abc.abstractmethod
+    def heartbeat(self, task_id: str, worker: str, lease: float = RENDER_QUEUE_LEASE_SECONDS,
+                  events: list = None) -> bool:
+        """
+        Extend the lease and append `events` to the task's event log. False
+        if the worker no longer holds the task or its cancellation was
+        requested.
+        """
+
+    @abc.abstractmethod
+    def holds(self, task_id: str, worker: str) -> bool:
+        """
+        Whether `worker` still holds the task and no cancellation was
+        requested; a read, cheap enough to check on every worker poll
+        """
+
+    @abc.abstractmethod
+    def events(self, task_id: str, after: int = 0) -> list:
+        """(seq, event) pairs of the task's event log after `after`, in order"""
+
+    @abc.abstractmethod
+    def finish(self, task_id: str, worker: str, status: str, result: dict = None, error: str = None,
+               events: list = None) -> bool:
+        """
+        Publish the outcome of a leased task, after its last `events`; False
+        if the lease was lost meanwhile
+        """
+
+    @abc.abstractmethod
+    def release(self, task_id: str, worker: str, error: str):
+        """
+        Give back a leased task whose render crashed: it is queued again,
+        or failed with `error` once it has had max_attempts claims
+        """
+
+    @abc.abstractmethod
+    def cancel(self, task_id: str):
+        """Cancel a queued task, or ask the worker holding it to stop"""
+
+    @abc.abstractmethod
+    def prune(self, ttl: float = RENDER_QUEUE_TTL_SECONDS) -> int:
+        """Delete tasks finished more than `ttl` seconds ago; returns how many"""
+
+
+class SQLiteQueue(RenderQueue):
+    """
+    Queue backend in one SQLite database (WAL mode). Every process that opens
+    the same file shares the queue, so workers on one node, or on several
+    nodes with a filesystem that supports SQLite locking, can consume it.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tasks (
+            id TEXT PRIMARY KEY,
+            priority INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            result TEXT,
+            error TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            worker TEXT,
+            lease_expires REAL,
+            cancel_requested INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS tasks_by_status ON tasks (status, priority, created_at);
+        CREATE TABLE IF NOT EXISTS task_events (
+            task_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            event TEXT NOT NULL,
+            PRIMARY KEY (task_id, seq)
+        );
+    """
+
+    def __init__(self, path: str, max_attempts: int = RENDER_QUEUE_MAX_ATTEMPTS):
+        self.path = Path(path)
+        self.max_attempts = max_attempts
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # One connection per process, shared by its threads under a lock
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), timeout=30, isolation_level=None,
+                                   check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(self.SCHEMA)
+
+    def _transaction(self, fn):
+        """Run fn(connection) in a write transaction"""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                value = fn(self._db)
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+            return value
+
+    @staticmethod
+    def _task(row):
+        if row is None:
+            return None
+        task = dict(row)
+        for field in ("payload", "result"):
+            if task[field] is not None:
+                task[field] = json.loads(task[field])
+        return task
+
+    def put(self, payload: dict, priority: int = 0) -> str:
+        task_id = uuid.uuid4().hex
+        now = time.time()
+        self._transaction(lambda db: db.execute(
+            "INSERT INTO tasks (id, priority, status, payload, created_at, updated_at) "
+            "VALUES (?, ?, 'queued', ?, ?, ?)",
+            (task_id, priority, json.dumps(payload), now, now)
+        ))
+        return task_id
+
+    def get(self, task_id: str):
+        with self._lock:
+            row = self._db.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
+        return self._task(row)
+
+    def claim(self, worker: str, lease: float = RENDER_QUEUE_LEASE_SECONDS):
+        def claim(db):
+            now = time.time()
+            # Workers that stopped heartbeating lose their tasks
+            expired = db.execute(
+                "SELECT id, attempts, worker, cancel_requested FROM tasks "
+                "WHERE status = 'leased' AND lease_expires < ?", (now,)
+            ).fetchall()
+            for row in expired:
+                if row["cancel_requested"]:
+                    db.execute("UPDATE tasks SET status = 'cancelled', updated_at = ? WHERE id = ?",
+                               (now, row["id"]))
+                elif row["attempts"] >= self.max_attempts:
+                    db.execute(
+                        "UPDATE tasks SET status = 'failed', error = ?, updated_at = ? WHERE id = ?",
+                        (f"Render worker lost {row['attempts']} times (last: {row['worker']})", now, row["id"])
+                    )
+                else:
+                    logger.warning(f"Lease on render task {row['id']} held by {row['worker']} expired; requeueing")
+                    db.execute("UPDATE tasks SET status = 'queued', worker = NULL, updated_at = ? WHERE id = ?",
+                               (now, row["id"]))
+
+            row = db.execute(
+                "SELECT * FROM tasks WHERE status = 'queued' ORDER BY priority, created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE tasks SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1, "
+                "updated_at = ? WHERE id = ?",
+                (worker, now + lease, now, row["id"])
+            )
+            task = self._task(row)
+            task.update(status="leased", worker=worker, attempts=row["attempts"] + 1)
+            return task
+        return self._transaction(claim)
+
+    def heartbeat(self, task_id: str, worker: str, lease: float = RENDER_QUEUE_LEASE_SECONDS,
+                  events: list = None) -> bool:
+        def heartbeat(db):
+            now = time.time()
+            updated = db.execute(
+                "UPDATE tasks SET lease_expires = ?, updated_at = ? "
+                "WHERE id = ? AND worker = ? AND status = 'leased' AND cancel_requested = 0",
+                (now + lease, now, task_id, worker)
+            )
+            if updated.rowcount != 1:
+                return False
+            self._append_events(db, task_id, events)
+            return True
+        return self._transaction(heartbeat)
+
+    @staticmethod
+    def _append_events(db, task_id: str, events: list):
+        if not events:
+            return
+        last = db.execute("SELECT COALESCE(MAX(seq), 0) FROM task_events WHERE task_id = ?",
+                          (task_id,)).fetchone()[0]
+        db.executemany(
+            "INSERT INTO task_events (task_id, seq, event) VALUES (?, ?, ?)",
+            [(task_id, last + index, json.dumps(event)) for index, event in enumerate(events, 1)]
+        )
+
+    def holds(self, task_id: str, worker: str) -> bool:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT 1 FROM tasks WHERE id = ? AND worker = ? AND status = 'leased' AND cancel_requested = 0",
+                (task_id, worker)
+            ).fetchone()
+        return row is not None
+
+    def events(self, task_id: str, after: int = 0) -> list:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT seq, event FROM task_events WHERE task_id = ? AND seq > ? ORDER BY seq",
+                (task_id, after)
+            ).fetchall()
+        return [(row["seq"], json.loads(row["event"])) for row in rows]
+
+    def finish(self, task_id: str, worker: str, status: str, result: dict = None, error: str = None,
+               events: list = None) -> bool:
+        def finish(db):
+            updated = db.execute(
+                "UPDATE tasks SET status = ?, result = ?, error = ?, lease_expires = NULL, updated_at = ? "
+                "WHERE id = ? AND worker = ? AND status = 'leased'",
+                (status, json.dumps(result) if result is not None else None, error, time.time(), task_id, worker)
+            )
+            if updated.rowcount != 1:
+                return False
+            self._append_events(db, task_id, events)
+            return True
+        return self._transaction(finish)
+
+    def release(self, task_id: str, worker: str, error: str):
+        # The claim already counted the attempt; a task that keeps crashing
+        # its workers must not be retried forever
+        self._transaction(lambda db: db.execute(
+            "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, "
+            "error = CASE WHEN attempts >= ? THEN ? ELSE error END, "
+            "worker = NULL, lease_expires = NULL, updated_at = ? "
+            "WHERE id = ? AND worker = ? AND status = 'leased'",
+            (self.max_attempts, self.max_attempts, error, time.time(), task_id, worker)
+        ))
+
+    def cancel(self, task_id: str):
+        def cancel(db):
+            now = time.time()
+            db.execute("UPDATE tasks SET status = 'cancelled', updated_at = ? WHERE id = ? AND status = 'queued'",
+                       (now, task_id))
+            # A worker holding the task notices on its next poll
+            db.execute("UPDATE tasks SET cancel_requested = 1, updated_at = ? WHERE id = ? AND status = 'leased'",
+                       (now, task_id))
+        self._transaction(cancel)
+
+    def prune(self, ttl: float = RENDER_QUEUE_TTL_SECONDS) -> int:
+        placeholders = ",".join("?" * len(FINISHED))
+        def prune(db):
+            deleted = db.execute(
+                f"DELETE FROM tasks WHERE status IN ({placeholders}) AND updated_at < ?",
+                (*FINISHED, time.time() - ttl)
+            ).rowcount
+            if deleted:
+                db.execute("DELETE FROM task_events WHERE task_id NOT IN (SELECT id FROM tasks)")
+            return deleted
+        return self._transaction(prune)
+
+    def counts(self) -> dict:
+        """Number of tasks per status"""
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) AS n FROM tasks GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+
+# URL scheme -> backend factory; other backends (e.g. Redis) register here.
+# SQLite URLs take a relative path after three slashes, an absolute one after four.
+BACKENDS = {
+    "sqlite": lambda url: SQLiteQueue(url.path[1:]),
+}
+
+
+def open_queue(url: str = RENDER_QUEUE_URL) -> RenderQueue:
+    """Open the queue backend for a URL such as sqlite:////var/lib/manim/queue.db"""
+    parsed = urlparse(url)
+    factory = BACKENDS.get(parsed.scheme)
+    if factory is None:
+        raise ValueError(f"Unsupported render queue URL: {url}")
+    return factory(parsed)
+
+
+async def render_remote(queue: RenderQueue, payload: dict, priority: int = 0,
+                        progress=None, cancel=None) -> dict:
+    """
+    Enqueue a render and wait for a worker to publish its result dict.
+    Progress events the worker publishes are put on `progress`, every one
+    of them however many heartbeats pass between polls; setting `cancel`
+    (or cancelling the caller) cancels the task.
+    """
+    loop = asyncio.get_running_loop()
+    task_id = await loop.run_in_executor(None, queue.put, payload, priority)
+    seen = 0
+
+    def poll():
+        # The task first: events logged before it finished are then all visible
+        task = queue.get(task_id)
+        return task, queue.events(task_id, seen) if progress is not None else []
+
+    try:
+        while True:
+            await asyncio.sleep(RENDER_QUEUE_POLL_INTERVAL)
+            task, events = await loop.run_in_executor(None, poll)
+            if task is None:
+                raise RuntimeError(f"Render task {task_id} disappeared from the queue")
+            for seen, event in events:
+                progress.put(event)
+            if task["status"] == "done":
+                return task["result"]
+            if task["status"] == "failed":
+                return {"success": False, "error": task["error"], "output": None, "video_path": None}
+            if task["status"] == "cancelled" or (cancel is not None and cancel.is_set()):
+                await loop.run_in_executor(None, queue.cancel, task_id)
+                return {"success": False, "error": "Render cancelled", "output": None,
+                        "video_path": None, "cancelled": True}
+    except asyncio.CancelledError:
+        await loop.run_in_executor(None, queue.cancel, task_id)
+        raise
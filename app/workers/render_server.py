@@ -0,0 +1,284 @@
+import os
+import sys
+import time
+import signal
+import logging
+import selectors
+import traceback
+import subprocess
+import importlib.util
+from pathlib import Path
+
+from app.workers import profiling
+from app.workers.render_limits import close_inherited_locks
+from app.workers.render_output import OutputBuffer, RENDER_OUTPUT_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+# Map manim CLI quality flags onto config.quality names
+QUALITY_FLAGS = {
+    "-ql": "low_quality",
+    "-qm": "medium_quality",
+    "-qh": "high_quality",
+    "-qp": "production_quality",
+    "-qk": "fourk_quality",
+}
+
+PREFORK_SUPPORTED = hasattr(os, "fork")
+# Pipes can only be multiplexed with selectors on POSIX
+STREAMING_SUPPORTED = os.name == "posix"
+
+# How often a running render checks whether it has been cancelled
+CANCEL_POLL_INTERVAL = 0.5
+
+
+class RenderCancelled(Exception):
+    """Raised when a render is stopped because its request was abandoned"""
+
+_warm = False
+
+
+def warm_up():
+    """
+    Import manim and its heavy dependencies once so every forked render
+    child starts with them already loaded. Used as the render pool initializer.
+    """
+    global _warm
+    if _warm:
+        return
+    start = time.monotonic()
+    import manim  # noqa: F401
+    _warm = True
+    logger.info(f"Render worker {os.getpid()} warmed up in {time.monotonic() - start:.2f}s")
+
+
+def _render_in_child(code_file: Path, media_dir: str, quality_flag: str, animations=None,
+                     video_dir: str = None, overrides: dict = None):
+    """
+    Render Scene0 from code_file inside the current (forked) process,
+    mirroring what `manim <quality> --media_dir <dir> <file> Scene0` does.
+    `animations` optionally limits the render to an inclusive (first, last)
+    range of animation numbers, like the CLI's `-n first,last`; `video_dir`
+    overrides where the finished Scene0.mp4 is written. `overrides` are
+    config values applied on top of the quality (pixel_width, frame_rate...).
+    """
+    from manim import config
+
+    config.media_dir = media_dir
+    if video_dir is not None:
+        config.video_dir = video_dir
+    config.quality = QUALITY_FLAGS[quality_flag]
+    for key, value in (overrides or {}).items():
+        setattr(config, key, value)
+    config.input_file = str(code_file)
+    config.scene_names = ["Scene0"]
+    if animations is not None:
+        config.from_animation_number, config.upto_animation_number = animations
+
+    spec = importlib.util.spec_from_file_location(code_file.stem, code_file)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[code_file.stem] = module
+    spec.loader.exec_module(module)
+
+    scene_class = getattr(module, "Scene0", None)
+    if scene_class is None:
+        raise AttributeError(f"{code_file.name} does not define Scene0")
+    scene_class().render()
+
+
+class ForkedRender:
+    """
+    A render child forked from this warm process. Has the same contract as
+    running the manim CLI under Popen.communicate: wait() returns
+    (returncode, stdout, stderr) and raises subprocess.TimeoutExpired after
+    killing the child if it runs longer than `timeout` seconds.
+    """
+    def __init__(self, code_file: Path, media_dir: str, quality_flag: str, cwd: str, animations=None,
+                 video_dir: str = None, profile: Path = None, overrides: dict = None, limits=None):
+        warm_up()
+        self.label = f"render {code_file} Scene0"
+        self.limits = limits
+
+        out_r, out_w = os.pipe()
+        err_r, err_w = os.pipe()
+        pid = os.fork()
+
+        if pid == 0:
+            # Child: isolate output, render, and never return into the parent's code
+            exit_code = 1
+            try:
+                # Own process group, so a kill also reaches LaTeX and ffmpeg
+                os.setpgid(0, 0)
+                # Locks of renders running alongside (CPU slots, asset views) stay with the parent
+                close_inherited_locks()
+                if limits is not None:
+                    limits.apply()
+                os.close(out_r)
+                os.close(err_r)
+                os.dup2(out_w, 1)
+                os.dup2(err_w, 2)
+                os.chdir(cwd)
+                args = (Path(code_file), media_dir, quality_flag, animations, video_dir, overrides)
+                if profile is not None and profiling.RENDER_PROFILER == "cprofile":
+                    profiling.run_profiled(profile, _render_in_child, *args)
+                else:
+                    _render_in_child(*args)
+                exit_code = 0
+            except SystemExit as e:
+                exit_code = e.code if isinstance(e.code, int) else 1
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                try:
+                    sys.stdout.flush()
+                    sys.stderr.flush()
+                finally:
+                    os._exit(exit_code)
+
+        try:
+            # Also from this side, so kill() never races the child's setpgid
+            os.setpgid(pid, pid)
+        except OSError:
+            pass  # the child got there first, or has already exited
+        os.close(out_w)
+        os.close(err_w)
+        self.pid = pid
+        self.out_fd = out_r
+        self.err_fd = err_r
+        self.reaped = False
+        self.profiler = None
+        if profile is not None and profiling.RENDER_PROFILER == "py-spy":
+            self.profiler = profiling.attach_py_spy(pid, profile)
+
+    def kill(self):
+        # Never signal a pid that has been reaped and may have been reused
+        if not self.reaped:
+            kill_group(self.pid, self.limits)
+
+    def wait(self, timeout: float, on_stderr=None, cancel=None):
+        """Collect output until the child exits; see read_output for `on_stderr` and `cancel`"""
+        try:
+            stdout, stderr = read_output(self.out_fd, self.err_fd, timeout, self.kill,
+                                         on_stderr, cancel, label=self.label)
+        finally:
+            # Reap the child whether it exited or was killed
+            _, status = os.waitpid(self.pid, 0)
+            self.reaped = True
+            if self.limits is not None:
+                self.limits.release()
+            if self.profiler is not None:
+                # py-spy writes its output once the target is gone
+                try:
+                    self.profiler.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    self.profiler.kill()
+        return os.waitstatus_to_exitcode(status), stdout, stderr
+
+
+class CliRender:
+    """
+    A render running as a `manim` CLI subprocess, with the same wait()
+    contract as ForkedRender.
+    """
+    def __init__(self, cmd: list, cwd: str, env: dict, limits=None):
+        self.label = " ".join(cmd)
+        self.limits = limits
+        # Without selectors on pipes (Windows) fall back to communicate()
+        self.process = subprocess.Popen(
+            cmd,
+            cwd=cwd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=not STREAMING_SUPPORTED,
+            env=env,
+            start_new_session=STREAMING_SUPPORTED
+        )
+        if limits is not None:
+            # Applied from outside (preexec_fn is unsafe next to the segment
+            # threads); the interpreter is still starting up at this point
+            try:
+                limits.apply(self.process.pid)
+            except ProcessLookupError:
+                pass
+            except Exception:
+                self.kill()
+                self.process.wait()
+                raise
+
+    def kill(self):
+        if not STREAMING_SUPPORTED:
+            self.process.kill()
+        elif self.process.returncode is None:
+            kill_group(self.process.pid, self.limits)
+
+    def wait(self, timeout: float, on_stderr=None, cancel=None):
+        if not STREAMING_SUPPORTED:
+            stdout, stderr = self.process.communicate(timeout=timeout)
+            return self.process.returncode, stdout[-RENDER_OUTPUT_MAX_BYTES:], stderr[-RENDER_OUTPUT_MAX_BYTES:]
+        try:
+            stdout, stderr = read_output(
+                self.process.stdout.fileno(), self.process.stderr.fileno(), timeout,
+                self.kill, on_stderr, cancel, label=self.label
+            )
+        finally:
+            self.process.wait()
+            if self.limits is not None:
+                self.limits.release()
+        return self.process.returncode, stdout, stderr
+
+
+def kill_group(pgid: int, limits=None):
+    """SIGKILL a render's process group: the render and everything it started"""
+    if limits is not None:
+        limits.kill(pgid)
+        return
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def read_output(out_fd: int, err_fd: int, timeout: float, kill, on_stderr=None,
+                cancel=None, label: str = "render"):
+    """
+    Read a render process's stdout and stderr pipes until both close.
+
+    `on_stderr` receives stderr text as it arrives (used for progress
+    reporting). If `timeout` expires `kill` is called and
+    subprocess.TimeoutExpired raised; if the `cancel` event gets set `kill`
+    is called and RenderCancelled raised. Returns (stdout, stderr), each
+    limited to the last RENDER_OUTPUT_MAX_BYTES of the stream.
+    """
+    chunks = {out_fd: OutputBuffer(), err_fd: OutputBuffer()}
+    deadline = time.monotonic() + timeout
+
+    with selectors.DefaultSelector() as selector:
+        selector.register(out_fd, selectors.EVENT_READ)
+        selector.register(err_fd, selectors.EVENT_READ)
+        try:
+            while selector.get_map():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    kill()
+                    raise subprocess.TimeoutExpired(
+                        label, timeout,
+                        output=chunks[out_fd].text(), stderr=chunks[err_fd].text()
+                    )
+                if cancel is not None and cancel.is_set():
+                    kill()
+                    raise RenderCancelled(f"{label} was cancelled")
+                for key, _ in selector.select(min(remaining, CANCEL_POLL_INTERVAL)):
+                    data = os.read(key.fd, 65536)
+                    if data:
+                        chunks[key.fd].append(data)
+                        if key.fd == err_fd and on_stderr is not None:
+                            on_stderr(data.decode("utf-8", errors="replace"))
+                    else:
+                        selector.unregister(key.fd)
+                        os.close(key.fd)
+        finally:
+            for fd in list(selector.get_map()):
+                selector.unregister(fd)
+                os.close(fd)
+
+    return chunks[out_fd].text(), chunks[err_fd].text()
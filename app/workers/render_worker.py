@@ -0,0 +1,154 @@
+"""
+Standalone render worker. Claims render tasks from the durable queue and
+renders them on a local process pool:
+
+    python -m app.workers.render_worker --concurrency 4
+
+Run any number of these, on any node that shares the queue and the video
+directory, with RENDER_BACKEND=queue on the API nodes.
+"""
+import os
+import time
+import queue
+import signal
+import socket
+import logging
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from dotenv import load_dotenv
+
+# Load environment variables before the app modules read their settings
+load_dotenv()
+
+from app.log_config import configure_logging
+from app.workers.manim_worker import run_manim_code, init_render_worker, RENDER_MODE
+from app.workers.segments import count_animations, plan_segments
+from app.workers.render_queue import (
+    open_queue, RENDER_QUEUE_URL, RENDER_QUEUE_LEASE_SECONDS, RENDER_QUEUE_POLL_INTERVAL
+)
+
+logger = logging.getLogger(__name__)
+
+# Minimum seconds between pruning finished tasks
+PRUNE_INTERVAL = 60
+
+
+class RenderWorker:
+    """
+    Keeps up to `concurrency` render slots busy with leased tasks; a long
+    scene takes idle slots for its parallel segments. Every poll it
+    forwards render progress, renews leases a few times per lease period
+    and publishes finished results with their last progress. A task whose
+    cancellation was requested (or whose lease was lost) has its render
+    killed, noticed within a poll.
+    """
+    def __init__(self, render_queue, concurrency: int, worker_id: str,
+                 lease: float = RENDER_QUEUE_LEASE_SECONDS):
+        self.queue = render_queue
+        self.concurrency = concurrency
+        self.worker_id = worker_id
+        self.lease = lease
+        self.running = {}
+        self.stopping = False
+
+    def stop(self, *_):
+        if not self.stopping:
+            logger.info(f"Worker {self.worker_id} draining {len(self.running)} renders")
+        self.stopping = True
+
+    def run(self, pool, manager):
+        last_prune = 0.0
+        while not (self.stopping and not self.running):
+            while not self.stopping and self._busy() < self.concurrency:
+                task = self.queue.claim(self.worker_id, self.lease)
+                if task is None:
+                    break
+                self._start(task, pool, manager)
+            for task_id in list(self.running):
+                self._tend(task_id)
+            if time.monotonic() - last_prune > PRUNE_INTERVAL:
+                last_prune = time.monotonic()
+                self.queue.prune()
+            time.sleep(RENDER_QUEUE_POLL_INTERVAL)
+
+    def _busy(self) -> int:
+        return sum(state["slots"] for state in self.running.values())
+
+    def _start(self, task: dict, pool, manager):
+        payload = task["payload"]
+        logger.info(f"Rendering task {task['id']} (attempt {task['attempts']})")
+        progress, cancel = manager.Queue(), manager.Event()
+        wanted = len(plan_segments(count_animations(payload["code"])))
+        slots = max(1, min(wanted, self.concurrency - self._busy()))
+        future = pool.submit(run_manim_code, payload["code"], progress, cancel,
+                             tuple(payload["qualities"]), payload.get("lineage"), payload.get("profile"),
+                             payload.get("deadline"), slots)
+        self.running[task["id"]] = {
+            "future": future, "progress": progress, "cancel": cancel, "renewed": time.monotonic(),
+            "slots": slots
+        }
+
+    def _tend(self, task_id: str):
+        state = self.running[task_id]
+        done = state["future"].done()
+        if state["cancel"].is_set() and not done:
+            return  # stopping; its events go out with the result
+        events = []
+        while True:
+            try:
+                events.append(state["progress"].get_nowait())
+            except queue.Empty:
+                break
+        if not done:
+            if events or time.monotonic() - state["renewed"] > self.lease / 3:
+                held = self.queue.heartbeat(task_id, self.worker_id, self.lease, events)
+                if held:
+                    state["renewed"] = time.monotonic()
+            else:
+                held = self.queue.holds(task_id, self.worker_id)
+            if not held:
+                logger.info(f"Task {task_id} was cancelled or reassigned; stopping its render")
+                state["cancel"].set()
+            return
+        del self.running[task_id]
+        try:
+            result = state["future"].result()
+        except Exception as e:
+            # The pool itself failed (e.g. a worker process died); another attempt may succeed
+            logger.error(f"Task {task_id} crashed the render pool: {str(e)}")
+            self.queue.release(task_id, self.worker_id, f"Render crashed the worker pool: {str(e)}")
+            self.stop()
+            return
+        status = "cancelled" if result.get("cancelled") else "done"
+        if not self.queue.finish(task_id, self.worker_id, status, result, events=events):
+            logger.warning(f"Lost the lease on task {task_id} before publishing its result")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render worker consuming the durable render queue")
+    parser.add_argument("--queue", default=RENDER_QUEUE_URL, help="queue URL (default RENDER_QUEUE_URL)")
+    parser.add_argument("--concurrency", type=int,
+                        default=int(os.getenv("RENDER_WORKERS", str(os.cpu_count() or 2))),
+                        help="renders at once (default RENDER_WORKERS)")
+    parser.add_argument("--worker-id", default=f"{socket.gethostname()}-{os.getpid()}")
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    worker = RenderWorker(open_queue(args.queue), args.concurrency, args.worker_id)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+
+    pool = ProcessPoolExecutor(max_workers=args.concurrency, initializer=init_render_worker)
+    manager = multiprocessing.Manager()
+    logger.info(f"Render worker {args.worker_id}: {args.concurrency} x {RENDER_MODE} renders from {args.queue}")
+    try:
+        worker.run(pool, manager)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+        manager.shutdown()
+
+
+if __name__ == "__main__":
+    main()
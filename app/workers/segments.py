@@ -0,0 +1,73 @@
+import os
+import ast
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on parallel segments per render, and the fewest animations
+# worth giving their own process
+RENDER_SEGMENTS = int(os.getenv("RENDER_SEGMENTS", "4"))
+MIN_SEGMENT_ANIMATIONS = int(os.getenv("MIN_SEGMENT_ANIMATIONS", "3"))
+
+# Scene methods that each advance Manim's animation counter by one
+ANIMATION_METHODS = {"play", "wait", "pause", "wait_until"}
+
+
+def count_animations(code: str) -> Optional[int]:
+    """
+    Number of animations Scene0 plays, when it can be known statically.
+
+    Only scenes whose play()/wait() calls are all plain statements directly
+    in construct() qualify; calls inside loops, conditionals or helpers make
+    the count data dependent and return None.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+
+    scene = next(
+        (node for node in tree.body if isinstance(node, ast.ClassDef) and node.name == "Scene0"),
+        None
+    )
+    construct = scene and next(
+        (node for node in scene.body if isinstance(node, ast.FunctionDef) and node.name == "construct"),
+        None
+    )
+    if construct is None:
+        return None
+
+    def is_animation(node) -> bool:
+        return (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                and node.func.attr in ANIMATION_METHODS)
+
+    top_level = sum(
+        1 for statement in construct.body
+        if isinstance(statement, ast.Expr) and is_animation(statement.value)
+    )
+    anywhere = sum(1 for node in ast.walk(tree) if is_animation(node))
+    if top_level != anywhere:
+        return None
+    return top_level
+
+
+def plan_segments(count: Optional[int], max_segments: int = RENDER_SEGMENTS,
+                  min_animations: int = MIN_SEGMENT_ANIMATIONS) -> list:
+    """
+    Split `count` animations into contiguous inclusive (first, last) ranges.
+    Returns an empty list when the scene is not worth splitting.
+    """
+    if not count or max_segments < 2:
+        return []
+    segments = min(max_segments, count // max(min_animations, 1))
+    if segments < 2:
+        return []
+
+    ranges = []
+    first = 0
+    for index in range(segments):
+        size = count // segments + (1 if index < count % segments else 0)
+        ranges.append((first, first + size - 1))
+        first += size
+    return ranges
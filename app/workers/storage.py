@@ -0,0 +1,106 @@
+import os
+import time
+import errno
+import shutil
+import logging
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Minimum seconds between directory scans for quota enforcement in one process
+QUOTA_CHECK_INTERVAL = float(os.getenv("QUOTA_CHECK_INTERVAL", "30"))
+
+
+def touch(path: Path):
+    """
+    Record an access by bumping the file's atime (mtime is left alone).
+    Done explicitly because relatime/noatime mounts do not do it for us.
+    """
+    try:
+        stat = os.stat(path)
+        os.utime(path, ns=(time.time_ns(), stat.st_mtime_ns))
+    except FileNotFoundError:
+        pass
+
+
+def place_file(source: Path, destination: Path):
+    """
+    Move a finished file into place atomically. A rename when both paths are
+    on one filesystem; otherwise copied next to the destination first.
+    """
+    try:
+        os.replace(source, destination)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        partial = destination.with_name(f".{destination.name}.{os.getpid()}.part")
+        shutil.copy2(source, partial)
+        os.replace(partial, destination)
+        os.unlink(source)
+
+
+class StorageQuota:
+    """
+    Byte and file-count quota for a directory of generated files, enforced
+    by deleting the least recently accessed files (by atime, see `touch`).
+    Hidden files (in-progress writes) are never counted or evicted.
+    `on_evict`, if given, is called with the path of every evicted file.
+    """
+    def __init__(self, directory: Path, max_bytes: int, max_files: int,
+                 check_interval: float = QUOTA_CHECK_INTERVAL, on_evict=None):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.check_interval = check_interval
+        self.on_evict = on_evict
+        self._last_check = 0.0
+
+    def usage(self):
+        """(path, size, atime) of every file under quota"""
+        files = []
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return files
+        for entry in entries:
+            if entry.name.startswith(".") or not entry.is_file(follow_symlinks=False):
+                continue
+            try:
+                stat = entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            files.append((Path(entry.path), stat.st_size, stat.st_atime))
+        return files
+
+    def enforce(self, force: bool = False) -> int:
+        """
+        Evict least recently accessed files until the directory is within
+        quota. Scans at most once per check_interval unless `force`.
+        Returns the number of files removed.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_check < self.check_interval:
+            return 0
+        self._last_check = now
+
+        files = self.usage()
+        total_bytes = sum(size for _, size, _ in files)
+        total_files = len(files)
+        if total_bytes <= self.max_bytes and total_files <= self.max_files:
+            return 0
+
+        removed = 0
+        for path, size, _ in sorted(files, key=lambda f: f[2]):
+            if total_bytes <= self.max_bytes and total_files <= self.max_files:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                continue
+            if self.on_evict is not None:
+                self.on_evict(path)
+            total_bytes -= size
+            total_files -= 1
+            removed += 1
+        logger.info(f"Evicted {removed} files from {self.directory} to stay within quota")
+        return removed
@@ -0,0 +1,135 @@
+import os
+import ast
+import builtins
+import logging
+from pathlib import Path
+from typing import Optional
+
+from app.workers.render_cache import MANIM_VERSION
+
+logger = logging.getLogger(__name__)
+
+# Builtins a scene never needs and that could escape the sandbox
+DISALLOWED_NAMES = {
+    "__import__", "breakpoint", "compile", "delattr", "eval", "exec", "exit",
+    "getattr", "globals", "help", "input", "locals", "memoryview", "open",
+    "quit", "setattr", "vars",
+}
+
+# Attributes used to reach interpreter internals from ordinary objects
+DISALLOWED_ATTRIBUTES = {
+    "__bases__", "__builtins__", "__class__", "__closure__", "__code__",
+    "__dict__", "__globals__", "__import__", "__loader__", "__mro__",
+    "__subclasses__", "f_back", "f_globals", "f_locals", "gi_frame",
+}
+
+# Importing manim takes seconds and the API may run without it (queue
+# backend), so render workers, which import it anyway, write the symbol
+# index here and every other process reads it
+MANIM_SYMBOLS_FILE = Path(os.getenv(
+    "MANIM_SYMBOLS_FILE",
+    str(Path(__file__).parent.parent.parent.absolute() / "app" / "manim-symbols" / f"{MANIM_VERSION}.txt")
+))
+
+_manim_index = None
+
+
+def manim_symbols():
+    """
+    Names exported by `from manim import *` as indexed by a render worker,
+    or None until one has. Read once per process.
+    """
+    global _manim_index
+    if _manim_index is None:
+        try:
+            _manim_index = frozenset(MANIM_SYMBOLS_FILE.read_text().split())
+        except FileNotFoundError:
+            return None
+    return _manim_index or None
+
+
+def index_manim_symbols():
+    """Import manim and write its symbol index, unless already written"""
+    global _manim_index
+    if MANIM_SYMBOLS_FILE.exists():
+        return
+    try:
+        import manim
+    except Exception as e:
+        logger.warning(f"Cannot index manim symbols, skipping symbol check: {str(e)}")
+        return
+    exported = getattr(manim, "__all__", None) or dir(manim)
+    _manim_index = frozenset(name for name in exported if not name.startswith("_"))
+    MANIM_SYMBOLS_FILE.parent.mkdir(parents=True, exist_ok=True)
+    partial = MANIM_SYMBOLS_FILE.with_name(f".{MANIM_SYMBOLS_FILE.name}.{os.getpid()}")
+    partial.write_text("\n".join(sorted(_manim_index)))
+    os.replace(partial, MANIM_SYMBOLS_FILE)
+
+
+def _excerpt(lines, lineno: Optional[int]) -> str:
+    if not lineno or lineno > len(lines):
+        return ""
+    return f"\n    {lineno} | {lines[lineno - 1].strip()}"
+
+
+def _bound_names(tree: ast.AST) -> set:
+    """Every name the code binds anywhere (assignments, defs, arguments, imports...)"""
+    bound = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            bound.add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            bound.add(node.name)
+        elif isinstance(node, ast.arg):
+            bound.add(node.arg)
+        elif isinstance(node, ast.alias):
+            bound.add((node.asname or node.name).split(".")[0])
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            bound.add(node.name)
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            bound.update(node.names)
+    return bound
+
+
+def validate_manim_code(code: str) -> Optional[str]:
+    """
+    Static pre-flight check of sanitized scene code.
+
+    Returns None if the code looks renderable, otherwise a precise error
+    message (with line number and excerpt) suitable for the repair prompt.
+    """
+    lines = code.split("\n")
+
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        return f"SyntaxError: {e.msg} (line {e.lineno}){_excerpt(lines, e.lineno)}"
+
+    scene = next(
+        (node for node in tree.body if isinstance(node, ast.ClassDef) and node.name == "Scene0"),
+        None
+    )
+    if scene is None:
+        return "No class named Scene0 is defined; define `class Scene0(Scene)` with a construct() method"
+    base_names = {base.id if isinstance(base, ast.Name) else getattr(base, "attr", "")
+                  for base in scene.bases}
+    if not any(name.endswith("Scene") for name in base_names):
+        return f"Scene0 must subclass Scene (line {scene.lineno}){_excerpt(lines, scene.lineno)}"
+    if not any(isinstance(node, ast.FunctionDef) and node.name == "construct" for node in scene.body):
+        return f"Scene0 has no construct() method (line {scene.lineno}){_excerpt(lines, scene.lineno)}"
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id in DISALLOWED_NAMES:
+            return f"Use of '{node.id}' is not allowed (line {node.lineno}){_excerpt(lines, node.lineno)}"
+        if isinstance(node, ast.Attribute) and node.attr in DISALLOWED_ATTRIBUTES:
+            return f"Access to attribute '{node.attr}' is not allowed (line {node.lineno}){_excerpt(lines, node.lineno)}"
+
+    symbols = manim_symbols()
+    if symbols is not None:
+        known = _bound_names(tree) | symbols | set(dir(builtins))
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load) and node.id not in known:
+                return (f"NameError: name '{node.id}' is not defined and is not exported by manim "
+                        f"(line {node.lineno}){_excerpt(lines, node.lineno)}")
+
+    return None
@@ -0,0 +1,178 @@
+"""
+Representative scenes used by the LLM stub and the load driver.
+
+Each scene has the prompt a user would type, code that renders, and a
+broken variant of that code the stub can return to exercise the repair
+path. `broken` fails in different places on purpose: some are caught by
+the static validator, others only fail inside Manim.
+"""
+
+SCENES = [
+    {
+        "name": "circle_to_square",
+        "prompt": "A circle that transforms into a square",
+        "code": """from manim import *
+
+class Scene0(Scene):
+    def construct(self):
+        circle = Circle(color=BLUE)
+        square = Square(color=GREEN)
+        self.play(Create(circle))
+        self.play(Transform(circle, square))
+        self.wait()
+""",
+        "broken": """from manim import *
+
+class Scene0(Scene):
+    def construct(self):
+        circle = Circle(color=BLUE)
+        square = Square(color=GREEN)
+        self.play(Creat(circle))
+        self.play(Transform(circle, square))
+        self.wait()
+""",
+    },
+    {
+        "name": "pythagoras",
+        "prompt": "The Pythagoras theorem visualized geometrically",
+        "code": """from manim import *
+
+class Scene0(Scene):
+    def construct(self):
+        triangle = Polygon([0, 0, 0], [3, 0, 0], [0, 2, 0], color=WHITE)
+        a_square = Square(side_length=3, color=BLUE).next_to(triangle, DOWN, buff=0)
+        b_square = Square(side_length=2, color=RED).next_to(triangle, LEFT, buff=0)
+        formula = MathTex("a^2 + b^2 = c^2").to_edge(UP)
+        self.play(Create(triangle))
+        self.play(FadeIn(a_square), FadeIn(b_square))
+        self.play(Write(formula))
+        self.wait()
+""",
+        "broken": """from manim import *
+
+class Scene0(Scene):
+    def construct(self):
+        triangle = Polygon([0, 0, 0], [3, 0, 0], [0, 2, 0], color=WHITE)
+        a_square = Square(side_length=3, color=BLUE).next_to(triangle, DOWN, buff=0)
+        formula = MathTex("a^2 + b^2 = c^2").to_edge(UP)
+        self.play(Create(triangle))
+        self.play(FadeIn(a_square, b_square))
+        self.play(Write(formula))
+""",
+    },
+    {
+        "name": "sine_wave",
+        "prompt": "Plot a sine wave on axes and trace a dot along it",
+        "code": """from manim import *
+
+class Scene0(Scene):
+    def construct(self):
+        axes = Axes(x_range=[0, 7, 1], y_range=[-1.5, 1.5, 0.5])
+        graph = axes.plot(lambda x: np.sin(x), color=YELLOW)
+        dot = Dot(axes.c2p(0, 0), color=RED)
+        self.play(Create(axes))
+        self.play(Create(graph))
+        self.play(MoveAlongPath(dot, graph), run_time=3)
+        self.wait()
+""",
+        "broken": """from manim import *
+
+class Scene0(Scene):
+    def construct(self):
+        axes = Axes(x_range=[0, 7, 1], y_range=[-1.5, 1.5, 0.5])
+        graph = axes.plot(lambda x: np.sin(x), color=YELLOW)
+        dot = Dot(axes.c2p(0, 0), color=RED)
+        self.play(Create(axes))
+        self.play(Create(graph))
+        self.play(MoveAlongPath(dot, graph, run_time="3"))
+""",
+    },
+    {
+        "name": "rotating_square",
+        "prompt": "A square rotating while changing colour",
+        "code": """from manim import *
+
+class Scene0(Scene):
+    def construct(self):
+        square = Square(side_length=2, color=BLUE, fill_opacity=0.5)
+        self.play(FadeIn(square))
+        self.play(Rotate(square, angle=PI), square.animate.set_color(ORANGE))
+        self.play(Rotate(square, angle=PI), square.animate.set_color(PURPLE))
+        self.wait()
+""",
+        "broken": """from manim import *
+
+class Scene0(Scene)
+    def construct(self):
+        square = Square(side_length=2, color=BLUE, fill_opacity=0.5)
+        self.play(FadeIn(square))
+""",
+    },
+    {
+        "name": "number_line",
+        "prompt": "Show counting from 0 to 5 on a number line",
+        "code": """from manim import *
+
+class Scene0(Scene):
+    def construct(self):
+        line = NumberLine(x_range=[0, 5, 1], include_numbers=True)
+        pointer = Triangle(fill_opacity=1).scale(0.15).rotate(PI).next_to(line.n2p(0), UP)
+        self.play(Create(line))
+        self.play(FadeIn(pointer))
+        self.play(pointer.animate.next_to(line.n2p(1), UP))
+        self.play(pointer.animate.next_to(line.n2p(2), UP))
+        self.play(pointer.animate.next_to(line.n2p(3), UP))
+        self.play(pointer.animate.next_to(line.n2p(4), UP))
+        self.play(pointer.animate.next_to(line.n2p(5), UP))
+        self.wait()
+""",
+        "broken": """from manim import *
+
+class Scene0(Scene):
+    def construct(self):
+        line = NumberLine(x_range=[0, 5, 1], include_numbers=True)
+        self.play(Create(line))
+        self.play(line.animate.shift(UP).scale("2"))
+""",
+    },
+    {
+        "name": "title_card",
+        "prompt": "A title card that writes 'Linear Algebra' and fades out",
+        "code": """from manim import *
+
+class Scene0(Scene):
+    def construct(self):
+        title = Text("Linear Algebra", font_size=72)
+        underline = Underline(title, color=YELLOW)
+        self.play(Write(title))
+        self.play(Create(underline))
+        self.wait()
+        self.play(FadeOut(title), FadeOut(underline))
+""",
+        "broken": """from manim import *
+
+class Scene0(Scene):
+    def construct(self):
+        title = Text("Linear Algebra", font_size=72)
+        self.play(Write(title))
+        self.play(FadeOut(titel))
+""",
+    },
+]
+
+
+def find_scene(text: str):
+    """The corpus scene whose prompt appears in `text`, or None"""
+    for scene in SCENES:
+        if scene["prompt"].lower() in text.lower():
+            return scene
+    return None
+
+
+def find_by_code(code: str):
+    """The corpus scene that `code` (good or broken) belongs to, or None"""
+    code = code.strip()
+    for scene in SCENES:
+        if code in (scene["code"].strip(), scene["broken"].strip()):
+            return scene
+    return None
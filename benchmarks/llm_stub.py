@@ -0,0 +1,144 @@
+"""
+Local stand-in for OpenRouter's chat completions API.
+
+Answers with canned Manim code from the corpus after a configurable delay,
+optionally returning a broken variant first so the app's repair call
+(`fix_manim_code`) is exercised. Supports `"stream": true` with SSE chunks.
+
+    python -m benchmarks.llm_stub --port 8100 --latency 1.5 --broken-rate 0.3
+
+Point the app at it with OPENROUTER_URL=http://127.0.0.1:8100/api/v1/chat/completions
+"""
+import time
+import json
+import random
+import asyncio
+import hashlib
+import argparse
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from benchmarks.corpus import SCENES, find_scene, find_by_code
+
+app = FastAPI(title="OpenRouter stub")
+
+settings = {
+    "latency": 1.0,
+    "jitter": 0.2,
+    "broken_rate": 0.0,
+    "chunk_chars": 24,
+    "chunk_delay": 0.02,
+}
+stats = {"requests": 0, "repairs": 0, "revisions": 0, "broken": 0}
+
+
+def _pick_code(messages: list, variant: str = "") -> str:
+    """
+    Choose the reply for a conversation: a repair, a broken first try, or good
+    code. `variant` (temperature, choice index) varies the draw between candidates.
+    """
+    last = messages[-1]["content"]
+
+    if last.startswith("Here is the traceback"):
+        stats["repairs"] += 1
+        previous = next((m["content"] for m in reversed(messages) if m["role"] == "assistant"), "")
+        scene = find_by_code(previous) or SCENES[0]
+        return scene["code"]
+
+    if last.startswith("Revise this scene"):
+        stats["revisions"] += 1
+        previous = next((m["content"] for m in reversed(messages) if m["role"] == "assistant"), "")
+        return previous or SCENES[0]["code"]
+
+    scene = find_scene(last)
+    if scene is None:
+        # Unknown prompt: map it onto a corpus scene deterministically
+        digest = int(hashlib.sha256(last.encode("utf-8")).hexdigest(), 16)
+        scene = SCENES[digest % len(SCENES)]
+
+    # Seeded by the prompt so a given run is reproducible
+    if random.Random(f"{last}|{variant}").random() < settings["broken_rate"]:
+        stats["broken"] += 1
+        return scene["broken"]
+    return scene["code"]
+
+
+def _usage(messages: list, code: str) -> dict:
+    # Roughly four characters per token
+    prompt_tokens = sum(len(m["content"]) for m in messages) // 4
+    completion_tokens = len(code) // 4
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+async def _delay():
+    await asyncio.sleep(max(0.0, random.gauss(settings["latency"], settings["jitter"])))
+
+
+@app.post("/api/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    stats["requests"] += 1
+    variant = str(body.get("temperature", ""))
+    code = _pick_code(body["messages"], variant)
+    completion_id = f"stub-{stats['requests']}"
+
+    if body.get("stream"):
+        async def stream():
+            await _delay()
+            yield ": OPENROUTER PROCESSING\n\n"
+            size = settings["chunk_chars"]
+            for start in range(0, len(code), size):
+                chunk = {
+                    "id": completion_id,
+                    "choices": [{"index": 0, "delta": {"content": code[start:start + size]}}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(settings["chunk_delay"])
+            usage = {"id": completion_id, "choices": [], "usage": _usage(body["messages"], code)}
+            yield f"data: {json.dumps(usage)}\n\n"
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    await _delay()
+    return JSONResponse({
+        "id": completion_id,
+        "created": int(time.time()),
+        "model": body.get("model"),
+        "choices": [
+            {"index": index, "message": {"role": "assistant", "content": choice}, "finish_reason": "stop"}
+            for index, choice in enumerate(
+                [code] + [_pick_code(body["messages"], f"{variant}|{i}") for i in range(1, body.get("n", 1))]
+            )
+        ],
+        "usage": _usage(body["messages"], code),
+    })
+
+
+@app.get("/stats")
+async def get_stats():
+    return stats
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", type=float, default=settings["latency"], help="mean seconds before answering")
+    parser.add_argument("--jitter", type=float, default=settings["jitter"], help="standard deviation of the latency")
+    parser.add_argument("--broken-rate", type=float, default=settings["broken_rate"],
+                        help="fraction of first answers that return broken code")
+    args = parser.parse_args()
+
+    settings.update(latency=args.latency, jitter=args.jitter, broken_rate=args.broken_rate)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
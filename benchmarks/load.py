@@ -0,0 +1,297 @@
+"""
+Load driver for the generation API.
+
+Sends `--requests` generations at a fixed `--concurrency` and reports
+latency percentiles, throughput and a per-stage breakdown.
+
+Against a running server:
+
+    python -m benchmarks.load --url http://127.0.0.1:8000 --requests 50 --concurrency 8
+
+Comparing worker configurations (starts the LLM stub and one app server
+per configuration, each with the given environment overrides):
+
+    python -m benchmarks.load --requests 40 --concurrency 8 \\
+        --config RENDER_WORKERS=2 --config RENDER_WORKERS=4,MANIM_RENDER_MODE=cli
+
+Modes:
+  jobs    POST /api/generate and poll /api/jobs/{id}; stages are queue wait and run time
+  stream  POST /api/generate/stream; stages come from the SSE stage events
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import asyncio
+import argparse
+import subprocess
+from pathlib import Path
+from collections import defaultdict
+
+import httpx
+
+from benchmarks.corpus import SCENES
+
+ROOT = Path(__file__).resolve().parent.parent
+POLL_INTERVAL = 0.2
+
+
+def percentile(values: list, pct: float) -> float:
+    """Nearest-rank percentile of `values` (0 when empty)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+def _prompt(index: int) -> str:
+    # A unique suffix keeps the prompt cache from answering every request
+    scene = SCENES[index % len(SCENES)]
+    return f"{scene['prompt']} (bench {uuid.uuid4().hex[:8]})"
+
+
+async def _run_job(client: httpx.AsyncClient, prompt: str, progressive: bool) -> dict:
+    response = await client.post("/api/generate", json={"prompt": prompt, "progressive": progressive})
+    if response.status_code != 202:
+        return {"ok": False, "error": f"HTTP {response.status_code}", "stages": {}}
+    job = response.json()
+    while job["status"] in ("queued", "running"):
+        await asyncio.sleep(POLL_INTERVAL)
+        job = (await client.get(f"/api/jobs/{job['id']}")).json()
+
+    stages = {}
+    if job.get("started_at"):
+        stages["queued"] = job["started_at"] - job["created_at"]
+        if job.get("finished_at"):
+            stages["running"] = job["finished_at"] - job["started_at"]
+    result = job.get("result") or {}
+    return {
+        "ok": bool(result.get("success")),
+        "error": result.get("error") or job.get("error"),
+        "stages": stages,
+    }
+
+
+async def _run_stream(client: httpx.AsyncClient, prompt: str, progressive: bool) -> dict:
+    stages = defaultdict(float)
+    current, since = "connecting", time.perf_counter()
+    outcome = {"ok": False, "error": "stream ended without a result"}
+
+    def enter(stage: str):
+        nonlocal current, since
+        now = time.perf_counter()
+        stages[current] += now - since
+        current, since = stage, now
+
+    async with client.stream("POST", "/api/generate/stream",
+                             json={"prompt": prompt, "progressive": progressive}) as response:
+        if response.status_code != 200:
+            return {"ok": False, "error": f"HTTP {response.status_code}", "stages": {}}
+        event = None
+        async for line in response.aiter_lines():
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                data = json.loads(line[len("data: "):])
+                if event == "job":
+                    enter("queued")
+                elif event == "stage":
+                    # Split rendering time by quality flag (preview vs HD)
+                    enter(" ".join(filter(None, (data["stage"], data.get("quality")))))
+                elif event == "result":
+                    outcome = {"ok": bool(data.get("success")), "error": data.get("error")}
+                elif event == "error":
+                    outcome = {"ok": False, "error": data.get("detail")}
+    enter("done")
+    outcome["stages"] = dict(stages)
+    return outcome
+
+
+async def run_load(url: str, requests: int, concurrency: int, mode: str, progressive: bool) -> dict:
+    """Drive `requests` generations through `concurrency` workers and summarize them"""
+    run_one = _run_stream if mode == "stream" else _run_job
+    pending = iter(range(requests))
+    samples = []
+
+    async def worker(client: httpx.AsyncClient):
+        for index in pending:
+            start = time.perf_counter()
+            try:
+                sample = await run_one(client, _prompt(index), progressive)
+            except httpx.HTTPError as e:
+                sample = {"ok": False, "error": f"{type(e).__name__}: {e}", "stages": {}}
+            sample["latency"] = time.perf_counter() - start
+            samples.append(sample)
+
+    limits = httpx.Limits(max_connections=concurrency * 2)
+    async with httpx.AsyncClient(base_url=url, timeout=httpx.Timeout(600.0), limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return summarize(samples, elapsed)
+
+
+def summarize(samples: list, elapsed: float) -> dict:
+    latencies = [s["latency"] for s in samples]
+    ok = [s for s in samples if s["ok"]]
+    stage_times = defaultdict(list)
+    for sample in samples:
+        for stage, seconds in sample["stages"].items():
+            stage_times[stage].append(seconds)
+    errors = defaultdict(int)
+    for sample in samples:
+        if not sample["ok"]:
+            errors[(sample["error"] or "unknown").splitlines()[0][:80]] += 1
+
+    return {
+        "requests": len(samples),
+        "succeeded": len(ok),
+        "elapsed": elapsed,
+        "throughput": len(ok) / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "stages": {
+            stage: {"mean": sum(times) / len(times), "p95": percentile(times, 95)}
+            for stage, times in stage_times.items()
+        },
+        "errors": dict(errors),
+    }
+
+
+def print_report(name: str, summary: dict):
+    print(f"\n== {name} ==")
+    print(f"requests   {summary['succeeded']}/{summary['requests']} succeeded in {summary['elapsed']:.1f}s")
+    print(f"throughput {summary['throughput']:.2f} scenes/s")
+    print(f"latency    p50 {summary['p50']:.2f}s  p95 {summary['p95']:.2f}s  p99 {summary['p99']:.2f}s")
+    if summary["stages"]:
+        print("stages     mean / p95")
+        for stage, times in summary["stages"].items():
+            print(f"  {stage:<20} {times['mean']:7.2f}s {times['p95']:7.2f}s")
+    for error, count in summary["errors"].items():
+        print(f"  error x{count}: {error}")
+
+
+def print_comparison(results: list):
+    print("\n== comparison ==")
+    header = f"{'config':<40} {'ok':>7} {'tput/s':>8} {'p50':>7} {'p95':>7} {'p99':>7}"
+    print(header)
+    print("-" * len(header))
+    for name, s in results:
+        print(f"{name[:40]:<40} {s['succeeded']:>3}/{s['requests']:<3} {s['throughput']:>8.2f} "
+              f"{s['p50']:>6.2f}s {s['p95']:>6.2f}s {s['p99']:>6.2f}s")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _parse_config(text: str) -> dict:
+    overrides = {}
+    for pair in filter(None, text.split(",")):
+        key, _, value = pair.partition("=")
+        overrides[key.strip()] = value.strip()
+    return overrides
+
+
+async def _wait_ready(url: str, process: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"{url} exited with code {process.returncode}")
+            try:
+                response = await client.get(url)
+                if response.status_code < 500:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.25)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+
+
+async def compare(configs: list, args) -> list:
+    """Run the load once per configuration against freshly started servers"""
+    # Server logs would drown the report; --verbose passes them through
+    output = None if args.verbose else subprocess.DEVNULL
+    stub_port = _free_port()
+    stub = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.llm_stub", "--port", str(stub_port),
+         "--latency", str(args.llm_latency), "--broken-rate", str(args.broken_rate)],
+        cwd=ROOT,
+    )
+    results = []
+    try:
+        await _wait_ready(f"http://127.0.0.1:{stub_port}/stats", stub)
+        for text in configs:
+            overrides = _parse_config(text)
+            port = _free_port()
+            env = {
+                **os.environ,
+                "OPENROUTER_URL": f"http://127.0.0.1:{stub_port}/api/v1/chat/completions",
+                "OPENROUTER_API_KEY": "bench",
+                # Measure rendering, not cache hits
+                "RENDER_CACHE_ENABLED": "0",
+                # All load comes from one client address
+                "RATE_LIMIT_PER_MINUTE": "0",
+                **overrides,
+            }
+            server = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+                cwd=ROOT, env=env, stdout=output, stderr=output,
+            )
+            try:
+                url = f"http://127.0.0.1:{port}"
+                await _wait_ready(f"{url}/", server)
+                summary = await run_load(url, args.requests, args.concurrency, args.mode, args.progressive)
+            finally:
+                server.terminate()
+                try:
+                    server.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    server.kill()
+            name = text or "defaults"
+            print_report(name, summary)
+            results.append((name, summary))
+    finally:
+        stub.terminate()
+        stub.wait()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="base URL of a running server (omit to use --config)")
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--mode", choices=("jobs", "stream"), default="stream")
+    parser.add_argument("--progressive", action="store_true", help="request preview-first rendering")
+    parser.add_argument("--config", action="append", default=[],
+                        help="KEY=VAL[,KEY=VAL...] environment for one server run (repeatable)")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="mean stub LLM latency in seconds")
+    parser.add_argument("--broken-rate", type=float, default=0.2, help="fraction of stub answers needing repair")
+    parser.add_argument("--verbose", action="store_true", help="show the servers' logs")
+    parser.add_argument("--json", help="also write the summaries to this file")
+    args = parser.parse_args()
+
+    if args.url:
+        summary = asyncio.run(run_load(args.url, args.requests, args.concurrency, args.mode, args.progressive))
+        print_report(args.url, summary)
+        results = [(args.url, summary)]
+    else:
+        results = asyncio.run(compare(args.config or [""], args))
+        if len(results) > 1:
+            print_comparison(results)
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(dict(results), indent=2))
+
+
+if __name__ == "__main__":
+    main()
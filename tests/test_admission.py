@@ -0,0 +1,26 @@
+from types import SimpleNamespace
+
+from app.api import admission
+from app.api.admission import TokenBucket, client_id
+
+
+def _request(headers: dict, host: str = "10.0.0.1"):
+    return SimpleNamespace(headers=headers, client=SimpleNamespace(host=host))
+
+
+def test_unknown_api_keys_are_ignored(monkeypatch):
+    monkeypatch.setattr(admission, "API_KEYS", frozenset({"known"}))
+    assert client_id(_request({"x-api-key": "known"})) == "key:known"
+    assert client_id(_request({"x-api-key": "made-up"})) == "10.0.0.1"
+
+
+def test_forwarded_for_uses_the_proxy_appended_address(monkeypatch):
+    monkeypatch.setattr(admission, "TRUST_FORWARDED_FOR", True)
+    request = _request({"x-forwarded-for": "1.2.3.4, 203.0.113.7"})
+    assert client_id(request) == "203.0.113.7"
+
+
+def test_cost_above_capacity_is_admitted_once_then_paid_back():
+    bucket = TokenBucket(rate=1.0, capacity=5)
+    assert bucket.take(8) == 0
+    assert bucket.take(1) > 3
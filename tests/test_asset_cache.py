@@ -0,0 +1,66 @@
+import os
+import time
+from pathlib import Path
+
+from app.workers.asset_cache import AssetCache, TEX_DIR, TEXT_DIR
+
+
+def _compile(view: dict, name: str, used_before: bool = False):
+    """Do what Manim does for one expression: write its .tex, then its SVG unless present"""
+    tex_dir = Path(view["tex_dir"])
+    (tex_dir / f"{name}.tex").write_text(name)
+    if not used_before:
+        (tex_dir / f"{name}.svg").write_text(f"<svg>{name}</svg>")
+
+
+def test_views_are_private_while_rendering(tmp_path):
+    cache = AssetCache(tmp_path)
+    with cache.view() as first, cache.view() as second:
+        assert first["tex_dir"] != second["tex_dir"]
+        assert os.path.isdir(first["text_dir"])
+    with cache.view() as again:
+        assert again == first
+    assert AssetCache(tmp_path, enabled=False).view().__enter__() == {}
+
+
+def test_compiled_svgs_are_published_and_reused_by_other_views(tmp_path):
+    cache = AssetCache(tmp_path)
+    with cache.view() as view:
+        started = time.time()
+        _compile(view, "a")
+        assert cache.collect(view["tex_dir"], view["text_dir"], started) == (0, 1)
+    assert (cache.directory / TEX_DIR / "a.svg").read_text() == "<svg>a</svg>"
+
+    with cache.view() as busy, cache.view() as other:
+        # A view that never saw the cache is linked in full, once
+        assert (Path(other["tex_dir"]) / "a.svg").exists()
+        started = time.time()
+        _compile(other, "a", used_before=True)
+        _compile(other, "b")
+        assert cache.collect(other["tex_dir"], other["text_dir"], started) == (1, 1)
+        # The .tex files only mark what one render used
+        assert not list(Path(other["tex_dir"]).glob("*.tex"))
+
+    # The first view catches up from the journal
+    with cache.view() as view:
+        assert view == busy
+        assert sorted(os.listdir(view["tex_dir"])) == ["a.svg", "b.svg"]
+
+
+def test_evicted_entries_leave_the_views(tmp_path):
+    cache = AssetCache(tmp_path, max_files=1)
+    for kind in (TEX_DIR, TEXT_DIR):
+        cache.quotas[kind].check_interval = 0
+    with cache.view() as view:
+        started = time.time()
+        _compile(view, "a")
+        cache.collect(view["tex_dir"], view["text_dir"], started)
+    time.sleep(0.01)
+    with cache.view() as other, cache.view() as view:
+        started = time.time()
+        _compile(view, "b")
+        cache.collect(view["tex_dir"], view["text_dir"], started)
+    assert os.listdir(cache.directory / TEX_DIR) == ["b.svg"]
+    with cache.view() as view:
+        assert view == other
+        assert os.listdir(view["tex_dir"]) == ["b.svg"]
@@ -0,0 +1,36 @@
+import json
+import asyncio
+
+from app.api.batches import Batch
+
+
+def test_identical_prompts_are_generated_once():
+    batch = Batch("b", ["A circle", "a  circle ", "A square", "a circle"], progressive=False)
+    assert [(item.prompt, item.indices) for item in batch.items] == [("A circle", [0, 1, 3]), ("A square", [2])]
+    assert batch.summary() == {"batch": "b", "prompts": 4, "unique": 2, "completed": 0, "done": False}
+
+
+def test_readers_resume_with_finished_items_first():
+    async def scenario():
+        batch = Batch("b", ["one", "two", "three"], progressive=False)
+        first, second, third = batch.items
+
+        async def read():
+            return [json.loads(line) async for line in batch.lines()]
+
+        early = asyncio.ensure_future(read())
+        await asyncio.sleep(0)
+        for item in (second, first):
+            item.status = "completed"
+            await batch.finish(item)
+        # Attaching mid-way replays what finished, in completion order
+        late = asyncio.ensure_future(read())
+        await asyncio.sleep(0)
+        third.status = "failed"
+        await batch.finish(third)
+        return await early, await late
+
+    early, late = asyncio.run(scenario())
+    assert early[1:] == late[1:]
+    assert [line["prompt"] for line in early[1:]] == ["two", "one", "three"]
+    assert late[0]["completed"] == 2 and not late[0]["done"]
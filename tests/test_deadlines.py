@@ -0,0 +1,39 @@
+import time
+import contextvars
+
+import pytest
+
+from app import deadlines
+from app.deadlines import DeadlineExceeded, budget, current_deadline, deadline_after, fits, remaining
+from app.workers import manim_worker
+
+
+def test_deadline_is_capped():
+    assert deadline_after(10) == pytest.approx(time.time() + 10, abs=1)
+    assert deadline_after(10 ** 6) == pytest.approx(time.time() + deadlines.MAX_REQUEST_DEADLINE_SECONDS, abs=1)
+
+
+def test_stages_get_what_is_left():
+    assert remaining() is None and fits(10 ** 6)
+    assert budget(60, "llm") == 60
+
+    def with_deadline():
+        current_deadline.set(time.time() + 30)
+        assert remaining() == pytest.approx(30, abs=1)
+        assert fits(20) and not fits(40)
+        assert budget(60, "llm") == pytest.approx(30, abs=1)
+        assert budget(10, "llm") == 10
+
+    contextvars.copy_context().run(with_deadline)
+    with pytest.raises(DeadlineExceeded, match="during render"):
+        budget(60, "render", deadline=time.time() + deadlines.MIN_STAGE_SECONDS / 2)
+
+
+def test_render_attempts_keep_time_for_their_fallbacks(monkeypatch):
+    monkeypatch.setattr(manim_worker, "RENDER_MIN_SECONDS", 5)
+    monkeypatch.setattr(manim_worker, "RENDER_TIMEOUT", 300)
+    assert manim_worker._attempt_timeout(None, 1) == 300
+    assert manim_worker._attempt_timeout(time.time() + 20, 1) == pytest.approx(15, abs=1)
+    # Too little left for the first attempt: skipped, the fallback gets it all
+    assert manim_worker._attempt_timeout(time.time() + 8, 1) is None
+    assert manim_worker._attempt_timeout(time.time() + 8, 0) == pytest.approx(8, abs=1)
@@ -0,0 +1,150 @@
+import asyncio
+
+from app.workers.jobs import JobManager, QueueFullError
+
+
+def _manager(max_concurrent: int = 1, max_queued: int = 3) -> JobManager:
+    return JobManager(workers=1, lanes={"interactive": (max_concurrent, max_queued)},
+                      render_queue=object())
+
+
+def test_cancelled_queued_jobs_leave_the_queue():
+    async def scenario():
+        manager = _manager()
+        release = asyncio.Event()
+
+        async def block(job):
+            await release.wait()
+            return job.id
+
+        running = manager.submit("running", block)
+        await asyncio.sleep(0)
+        queued = [manager.submit(f"queued {i}", block) for i in range(3)]
+        await asyncio.sleep(0)
+        assert manager.queued("interactive") == 3
+        try:
+            manager.submit("one too many", block)
+        except QueueFullError:
+            pass
+        else:
+            raise AssertionError("the lane queue should be full")
+
+        for job in queued:
+            job.task.cancel()
+        await asyncio.wait({job.task for job in queued})
+
+        for job in queued:
+            assert job.status == "cancelled"
+            assert job.finished_at is not None
+            assert job.started_at is None
+        assert manager.queued("interactive") == 0
+        # The freed queue accepts new jobs again
+        later = manager.submit("later", block)
+
+        release.set()
+        await asyncio.wait({running.task, later.task})
+        assert running.status == "completed"
+        assert later.status == "completed"
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_running_job_is_marked_cancelled():
+    async def scenario():
+        manager = _manager()
+
+        async def forever(job):
+            await asyncio.Event().wait()
+
+        job = manager.submit("running", forever)
+        await asyncio.sleep(0)
+        assert job.status == "running"
+        job.task.cancel()
+        await asyncio.wait({job.task})
+        assert job.status == "cancelled"
+        assert job.finished_at >= job.started_at
+
+    asyncio.run(scenario())
+
+
+def test_channel_waits_for_the_result_after_the_last_event():
+    async def scenario():
+        manager = _manager()
+        channel = manager.channel()
+        release = asyncio.Event()
+
+        async def render():
+            channel.progress.put({"event": "progress", "percent": 50})
+            # Closed before the result is set, as the pool worker does
+            channel.progress.close()
+            await release.wait()
+            return {"success": True}
+
+        task = asyncio.ensure_future(render())
+        asyncio.get_running_loop().call_later(0.05, release.set)
+        events = [event async for event in channel.events(task)]
+        assert events == [{"event": "progress", "percent": 50}]
+        assert task.done() and task.result() == {"success": True}
+        channel.close()
+        assert manager._channels == {}
+
+    asyncio.run(scenario())
+
+
+def test_channel_ends_when_the_render_fails_without_closing_it():
+    async def scenario():
+        channel = _manager().channel()
+
+        async def render():
+            channel.progress.put({"event": "stage"})
+            raise RuntimeError("pool broke")
+
+        task = asyncio.ensure_future(render())
+        events = [event async for event in channel.events(task)]
+        assert events == [{"event": "stage"}]
+        assert isinstance(task.exception(), RuntimeError)
+
+    asyncio.run(scenario())
+
+
+def test_pool_channel_relays_events_from_other_threads():
+    async def scenario():
+        manager = JobManager(workers=1, lanes={"interactive": (1, 1)}, initializer=None)
+        channel = manager.channel()
+        try:
+            def render(progress):
+                for percent in (10, 60, 100):
+                    progress.put({"event": "progress", "percent": percent})
+                progress.close()
+                return "done"
+
+            task = asyncio.ensure_future(
+                asyncio.get_running_loop().run_in_executor(None, render, channel.progress)
+            )
+            events = [event async for event in channel.events(task)]
+            assert [event["percent"] for event in events] == [10, 60, 100]
+            assert task.result() == "done"
+        finally:
+            channel.close()
+            await manager.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_extra_render_slots_are_only_taken_when_idle():
+    async def scenario():
+        manager = JobManager(workers=1, lanes={"interactive": (4, 4)}, max_renders=3, initializer=None)
+        try:
+            async with manager.render_slots(4) as held:
+                assert held == 3
+                waiter = asyncio.ensure_future(manager.run_in_pool(int))
+                await asyncio.sleep(0)
+            # The waiting render is served first; a segmented one then gets what is left
+            assert await waiter == 0
+            async with manager.render_slots(2) as first:
+                async with manager.render_slots(4) as second:
+                    assert (first, second) == (2, 1)
+        finally:
+            await manager.shutdown()
+
+    asyncio.run(scenario())
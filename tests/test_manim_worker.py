@@ -0,0 +1,57 @@
+import threading
+
+from app.workers import manim_worker, validator
+
+
+def test_render_cancelled_before_it_starts_does_no_work(monkeypatch, tmp_path):
+    monkeypatch.setattr(manim_worker, "CODE_DIR", tmp_path / "code")
+    cancel = threading.Event()
+    cancel.set()
+    result = manim_worker.run_manim_code("from manim import *", cancel=cancel)
+    assert result["cancelled"]
+    assert not result["success"]
+    assert not (tmp_path / "code").exists()
+
+
+def _fake_render(rendered):
+    def render(code_file, media_dir, quality_flag, env, *args, **kwargs):
+        rendered.append(quality_flag)
+        video = manim_worker.output_path(media_dir)
+        video.parent.mkdir(parents=True, exist_ok=True)
+        video.write_bytes(quality_flag.encode())
+        return 0, "", ""
+    return render
+
+
+def test_render_degraded_by_the_deadline_is_not_cached(monkeypatch, tmp_path):
+    for name in ("VIDEO_DIR", "CODE_DIR", "STAGING_DIR"):
+        monkeypatch.setattr(manim_worker, name, tmp_path / name)
+    monkeypatch.setattr(manim_worker, "render_cache", manim_worker.RenderCache(tmp_path / "VIDEO_DIR", enabled=True))
+    monkeypatch.setattr(manim_worker, "FFMPEG_AVAILABLE", False)
+    monkeypatch.setattr(manim_worker, "preflight", lambda code, watch: (code, None))
+    rendered = []
+    monkeypatch.setattr(manim_worker, "_render", _fake_render(rendered))
+    # Too little time left for the first quality
+    monkeypatch.setattr(manim_worker, "_attempt_timeout", lambda deadline, fallbacks: None if fallbacks else 30)
+
+    qualities = ("-qh", "-ql")
+    result = manim_worker.run_manim_code("scene", qualities=qualities, deadline=0)
+    assert result["success"] and result["counts"]["deadline_skip"] == 1
+    key = manim_worker.render_cache.key("scene", ",".join(qualities))
+    assert manim_worker.render_cache.get(key) is None
+
+    # Unhurried, the full ladder renders and is cached
+    monkeypatch.setattr(manim_worker, "_attempt_timeout", lambda deadline, fallbacks: 30)
+    result = manim_worker.run_manim_code("scene", qualities=qualities)
+    assert rendered == ["-ql", "-qh"]
+    assert manim_worker.render_cache.get(key).read_bytes() == b"-qh"
+
+
+def test_symbol_check_uses_the_index_written_by_render_workers(monkeypatch, tmp_path):
+    monkeypatch.setattr(validator, "MANIM_SYMBOLS_FILE", tmp_path / "symbols.txt")
+    monkeypatch.setattr(validator, "_manim_index", None)
+    code = "from manim import *\n\nclass Scene0(Scene):\n    def construct(self):\n        self.play(Creat(Circle()))\n"
+    # Not indexed yet: only the worker's own check can catch unknown names
+    assert validator.validate_manim_code(code) is None
+    (tmp_path / "symbols.txt").write_text("Scene\nCircle\nCreate")
+    assert "'Creat'" in validator.validate_manim_code(code)
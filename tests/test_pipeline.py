@@ -0,0 +1,121 @@
+import asyncio
+import threading
+
+from app.api import pipeline
+from app.api.prompt_cache import PromptCache
+from app.metrics import Trace
+from app.workers import manim_worker
+from app.workers.jobs import Channel
+from app.workers.render_cache import RenderCache
+from app.workers.lineage import LineageStore
+
+
+def test_invalid_code_is_rejected_before_taking_a_render_slot(monkeypatch):
+    async def render(*args, **kwargs):
+        raise AssertionError("invalid code must not reach the render pool")
+
+    monkeypatch.setattr(pipeline.job_manager, "render", render)
+    result = asyncio.run(pipeline._render("print('no scene here')"))
+    assert not result["success"]
+    assert result["error"].startswith("Validation failed")
+    assert "validate" in result["timings"]
+
+
+def test_speculation_saves_the_winner_to_the_lineage(monkeypatch, tmp_path):
+    store = LineageStore(tmp_path)
+    monkeypatch.setattr(pipeline, "lineage_store", store)
+
+    async def generate(prompt, temperature=None):
+        return f"# temperature {temperature}"
+
+    async def render(code, emit=None, qualities=None, lineage=None, profile=None):
+        success = code.endswith("0.7")
+        return {"success": success, "error": None if success else "broken", "video_path": None}
+
+    monkeypatch.setattr(pipeline, "get_manim_code_from_llm", generate)
+    monkeypatch.setattr(pipeline, "_render", render)
+    code, result = asyncio.run(pipeline._speculate("a circle", 2, None, ("-ql",), lineage_id="scene"))
+    assert result["success"]
+    assert store.code("scene") == code == "# temperature 0.7"
+
+
+def test_cancelling_a_render_cancels_its_pool_task(monkeypatch):
+    async def scenario():
+        started = asyncio.Event()
+        cancelled = asyncio.Event()
+
+        async def render(code, progress, cancel, *args):
+            started.set()
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                assert cancel.is_set()
+                cancelled.set()
+                raise
+
+        monkeypatch.setattr(pipeline.job_manager, "render", render)
+        monkeypatch.setattr(pipeline.job_manager, "channel",
+                            lambda: Channel(pipeline.job_manager, 0, None, threading.Event()))
+        code = "from manim import *\nclass Scene0(Scene):\n    def construct(self):\n        pass\n"
+        task = asyncio.ensure_future(pipeline._render(code))
+        await started.wait()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        assert cancelled.is_set()
+
+    asyncio.run(scenario())
+
+
+def test_hd_upgrades_beyond_the_cap_are_skipped(monkeypatch, tmp_path):
+    monkeypatch.setattr(pipeline, "prompt_cache", PromptCache(tmp_path / "prompts"))
+    monkeypatch.setattr(pipeline, "lineage_store", LineageStore(tmp_path / "lineages"))
+    monkeypatch.setattr(pipeline, "MAX_PENDING_HD_UPGRADES", 1)
+
+    async def generate(prompt, temperature=None):
+        return f"# {prompt}"
+
+    async def render(code, emit=None, qualities=None, lineage=None, profile=None):
+        return {"success": True, "error": None, "video_path": "static/videos/preview.mp4"}
+
+    upgrades = []
+
+    def spawn(coro):
+        coro.close()
+        upgrades.append(asyncio.get_running_loop().create_future())
+        return upgrades[-1]
+
+    monkeypatch.setattr(pipeline, "get_manim_code_from_llm", generate)
+    monkeypatch.setattr(pipeline, "_render", render)
+    monkeypatch.setattr(pipeline.job_manager, "spawn", spawn)
+
+    async def scenario():
+        pipeline.current_trace.set(Trace("test"))
+        first = await pipeline._generate_scene("a", "a circle", None, True, 1, None, None)
+        second = await pipeline._generate_scene("b", "a square", None, True, 1, None, None)
+        upgrades[0].set_result(None)
+        await asyncio.sleep(0)
+        third = await pipeline._generate_scene("c", "a line", None, True, 1, None, None)
+        upgrades[-1].set_result(None)
+        await asyncio.sleep(0)
+        return first, second, third
+
+    first, second, third = asyncio.run(scenario())
+    assert (first.hd_status, second.hd_status, third.hd_status) == ("pending", "skipped", "pending")
+    assert second.preview_url == second.video_url == "/static/videos/preview.mp4"
+    assert not pipeline._hd_upgrades
+
+
+def test_cached_render_is_served_without_a_render_slot(monkeypatch, tmp_path):
+    cache = RenderCache(tmp_path, enabled=True)
+    monkeypatch.setattr(manim_worker, "render_cache", cache)
+
+    async def render(*args, **kwargs):
+        raise AssertionError("a cached render must not reach the render pool")
+
+    monkeypatch.setattr(pipeline.job_manager, "render", render)
+    code = "from manim import *\nclass Scene0(Scene):\n    def construct(self):\n        pass\n"
+    key = cache.key(code, ",".join(pipeline.PREVIEW_QUALITIES))
+    cache.path(key).write_bytes(b"video")
+    result = asyncio.run(pipeline._render(code, qualities=pipeline.PREVIEW_QUALITIES))
+    assert result["cached"] and result["video_path"] == f"static/videos/{key}.mp4"
+    assert "cache" in result["timings"]
@@ -0,0 +1,19 @@
+import os
+import time
+
+from app.api.prompt_cache import PromptCache
+
+
+def test_disk_tier_keeps_the_most_recently_used_entries(tmp_path):
+    cache = PromptCache(tmp_path, memory_entries=1, disk_entries=2)
+    cache.quota.check_interval = 0
+    cache.put("a circle", "circle")
+    cache.put("a square", "square")
+    past = time.time() - 60
+    os.utime(cache._path(cache.key("a circle")), (past, past))
+    os.utime(cache._path(cache.key("a square")), (past - 60, past - 60))
+    cache.put("a line", "line")
+    assert sorted(os.listdir(tmp_path)) == sorted(f"{cache.key(p)}.json" for p in ("a circle", "a line"))
+    # Memory holds only the last entry, so the circle comes from disk
+    assert PromptCache(tmp_path).get("A  Circle") == "circle"
+    assert cache.get("a square") is None
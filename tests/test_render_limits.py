@@ -0,0 +1,32 @@
+import os
+
+import pytest
+
+from app.workers import render_limits
+from app.workers.render_limits import open_lock, close_lock, close_inherited_locks
+
+
+@pytest.mark.skipif(render_limits.fcntl is None or not hasattr(os, "fork"), reason="needs flock and fork")
+def test_forked_child_does_not_keep_the_parents_locks(tmp_path):
+    path = tmp_path / "0.lock"
+    fd = open_lock(path)
+    ready_r, ready_w = os.pipe()
+    done_r, done_w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        close_inherited_locks()
+        os.write(ready_w, b"x")
+        os.read(done_r, 1)
+        os._exit(0)
+    try:
+        os.read(ready_r, 1)
+        close_lock(fd)
+        # Free although the child is still running
+        again = open_lock(path)
+        assert again is not None
+        close_lock(again)
+    finally:
+        os.write(done_w, b"x")
+        os.waitpid(pid, 0)
+        for end in (ready_r, ready_w, done_r, done_w):
+            os.close(end)
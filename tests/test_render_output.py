@@ -0,0 +1,60 @@
+from app.workers.render_output import OutputBuffer, extract_error
+
+CODE = """from manim import *
+
+class Scene0(Scene):
+    def construct(self):
+        circle = Circle()
+        self.play(Creat(circle))
+"""
+
+PLAIN = """Manim Community v0.18.0
+Traceback (most recent call last):
+  File "/usr/lib/python3/site-packages/manim/scene/scene.py", line 229, in render
+    self.construct()
+  File "/tmp/manim-code/scene_ab12.py", line 6, in construct
+    self.play(Creat(circle))
+NameError: name 'Creat' is not defined
+"""
+
+RICH = """\x1b[31m╭───────────────────── Traceback (most recent call last) ──────────────────────╮\x1b[0m
+│ /usr/lib/python3/site-packages/manim/cli/render/commands.py:115 in render    │
+│                                                                              │
+│ /tmp/manim-code/scene_ab12.py:6 in construct                                 │
+│                                                                              │
+│   5 │   │   circle = Circle()                                                │
+│ ❱ 6 │   │   self.play(Creat(circle))                                         │
+╰──────────────────────────────────────────────────────────────────────────────╯
+NameError: name 'Creat' is not defined
+"""
+
+
+def test_plain_traceback_points_at_the_scene_line():
+    error = extract_error(PLAIN, CODE, "scene_ab12.py")
+    lines = error.split("\n")
+    assert lines[0] == "NameError: name 'Creat' is not defined"
+    assert lines[1] == "(line 6, in construct)"
+    assert "> 6 |         self.play(Creat(circle))" in error
+    assert "manim/scene" not in error
+
+
+def test_rich_traceback_points_at_the_scene_line():
+    error = extract_error(RICH, CODE, "scene_ab12.py")
+    assert error.split("\n")[:2] == ["NameError: name 'Creat' is not defined", "(line 6, in construct)"]
+    assert "\x1b" not in error
+
+
+def test_output_without_traceback_falls_back_to_its_tail():
+    output = "\n".join(f"line {n}" for n in range(30)) + "\rprogress 50%\rprogress 100%\n"
+    error = extract_error(output, CODE)
+    assert error.split("\n")[-1] == "progress 100%"
+    assert "line 0" not in error
+    assert extract_error("", CODE) == "Render failed without output"
+
+
+def test_output_buffer_keeps_the_end():
+    buffer = OutputBuffer(max_bytes=10)
+    for chunk in (b"abcdef", b"ghijkl", b"mn"):
+        buffer.append(chunk)
+    assert buffer.size == 10
+    assert buffer.text() == "[... 4 earlier bytes dropped ...]\nefghijklmn"
@@ -0,0 +1,33 @@
+import pytest
+
+from app.workers.render_profiles import (
+    DEFAULT_PROFILE, PROFILES, resolve_profile, profile_key, dimensions, needs_encode
+)
+
+
+def test_named_and_custom_profiles():
+    assert resolve_profile(None) is None
+    assert resolve_profile("web") == PROFILES["web"]
+    assert resolve_profile("web") is not PROFILES["web"]
+    custom = resolve_profile({"height": 360, "format": "gif", "unknown": 1})
+    assert custom == {**DEFAULT_PROFILE, "height": 360, "format": "gif"}
+
+
+@pytest.mark.parametrize("profile", ["cinema", {"format": "avi"}, {"preset": "ultra"}])
+def test_invalid_profiles_are_rejected(profile):
+    with pytest.raises(ValueError):
+        resolve_profile(profile)
+
+
+def test_dimensions_are_even_and_16_by_9():
+    assert dimensions(PROFILES["hd"]) == (1920, 1080)
+    assert dimensions(PROFILES["thumbnail"]) == (426, 240)
+    assert dimensions({"height": 481}) == (852, 480)
+
+
+def test_profile_key_and_encoding():
+    assert profile_key(resolve_profile({"fps": 30})) == profile_key({**DEFAULT_PROFILE, "fps": 30})
+    assert profile_key(resolve_profile("mobile")) != profile_key(resolve_profile("hd"))
+    assert not needs_encode(PROFILES["hd"])
+    assert needs_encode(PROFILES["web"])
+    assert needs_encode({**DEFAULT_PROFILE, "max_duration": 5})
@@ -0,0 +1,85 @@
+import time
+import asyncio
+import threading
+from queue import Queue
+from concurrent.futures import Future
+
+import pytest
+
+from app.workers import render_queue
+from app.workers.render_queue import RenderQueue, SQLiteQueue, render_remote
+from app.workers.render_worker import RenderWorker
+
+
+def test_interface_cannot_be_instantiated():
+    with pytest.raises(TypeError):
+        RenderQueue()
+
+
+def test_released_crashes_count_until_the_task_fails(tmp_path):
+    queue = SQLiteQueue(tmp_path / "queue.db", max_attempts=2)
+    task_id = queue.put({"code": "x"})
+    for attempt in (1, 2):
+        task = queue.claim("worker")
+        assert task["id"] == task_id and task["attempts"] == attempt
+        queue.release(task_id, "worker", "pool crashed")
+    task = queue.get(task_id)
+    assert task["status"] == "failed"
+    assert task["error"] == "pool crashed"
+    assert queue.claim("worker") is None
+
+
+def test_progress_events_between_polls_are_kept(tmp_path):
+    queue = SQLiteQueue(tmp_path / "queue.db")
+    task_id = queue.put({"code": "x"})
+    queue.claim("worker")
+    assert queue.heartbeat(task_id, "worker", events=[{"n": 1}, {"n": 2}])
+    assert queue.heartbeat(task_id, "worker", events=[{"n": 3}])
+    assert [event["n"] for _, event in queue.events(task_id)] == [1, 2, 3]
+    assert queue.events(task_id, after=2) == [(3, {"n": 3})]
+
+
+def test_cancelled_remote_render_cancels_its_task(tmp_path, monkeypatch):
+    monkeypatch.setattr(render_queue, "RENDER_QUEUE_POLL_INTERVAL", 0.01)
+    queue = SQLiteQueue(tmp_path / "queue.db")
+
+    async def scenario():
+        waiter = asyncio.ensure_future(render_remote(queue, {"code": "x"}))
+        await asyncio.sleep(0.05)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+
+    asyncio.run(scenario())
+    assert queue.counts() == {"cancelled": 1}
+
+
+def _tended_task(queue, worker):
+    task = queue.claim(worker.worker_id)
+    state = {"future": Future(), "progress": Queue(), "cancel": threading.Event(), "renewed": time.monotonic(),
+             "slots": 1}
+    worker.running[task["id"]] = state
+    return task["id"], state
+
+
+def test_worker_publishes_the_last_events_with_the_result(tmp_path):
+    queue = SQLiteQueue(tmp_path / "queue.db")
+    queue.put({"code": "x"})
+    worker = RenderWorker(queue, 1, "worker")
+    task_id, state = _tended_task(queue, worker)
+    state["progress"].put({"n": 1})
+    state["future"].set_result({"success": True})
+    worker._tend(task_id)
+    assert queue.get(task_id)["status"] == "done"
+    assert queue.events(task_id) == [(1, {"n": 1})]
+
+
+def test_worker_stops_a_cancelled_render_on_its_next_poll(tmp_path):
+    queue = SQLiteQueue(tmp_path / "queue.db")
+    queue.put({"code": "x"})
+    worker = RenderWorker(queue, 1, "worker")
+    task_id, state = _tended_task(queue, worker)
+    worker._tend(task_id)
+    assert not state["cancel"].is_set()
+    queue.cancel(task_id)
+    worker._tend(task_id)
+    assert state["cancel"].is_set()
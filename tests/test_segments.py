@@ -0,0 +1,37 @@
+from app.workers.segments import count_animations, plan_segments
+
+SCENE = """from manim import *
+
+class Scene0(Scene):
+    def construct(self):
+        circle = Circle()
+        self.play(Create(circle))
+        self.wait()
+{body}
+"""
+
+
+def test_counts_top_level_animations():
+    assert count_animations(SCENE.format(body="        self.play(FadeOut(circle))")) == 3
+    assert count_animations(SCENE.format(body="")) == 2
+
+
+def test_data_dependent_animations_are_not_counted():
+    loop = "        for _ in range(3):\n            self.play(circle.animate.shift(UP))"
+    assert count_animations(SCENE.format(body=loop)) is None
+    helper = "        self.helper()\n\n    def helper(self):\n        self.wait()"
+    assert count_animations(SCENE.format(body=helper)) is None
+    assert count_animations("class Other(Scene):\n    def construct(self):\n        self.wait()") is None
+    assert count_animations("def broken(:") is None
+
+
+def test_segments_cover_every_animation_once():
+    assert plan_segments(10, max_segments=4, min_animations=3) == [(0, 3), (4, 6), (7, 9)]
+    assert plan_segments(12, max_segments=4, min_animations=3) == [(0, 2), (3, 5), (6, 8), (9, 11)]
+    assert plan_segments(100, max_segments=2, min_animations=3) == [(0, 49), (50, 99)]
+
+
+def test_short_or_unknown_scenes_are_not_split():
+    assert plan_segments(None) == []
+    assert plan_segments(5, max_segments=4, min_animations=3) == []
+    assert plan_segments(20, max_segments=1) == []
@@ -0,0 +1,84 @@
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from app.api.video_files import _parse_range, serve_video
+
+BODY = bytes(range(100))
+
+
+def test_parse_range():
+    assert _parse_range("bytes=0-9", 100) == (0, 9)
+    assert _parse_range("bytes=90-", 100) == (90, 99)
+    assert _parse_range("bytes=90-500", 100) == (90, 99)
+    assert _parse_range("bytes=-10", 100) == (90, 99)
+    assert _parse_range("bytes=-500", 100) == (0, 99)
+    # Served in full
+    assert _parse_range("bytes=0-1,5-6", 100) is None
+    assert _parse_range("items=0-1", 100) is None
+    assert _parse_range("bytes=-", 100) is None
+    for header in ("bytes=100-", "bytes=5-4", "bytes=-0"):
+        with pytest.raises(ValueError):
+            _parse_range(header, 100)
+
+
+@pytest.fixture
+def client(tmp_path):
+    path = tmp_path / "scene.mp4"
+    path.write_bytes(BODY)
+    app = FastAPI()
+
+    @app.get("/video")
+    async def video(request: Request):
+        return serve_video(path, request)
+
+    @app.get("/missing")
+    async def missing(request: Request):
+        return serve_video(tmp_path / "missing.mp4", request)
+
+    return TestClient(app)
+
+
+def test_full_and_partial_responses(client):
+    response = client.get("/video")
+    assert response.status_code == 200
+    assert response.content == BODY
+    assert response.headers["accept-ranges"] == "bytes"
+
+    response = client.get("/video", headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.content == BODY[10:20]
+    assert response.headers["content-range"] == "bytes 10-19/100"
+
+    response = client.get("/video", headers={"Range": "bytes=200-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == "bytes */100"
+
+    assert client.get("/missing").status_code == 404
+
+
+def test_conditional_requests(client):
+    etag = client.get("/video").headers["etag"]
+    assert client.get("/video", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/video", headers={"If-None-Match": '"other"'}).status_code == 200
+
+    # The range applies only while the client's copy is current
+    response = client.get("/video", headers={"Range": "bytes=0-9", "If-Range": etag})
+    assert response.status_code == 206
+    response = client.get("/video", headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+    assert response.status_code == 200
+    assert response.content == BODY
+
+
+def test_video_ids_resolve_every_output_format(monkeypatch, tmp_path):
+    from app.api import routes
+
+    monkeypatch.setattr(routes, "VIDEO_DIR", tmp_path)
+    (tmp_path / "preview.webm").write_bytes(BODY)
+    app = FastAPI()
+    app.include_router(routes.router, prefix="/api")
+    client = TestClient(app)
+    response = client.get("/api/videos/preview")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "video/webm"
+    assert client.get("/api/videos/other").status_code == 404